@@ -0,0 +1,684 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+性能基准脚本 - 对比优化前后的实现，并校验结果一致
+
+用法:
+    python benchmark.py jan_map [行数]
+    python benchmark.py pt_styles [店铺数] [SKU数]
+    python benchmark.py pt_stream [店铺数] [SKU数]
+    python benchmark.py store_items [店铺数]
+    python benchmark.py pt_parse [店铺数] [SKU数]
+    python benchmark.py full_package [店铺数] [SKU数]
+    python benchmark.py box_items [箱数] [每箱行数] [SKU数]
+    python benchmark.py box_labels [箱数]
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import multiprocessing
+from copy import copy
+
+import numpy as np
+import pandas as pd
+
+from openpyxl import load_workbook
+
+from config import (DetailTableConfig, AllocationConfig, AssortmentConfig, StoreDetailConfig, TemplateConfig,
+                    DeliveryNoteConfig)
+from excel_reader import DetailTableReader
+from template_writer import TemplateWriter
+from streaming_writer import StreamingTemplateWriter, StreamingStoreDetailWriter
+from store_detail_writer import StoreDetailWriter
+from assortment_generator import AssortmentGenerator
+from package_pipeline import AllocationPackageWriter, ShipmentPackageWriter, ZipPackage
+from template_cache import template_cache
+from pt_sheet_parser import read_pt_workbook, PTParseCache, pt_parse_cache
+from excel_reader import BoxSettingReader
+from box_label_generator import BoxLabelGenerator
+from delivery_note_generator import DeliveryNoteGenerator
+
+try:
+    import resource  # Windows上没有，峰值RSS显示为N/A
+except ImportError:
+    resource = None
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'templates')
+
+
+def _timeit(func, *args, repeat=3):
+    """运行多次，返回(最短耗时, 结果)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+# ---------------------------------------------------------------------------
+# 明细表 JAN 映射
+# ---------------------------------------------------------------------------
+
+def legacy_build_jan_map(df):
+    """优化前的逐行实现（iterrows），作为对照"""
+    jan_map = {}
+    for _, row in df.iterrows():
+        product_code = str(row[DetailTableConfig.COL_PRODUCT_CODE]).strip()
+        color_val = row[DetailTableConfig.COL_COLOR]
+        if isinstance(color_val, str):
+            if '.' in color_val:
+                try:
+                    color = str(int(float(color_val)))
+                except:
+                    color = color_val.strip()
+            else:
+                color = color_val.strip()
+        elif isinstance(color_val, float) and color_val.is_integer():
+            color = str(int(color_val))
+        else:
+            color = str(color_val).strip()
+
+        size_val = row[DetailTableConfig.COL_SIZE]
+        if isinstance(size_val, str):
+            if '.' in size_val:
+                try:
+                    size = str(int(float(size_val)))
+                except:
+                    size = size_val.strip()
+            else:
+                size = size_val.strip()
+        elif isinstance(size_val, float) and size_val.is_integer():
+            size = str(int(size_val))
+        else:
+            size = str(size_val).strip()
+
+        jan_val = row[DetailTableConfig.COL_JAN]
+        if pd.notna(jan_val):
+            if isinstance(jan_val, str):
+                if '.' in jan_val:
+                    try:
+                        jan = str(int(float(jan_val)))
+                    except:
+                        jan = jan_val.strip()
+                else:
+                    jan = jan_val.strip()
+            elif isinstance(jan_val, float):
+                jan = str(int(jan_val))
+            else:
+                jan = str(jan_val).strip()
+        else:
+            jan = ""
+
+        key = (product_code, color, size)
+        if jan:
+            jan_map[key] = jan
+    return jan_map
+
+
+def make_detail_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """生成模拟明细表（dtype=str读取后的形态，含各种需要规范化的写法）"""
+    rng = random.Random(seed)
+    colors = ['403', '403.0', ' 23 ', '023', '06.00', 'BK', '1.5', '１２.0', None]
+    sizes = ['02', '2.0', '3', ' 04', 'F', 'FREE', '0.0', '.5', '1e2', None]
+    data = {
+        DetailTableConfig.COL_PRODUCT_CODE: [],
+        DetailTableConfig.COL_COLOR: [],
+        DetailTableConfig.COL_SIZE: [],
+        DetailTableConfig.COL_JAN: [],
+    }
+    for i in range(rows):
+        jan = 4547810000000 + i
+        data[DetailTableConfig.COL_PRODUCT_CODE].append(
+            rng.choice([f"{19000 + i % 5000}", f" {19000 + i % 5000}(A) ", None]))
+        data[DetailTableConfig.COL_COLOR].append(rng.choice(colors))
+        data[DetailTableConfig.COL_SIZE].append(rng.choice(sizes))
+        data[DetailTableConfig.COL_JAN].append(rng.choice(
+            [str(jan), f"{jan}.0", f" {jan} ", "  ", "12345678901234567.0", None]))
+    df = pd.DataFrame(data, dtype=object)
+    return df.where(df.notna(), np.nan)
+
+
+def bench_jan_map(rows: int = 200000):
+    """明细表JAN映射：iterrows逐行 vs 向量化"""
+    df = make_detail_frame(rows)
+    print(f"明细表行数: {rows}")
+
+    legacy_time, legacy_map = _timeit(legacy_build_jan_map, df, repeat=1)
+    new_time, new_map = _timeit(DetailTableReader.build_jan_map, df)
+
+    same = legacy_map == new_map and list(legacy_map) == list(new_map)
+    print(f"  结果一致: {same} ({len(new_map)} 条)")
+    print(f"  iterrows: {legacy_time:.3f}s")
+    print(f"  向量化:   {new_time:.3f}s")
+    print(f"  加速比:   {legacy_time / new_time:.1f}x")
+    if not same:
+        diff = [k for k in set(legacy_map) | set(new_map) if legacy_map.get(k) != new_map.get(k)]
+        print(f"  不一致示例: {[(k, legacy_map.get(k), new_map.get(k)) for k in diff[:5]]}")
+    return same
+
+
+# ---------------------------------------------------------------------------
+# PT页样式写入
+# ---------------------------------------------------------------------------
+
+class LegacyStyles:
+    """优化前的样式写法：逐个单元格赋样式对象 / copy()模板单元格样式，由openpyxl逐个查重"""
+
+    def __init__(self, workbook):
+        self._styles = {}
+
+    def register(self, name, font=None, fill=None, border=None, alignment=None):
+        parts = {'font': font, 'fill': fill, 'border': border, 'alignment': alignment}
+        self._styles[name] = {k: v for k, v in parts.items() if v is not None}
+
+    def apply(self, cell, name):
+        for part, value in self._styles[name].items():
+            setattr(cell, part, value)
+
+    def copy_from(self, template_cell, target_cell, font_name=None, font_size=None):
+        new_font = copy(template_cell.font)
+        if font_name:
+            new_font.name = font_name
+        if font_size:
+            new_font.size = font_size
+        target_cell.font = new_font
+        target_cell.border = copy(template_cell.border)
+        target_cell.fill = copy(template_cell.fill)
+        target_cell.alignment = copy(template_cell.alignment)
+
+
+class LegacyStyleTemplateWriter(TemplateWriter):
+    """使用优化前样式写法的TemplateWriter，作为对照"""
+
+    def _register_styles(self):
+        self.styles = LegacyStyles(self.workbook)
+        super()._register_styles()
+
+
+def make_transformed_data(stores: int, skus: int, pt_count: int = 20, seed: int = 0) -> dict:
+    """生成模拟的DataTransformer输出（每个PT约10%的SKU有数量）"""
+    rng = random.Random(seed)
+    sku_list = [
+        {'product_code': f"{19000 + i // 40}", 'color': f"{i // 4 % 10:02d}", 'size': f"{i % 4 + 1:02d}",
+         'jan_code': str(4547810000000 + i), 'total_qty': 0}
+        for i in range(skus)
+    ]
+    pt_groups = []
+    seq_no = 1
+    per_pt = max(1, stores // pt_count)
+    for pt_idx in range(pt_count):
+        sku_ids = sorted(rng.sample(range(skus), max(1, skus // 10)))
+        sku_qtys = [float(rng.randint(1, 5)) for _ in sku_ids]
+        group_stores = []
+        for local_idx in range(per_pt):
+            group_stores.append({
+                'no': seq_no, 'type': '1', 'rank': 'A',
+                'store_code': str(1000 + seq_no), 'store_name': f"店舗{seq_no}",
+                'pt_local_idx': local_idx + 1, 'global_seq_no': seq_no, 'ctn_no': seq_no,
+                'total_qty': int(sum(sku_qtys)), 'sku_ids': sku_ids, 'sku_qtys': sku_qtys,
+            })
+            seq_no += 1
+        pt_groups.append({'pt_name': f"PT-{pt_idx + 1}", 'sku_ids': sku_ids, 'sku_qtys': sku_qtys,
+                          'stores': group_stores, 'total_qty': int(sum(sku_qtys))})
+    return {'metadata': {'kanri_no': '5115030', 'store_date': '2025/12/25'},
+            'skus': sku_list, 'pt_groups': pt_groups}
+
+
+_WRITERS = {
+    'legacy': LegacyStyleTemplateWriter,
+    'registry': TemplateWriter,
+    'stream': StreamingTemplateWriter,
+}
+
+
+def _writer_worker(variant: str, stores: int, skus: int, pt_count: int, output_path: str):
+    """在独立进程中写一次，返回(耗时, 峰值RSS MB)"""
+    import contextlib
+    import io
+    data = make_transformed_data(stores, skus, pt_count)
+    template_path = os.path.join(TEMPLATES_DIR, AllocationConfig.TEMPLATE_NAME)
+    writer_cls = _WRITERS[variant]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        writer_cls(template_path, output_path).write(data)
+    elapsed = time.perf_counter() - start
+    peak_mb = None
+    if resource is not None:
+        # Linux上ru_maxrss单位为KB，macOS为字节
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    return elapsed, peak_mb
+
+
+def _run_writer(variant: str, stores: int, skus: int, pt_count: int = 20):
+    """在新进程中运行一次写入（分别统计峰值RSS），返回(耗时, 峰值RSS MB, 输出字节数)"""
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, f"{variant}.xlsx")
+        with ctx.Pool(1) as pool:
+            elapsed, peak_mb = pool.apply(_writer_worker, (variant, stores, skus, pt_count, output_path))
+        return elapsed, peak_mb, os.path.getsize(output_path)
+
+
+def _print_writer_result(label: str, result):
+    elapsed, peak_mb, size = result
+    peak = f"{peak_mb:.0f}MB" if peak_mb is not None else "N/A"
+    print(f"  {label}: {elapsed:.2f}s, 峰值RSS {peak}, 输出 {size / 1024:.0f}KB")
+
+
+def bench_pt_styles(stores: int = 1000, skus: int = 800):
+    """PT页写入：逐格样式对象 vs 样式注册表"""
+    print(f"店铺数: {stores}, SKU数: {skus}")
+    legacy = _run_writer('legacy', stores, skus)
+    _print_writer_result('逐格样式', legacy)
+    registry = _run_writer('registry', stores, skus)
+    _print_writer_result('样式注册表', registry)
+    print(f"  加速比: {legacy[0] / registry[0]:.1f}x")
+
+
+def bench_pt_stream(stores: int = 500, skus: int = 800):
+    """PT页写入：内存工作簿 vs 流式写入，店铺数和PT数按1/2/4倍增长时的峰值RSS"""
+    print(f"SKU数: {skus}")
+    for scale in (1, 2, 4):
+        scaled_stores, pt_count = stores * scale, 20 * scale
+        print(f" 店铺数 {scaled_stores}, PT数 {pt_count}")
+        _print_writer_result('内存工作簿', _run_writer('registry', scaled_stores, skus, pt_count))
+        _print_writer_result('流式写入  ', _run_writer('stream', scaled_stores, skus, pt_count))
+
+
+# ---------------------------------------------------------------------------
+# 各店铺明细 SKU提取
+# ---------------------------------------------------------------------------
+
+def legacy_collect_stores(data: dict, prefix: str = "81") -> dict:
+    """优化前的实现：每个店铺遍历全部SKU，拼接键后查 sku_quantities（O(店铺数 x SKU数)）"""
+    all_skus = data['skus']
+    stores_map = {}
+    for group in data['pt_groups']:
+        for store in group['stores']:
+            store_code = str(store.get('store_code', ''))
+            if store_code not in stores_map:
+                stores_map[store_code] = {'info': store, 'items': []}
+            sku_quantities = store['sku_quantities']
+            slip_no = f"{prefix}{int(store['global_seq_no']):04d}"
+            for sku in all_skus:
+                p_code = str(sku.get('product_code', ''))
+                color = str(sku.get('color', ''))
+                size = str(sku.get('size', ''))
+                qty = sku_quantities.get(f"{p_code}_{color}_{size}", 0)
+                if qty > 0:
+                    stores_map[store_code]['items'].append({
+                        'slip_no': slip_no, 'product_code': p_code, 'color': color, 'size': size, 'qty': qty
+                    })
+    return stores_map
+
+
+def bench_store_items(stores: int = 2000):
+    """各店铺明细的SKU提取：非零比例固定为10%，SKU数按倍数增长"""
+    writer = StoreDetailWriter(None, None)
+    print(f"店铺数: {stores}, 每个PT约10%的SKU有数量")
+    ok = True
+    for skus in (250, 500, 1000, 2000, 4000):
+        data = make_transformed_data(stores, skus)
+        # 旧实现读取的按 "品番_颜色_尺码" 索引的数量字典（不计入耗时）
+        for group in data['pt_groups']:
+            keys = {sku_idx: "{product_code}_{color}_{size}".format(**data['skus'][sku_idx])
+                    for sku_idx in group['sku_ids']}
+            quantities = {keys[i]: q for i, q in zip(group['sku_ids'], group['sku_qtys'])}
+            for store in group['stores']:
+                store['sku_quantities'] = quantities
+        legacy_time, legacy_result = _timeit(legacy_collect_stores, data)
+        new_time, new_result = _timeit(writer._collect_stores, data)
+        same = legacy_result == new_result
+        ok = ok and same
+        print(f"  SKU {skus:5d}: 逐SKU查找 {legacy_time * 1000:8.1f}ms, 只遍历非零项 {new_time * 1000:7.1f}ms, "
+              f"加速比 {legacy_time / new_time:5.1f}x, 结果一致: {same}")
+    return ok
+
+
+# ---------------------------------------------------------------------------
+# アソート明細 写入
+# ---------------------------------------------------------------------------
+
+def bench_assortment(rows: int = 25000):
+    """アソート明細写入：内存工作簿逐格写入 vs 流式按行写入，行数按1/2/4倍增长"""
+    import contextlib
+    import io
+    template_path = os.path.join(TEMPLATES_DIR, AssortmentConfig.TEMPLATE_NAME)
+    template_cache.skeleton(template_path)
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in (1, 2, 4):
+            count = rows * scale
+            generator = AssortmentGenerator(None, template_path, os.path.join(tmp_dir, "assortment.xlsx"))
+            generator.data_rows = [{
+                'delivery_code': str(1000 + i // 50), 'delivery_name': f"店舗{i // 50}",
+                'slip_no': f"81{i // 50:04d}", 'jan': str(4900000000000 + rng.randint(0, 99999)),
+                'manufacturer_code': f"AB{i % 997:04d}", 'qty': rng.randint(1, 9),
+            } for i in range(count)]
+            with contextlib.redirect_stdout(io.StringIO()):
+                legacy_time, _ = _timeit(generator._write_to_workbook, repeat=1)
+                new_time, _ = _timeit(generator._write_to_template, repeat=1)
+            print(f"  {count:7d}行: 逐格写入 {legacy_time:6.2f}s, 流式按行写入 {new_time:6.2f}s, "
+                  f"加速比 {legacy_time / new_time:4.1f}x")
+
+
+# ---------------------------------------------------------------------------
+# ①箱設定 + ④各店铺明细 打包
+# ---------------------------------------------------------------------------
+
+def bench_package(stores: int = 1000, skus: int = 800):
+    """①和④依次生成 vs 子进程同时生成：打包总耗时应接近两者中较长的一个"""
+    import contextlib
+    import io
+    import zipfile
+    data = make_transformed_data(stores, skus)
+    template_path = os.path.join(TEMPLATES_DIR, AllocationConfig.TEMPLATE_NAME)
+    sd_template_path = os.path.join(TEMPLATES_DIR, StoreDetailConfig.TEMPLATE_NAME)
+    print(f"店铺数: {stores}, SKU数: {skus}, CPU数: {os.cpu_count()}")
+    if (os.cpu_count() or 1) <= 1:
+        print("  单核环境下同时生成会自动改为依次生成")
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        allocation_path = os.path.join(tmp_dir, "allocation.xlsx")
+        sd_path = os.path.join(tmp_dir, "store_detail.xlsx")
+        with contextlib.redirect_stdout(io.StringIO()):
+            template_cache.skeleton(template_path)
+            template_cache.skeleton(sd_template_path)
+            alloc_time, _ = _timeit(lambda: StreamingTemplateWriter(template_path, allocation_path).write(data), repeat=1)
+            sd_time, _ = _timeit(lambda: StreamingStoreDetailWriter(sd_template_path, sd_path).write(data), repeat=1)
+        print(f"  ①单独: {alloc_time:.2f}s, ④单独: {sd_time:.2f}s")
+        for label, concurrent in (("依次生成", False), ("同时生成", True)):
+            zip_path = os.path.join(tmp_dir, f"package_{concurrent}.zip")
+            writer = AllocationPackageWriter(template_path, allocation_path, sd_template_path, sd_path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, _ = _timeit(lambda: writer.write(data, package=ZipPackage(zip_path), concurrent=concurrent),
+                                    repeat=1)
+            with zipfile.ZipFile(zip_path) as zf:
+                names = sorted(zf.namelist())
+            ok = ok and names == ["allocation.xlsx", "store_detail.xlsx"]
+            print(f"  {label}: {elapsed:.2f}s, 打包内容: {names}")
+    return ok
+
+
+# ---------------------------------------------------------------------------
+# 工厂返回文件 PT页解析
+# ---------------------------------------------------------------------------
+
+def legacy_pt_quantities(path: str, passes: int = 3) -> int:
+    """优化前的读取方式：箱贴/②/③各自 load_workbook 整个文件，再逐格 ws.cell() 读取（同一文件解析3遍）"""
+    total = 0
+    for _ in range(passes):
+        wb = load_workbook(path, data_only=True)
+        for ws in wb.worksheets:
+            if "PT-" not in ws.title:
+                continue
+            first_col = TemplateConfig.PT_SKU_START_COL + 1
+            last_col = first_col
+            while ws.cell(row=2, column=last_col).value:
+                last_col += 1
+            for row in range(TemplateConfig.PT_DATA_START_ROW + 1, ws.max_row + 1):
+                if not ws.cell(row=row, column=TemplateConfig.PT_COL_STORE_CODE + 1).value:
+                    continue
+                for col in range(first_col, last_col):
+                    qty = ws.cell(row=row, column=col).value
+                    if qty and isinstance(qty, (int, float)) and qty > 0:
+                        total += int(qty)
+    return total // passes
+
+
+def _pt_quantities(path: str) -> int:
+    """共用解析器：只读一遍，从列式箱表取数量"""
+    total = 0
+    for sheet in read_pt_workbook(path).sheets:
+        if "PT-" not in sheet.title:
+            continue
+        for i in range(len(sheet)):
+            if sheet.store_codes[i]:
+                total += sum(qty for _, qty in sheet.quantities(i))
+    return total
+
+
+def make_factory_file(path: str, stores: int, skus: int):
+    """模拟工厂返回的箱設定文件：①箱設定 + 按店铺顺序填写的CTN_NO"""
+    import contextlib
+    import io
+    template_path = os.path.join(TEMPLATES_DIR, AllocationConfig.TEMPLATE_NAME)
+    with contextlib.redirect_stdout(io.StringIO()):
+        StreamingTemplateWriter(template_path, path).write(make_transformed_data(stores, skus))
+    wb = load_workbook(path)
+    ctn_no = 0
+    for ws in wb.worksheets:
+        for row in range(TemplateConfig.PT_DATA_START_ROW + 1, ws.max_row + 1):
+            if "PT-" in ws.title and ws.cell(row=row, column=TemplateConfig.PT_COL_STORE_CODE + 1).value:
+                ctn_no += 1
+                ws.cell(row=row, column=TemplateConfig.PT_COL_CTN_NO + 1).value = ctn_no
+    wb.save(path)
+
+
+def bench_pt_parse(stores: int = 1000, skus: int = 800):
+    """工厂返回文件：箱贴/②/③各自载入逐格读取（3遍） vs 共用解析器读取1遍"""
+    import contextlib
+    import io
+    import logging
+    print(f"店铺数: {stores}, SKU数: {skus}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "factory.xlsx")
+        make_factory_file(path, stores, skus)
+
+        legacy_time, legacy_total = _timeit(legacy_pt_quantities, path, repeat=1)
+        new_time, new_total = _timeit(_pt_quantities, path, repeat=1)
+        print(f"  逐格读取x3: {legacy_time:.2f}s, 共用解析器: {new_time:.2f}s, 加速比 {legacy_time / new_time:.1f}x")
+
+        # 三个生成器共用一次解析（解析缓存）
+        cache = PTParseCache()
+        logging.disable(logging.INFO)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                book = cache.load(path)
+                BoxSettingReader(path, pt_book=cache.load(path)).read()
+                AssortmentGenerator(path, None, None, pt_book=cache.load(path))._read_input_data()
+                DeliveryNoteGenerator(path, None, None, pt_book=cache.load(path))._read_input_data()
+                elapsed = time.perf_counter() - start
+        finally:
+            logging.disable(logging.NOTSET)
+        print(f"  箱贴+②+③读取: {elapsed:.2f}s (解析 {cache.misses} 次, 缓存命中 {cache.hits} 次, "
+              f"PT页 {len(book.sheets)})")
+    same = legacy_total == new_total
+    print(f"  数量合计一致: {same} ({new_total})")
+    return same
+
+
+# ---------------------------------------------------------------------------
+# 箱设定读取 箱内SKU合并
+# ---------------------------------------------------------------------------
+
+def legacy_box_items(sheet) -> list:
+    """优化前的合并方式：每个数量格子都线性查找箱内已有条目，每次比较都重新拼接メーカー品番"""
+    boxes = {}
+    last_ctn_no = None
+    for i in range(len(sheet)):
+        if sheet.ctn_nos[i] is not None:
+            last_ctn_no = sheet.ctn_nos[i]
+        if not last_ctn_no:
+            continue
+        items = boxes.setdefault(str(last_ctn_no), [])
+        for sku_idx, qty in sheet.quantities(i):
+            sku = sheet.skus[sku_idx]
+            existing_item = next((item for item in items
+                                  if item['maker_code'] == f"{sku['product_code']}-{sku['color']}-{sku['size']}"), None)
+            if existing_item:
+                existing_item['qty'] += qty
+            else:
+                items.append({'maker_code': f"{sku['product_code']}-{sku['color']}-{sku['size']}",
+                              'product_name': '', 'qty': qty})
+    return list(boxes.values())
+
+
+def bench_box_items(boxes: int = 20, rows_per_box: int = 20, skus: int = 300):
+    """箱设定读取：箱内条目线性查找 vs 按メーカー品番索引（每箱跨多行）"""
+    import logging
+    from openpyxl import Workbook
+    rng = random.Random(0)
+    print(f"箱数: {boxes}, 每箱行数: {rows_per_box}, SKU数: {skus}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "boxes.xlsx")
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("PT-1")
+        sku_cols = [None] * TemplateConfig.PT_SKU_START_COL
+        ws.append(sku_cols + [str(4547810000000 + i) for i in range(skus)])
+        ws.append(sku_cols + [f"{19000 + i // 20}" for i in range(skus)])
+        ws.append(sku_cols + [f"{i // 4 % 5:02d}" for i in range(skus)])
+        ws.append(sku_cols + [f"{i % 4 + 1:02d}" for i in range(skus)])
+        ws.append(["No.", "タイプ", "ランク", "コード", "店舗名", "CTN_NO", "パターン", "合計"])
+        for box in range(boxes):
+            for row in range(rows_per_box):
+                head = [box + 1, None, None, str(1000 + box), f"店舗{box}", box + 1, None, None] if row == 0 else [None] * 8
+                ws.append(head + [rng.choice((0, 0, 0, 1, 2)) for _ in range(skus)])
+        wb.save(path)
+
+        book = read_pt_workbook(path)
+    # 两种方式读取同一个已解析的箱表，只比较合并部分
+    logging.disable(logging.INFO)
+    try:
+        new_time, new_boxes = _timeit(lambda: BoxSettingReader(path, pt_book=book).read())
+    finally:
+        logging.disable(logging.NOTSET)
+    legacy_time, legacy_items = _timeit(legacy_box_items, book.sheets[0], repeat=1)
+    same = legacy_items == [box['items'] for box in new_boxes]
+    print(f"  线性查找: {legacy_time:.2f}s, 索引: {new_time:.3f}s, 加速比 {legacy_time / new_time:.0f}x")
+    print(f"  结果一致: {same}")
+    return same
+
+
+# ---------------------------------------------------------------------------
+# 箱贴PDF绘制
+# ---------------------------------------------------------------------------
+
+def make_label_boxes(boxes: int, seed: int = 0) -> list:
+    """生成模拟的BoxSettingReader输出（每箱1~20个条目，超过14条的箱会拆成多张箱贴）"""
+    rng = random.Random(seed)
+    result = []
+    for box in range(boxes):
+        items = [{
+            'jan': str(4547810000000 + i),
+            'maker_code': f"{19000 + i // 20}-{i // 4 % 5:02d}-{i % 4 + 1:02d}",
+            'product_name': f"ロングスリーブTシャツ{i // 20}",
+            'qty': rng.randint(1, 12),
+        } for i in rng.sample(range(400), rng.randint(1, 20))]
+        result.append({
+            'store_code': str(1000 + box), 'store_name': f"店舗{box}", 'store_date': "2026/10/17",
+            'ctn_no': box + 1, 'kanri_no': "K0001", 'dept': "81", 'pattern': box % 20,
+            'items': items, 'total_qty': sum(item['qty'] for item in items),
+        })
+    return result
+
+
+def bench_box_labels(boxes: int = 2000):
+    """箱贴PDF：每张箱贴用Table排版 vs 固定部分画成表单复用、文字直接写入（每秒箱贴数）"""
+    import logging
+    from copy import deepcopy
+    label_boxes = make_label_boxes(boxes)
+    logging.disable(logging.INFO)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            results = {}
+            for fast in (False, True):
+                path = os.path.join(tmp_dir, f"labels_{int(fast)}.pdf")
+                seconds, (_, stats) = _timeit(
+                    lambda: BoxLabelGenerator(deepcopy(label_boxes), path, fast_render=fast).generate(), repeat=1)
+                results[fast] = (seconds, stats, os.path.getsize(path))
+    finally:
+        logging.disable(logging.NOTSET)
+    (legacy_time, legacy_stats, legacy_size), (fast_time, fast_stats, fast_size) = results[False], results[True]
+    labels = fast_stats['label_count']
+    print(f"箱数: {boxes}, 箱贴数: {labels}")
+    print(f"  Table排版: {legacy_time:.2f}s ({labels / legacy_time:.0f} 张/秒, {legacy_size / 1024:.0f}KB)")
+    print(f"  表单复用: {fast_time:.2f}s ({labels / fast_time:.0f} 张/秒, {fast_size / 1024:.0f}KB), "
+          f"加速比 {legacy_time / fast_time:.1f}x")
+    same = legacy_stats == fast_stats
+    print(f"  统计一致: {same}")
+    return same
+
+
+# ---------------------------------------------------------------------------
+# ②アソート明細 + ③受渡伝票 + 箱贴 一次生成
+# ---------------------------------------------------------------------------
+
+def legacy_shipment_documents(path: str, tmp_dir: str):
+    """优化前的流程：同一文件上传3次，②③和箱贴各自解析文件、依次生成"""
+    as_template = os.path.join(TEMPLATES_DIR, AssortmentConfig.TEMPLATE_NAME)
+    dn_template = os.path.join(TEMPLATES_DIR, DeliveryNoteConfig.TEMPLATE_NAME)
+    pt_parse_cache.clear()
+    AssortmentGenerator(path, as_template, os.path.join(tmp_dir, "legacy_as.xlsx")).process()
+    pt_parse_cache.clear()
+    DeliveryNoteGenerator(path, dn_template, os.path.join(tmp_dir, "legacy_dn.xlsx")).process()
+    pt_parse_cache.clear()
+    boxes = BoxSettingReader(path).read()
+    BoxLabelGenerator(boxes, os.path.join(tmp_dir, "legacy_labels.pdf")).generate()
+
+
+def bench_full_package(stores: int = 300, skus: int = 400):
+    """②③和箱贴：分3次上传各自解析 vs 一次上传解析1次、同时生成并打包"""
+    import contextlib
+    import io
+    import logging
+    import zipfile
+    print(f"店铺数: {stores}, SKU数: {skus}, CPU数: {os.cpu_count()}")
+    if (os.cpu_count() or 1) <= 1:
+        print("  单核环境下同时生成会自动改为依次生成")
+    logging.disable(logging.INFO)
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "factory.xlsx")
+            make_factory_file(path, stores, skus)
+            with contextlib.redirect_stdout(io.StringIO()):
+                template_cache.skeleton(os.path.join(TEMPLATES_DIR, AssortmentConfig.TEMPLATE_NAME))
+                template_cache.skeleton(os.path.join(TEMPLATES_DIR, DeliveryNoteConfig.TEMPLATE_NAME))
+                legacy_time, _ = _timeit(legacy_shipment_documents, path, tmp_dir, repeat=1)
+                pt_parse_cache.clear()
+                writer = ShipmentPackageWriter(
+                    path,
+                    os.path.join(TEMPLATES_DIR, AssortmentConfig.TEMPLATE_NAME), os.path.join(tmp_dir, "as.xlsx"),
+                    os.path.join(TEMPLATES_DIR, DeliveryNoteConfig.TEMPLATE_NAME), os.path.join(tmp_dir, "dn.xlsx"),
+                    os.path.join(tmp_dir, "labels.pdf"))
+                zip_path = os.path.join(tmp_dir, "package.zip")
+                result = writer.write(package=ZipPackage(zip_path), concurrent=True)
+            print(f"  分3次生成: {legacy_time:.2f}s")
+            print(f"  一次生成并打包: {result['seconds']:.2f}s (解析 {result['parse_seconds']:.2f}s, "
+                  + ", ".join(f"{name} {doc['seconds']:.2f}s" for name, doc in result['documents'].items()) + ")")
+            with zipfile.ZipFile(zip_path) as zf:
+                names = zf.namelist()
+            print(f"  打包内容: {names}")
+    finally:
+        logging.disable(logging.NOTSET)
+    return len(names) == 3
+
+
+BENCHMARKS = {
+    'jan_map': bench_jan_map,
+    'pt_styles': bench_pt_styles,
+    'pt_stream': bench_pt_stream,
+    'store_items': bench_store_items,
+    'assortment': bench_assortment,
+    'package': bench_package,
+    'pt_parse': bench_pt_parse,
+    'full_package': bench_full_package,
+    'box_items': bench_box_items,
+    'box_labels': bench_box_labels,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"用法: python benchmark.py <{'|'.join(BENCHMARKS)}> [参数...]")
+        sys.exit(1)
+    args = [int(a) for a in sys.argv[2:]]
+    ok = BENCHMARKS[sys.argv[1]](*args)
+    sys.exit(0 if ok is not False else 1)
@@ -18,17 +18,40 @@ import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 明细表格版面 (箱贴内坐标，原点为箱贴左下角)
+TABLE_HEADER = ('部門', 'メーカー品番', '品名', '数量')
+TABLE_COL_WIDTHS = [12*mm, 38*mm, 35*mm, 10*mm]  # Total 95mm < 100mm
+TABLE_ROW_HEIGHT = 4.5*mm
+TABLE_FONT_SIZE = 7
+TABLE_CELL_PADDING = 2
+TABLE_GRID_WIDTH = 0.5
+TABLE_X = 2.5*mm
+TABLE_COL_POSITIONS = [0]                               # 各列分界的x坐标（表格内坐标）
+for _col_width in TABLE_COL_WIDTHS:
+    TABLE_COL_POSITIONS.append(TABLE_COL_POSITIONS[-1] + _col_width)
+TABLE_QTY_X = TABLE_COL_POSITIONS[-2] + TABLE_COL_WIDTHS[-1] * 0.5  # 数量列居中文字的中心
+TABLE_TOP_GAP = 2*mm                                    # 表格与头部分割线的间距
+LABEL_HEADER_BOTTOM = BoxLabelConfig.LABEL_HEIGHT - 30*mm  # 头部信息区下边
+LABEL_FOOTER_Y = 20*mm                                  # 底部汇总区上边
+TABLE_LEADING = 12                                      # CellStyle默认行距（单元格内换行时使用）
+# 单元格文字基线相对行底边的高度：Table 垂直居中的算法
+# (bottomPadding + 行高 - topPadding + 行数 * leading) / 2 - fontSize，CellStyle默认 padding=3
+TABLE_TEXT_RISE = (3 + TABLE_ROW_HEIGHT - 3 + TABLE_LEADING) / 2 - TABLE_FONT_SIZE
+
 class BoxLabelGenerator:
-    def __init__(self, boxes: list, output_path: str):
+    def __init__(self, boxes: list, output_path: str, fast_render: bool = None):
         """
         初始化箱贴生成器
         
         Args:
             boxes: 箱数据列表 (由BoxSettingReader读取)
             output_path: 输出PDF路径
+            fast_render: 是否使用快速绘制（固定部分画成PDF表单复用），默认取BoxLabelConfig.FAST_RENDER
         """
         self.boxes = boxes
         self.output_path = output_path
+        self.fast_render = BoxLabelConfig.FAST_RENDER if fast_render is None else fast_render
+        self._forms = {}  # 明细行数 -> 表单名（快速绘制用）
         self.font_registered = False
         self._register_font()
         
@@ -70,14 +93,14 @@ class BoxLabelGenerator:
         processed_boxes = []
         
         # Max rows per label
-        MAX_ROWS = 14
+        MAX_ROWS = BoxLabelConfig.MAX_ROWS
         
-        for box in self.boxes:
+        for box_no, box in enumerate(self.boxes, 1):
             items = box['items']
             total_items = len(items)
             
             if total_items <= MAX_ROWS:
-                box['_original_box_index'] = self.boxes.index(box) + 1
+                box['_original_box_index'] = box_no
                 box['_total_logical_boxes'] = len(self.boxes)
                 processed_boxes.append(box)
             else:
@@ -105,12 +128,17 @@ class BoxLabelGenerator:
                     
                     # Store original box information for footer numbering
                     # We need to know which logical box this belongs to
-                    sub_box['_original_box_index'] = self.boxes.index(box) + 1 # 1-based index
+                    sub_box['_original_box_index'] = box_no # 1-based index
                     sub_box['_total_logical_boxes'] = len(self.boxes)
                     
                     processed_boxes.append(sub_box)
 
         c = canvas.Canvas(self.output_path, pagesize=A4)
+        if self.fast_render:
+            # 用到的每种明细行数各画一个表单
+            self._forms = {}
+            for rows in sorted(set(len(box['items']) for box in processed_boxes)):
+                self._define_label_form(c, rows)
         total_boxes = len(processed_boxes)
         logger.info(f"Generating labels for {total_boxes} labels (from {len(self.boxes)} original boxes)...")
         
@@ -170,7 +198,10 @@ class BoxLabelGenerator:
             x = start_x + col * (BoxLabelConfig.LABEL_WIDTH + GAP_X)
             y = start_y + row * (BoxLabelConfig.LABEL_HEIGHT + GAP_Y)
             
-            self._draw_single_label(c, x, y, box, start_idx + i + 1, total)
+            if self.fast_render:
+                self._draw_single_label_fast(c, x, y, box, start_idx + i + 1, total)
+            else:
+                self._draw_single_label(c, x, y, box, start_idx + i + 1, total)
             
     def _draw_single_label(self, c, x, y, box, current_no, total):
         """绘制单个箱贴"""
@@ -203,16 +234,7 @@ class BoxLabelGenerator:
         #      c.drawRightString(width - padding, date_y - 4*mm, f"出区日: {box['delivery_date']}")
         
         # 第三行: 箱ID
-        # 箱ID: ★E-{管理No}-{箱号}
-        # 如果箱号是 C-001 这种格式，可能需要处理一下
-        ctn_clean = str(box['ctn_no']).replace('C-', '')
-        try:
-            ctn_clean_int = int(ctn_clean)
-            ctn_fmt = f"{ctn_clean_int:05d}"
-        except:
-            ctn_fmt = ctn_clean
-            
-        box_id = f"★E-{box['kanri_no']}-{ctn_fmt}"
+        box_id = self._box_id(box)
         c.setFont(self.font_name, 9)
         c.drawString(padding, height - 25*mm, f"箱ID: {box_id}")
         
@@ -222,7 +244,7 @@ class BoxLabelGenerator:
         
         # 3. 明细表格区
         # 表头: 部门 | メーカー品番 | 品名 | 数量
-        table_data = [['部門', 'メーカー品番', '品名', '数量']]
+        table_data = [list(TABLE_HEADER)]
         
         # 填充数据
         # 动态计算可用高度: 120 - 30(Head) - 20(Foot) = 70mm
@@ -231,27 +253,9 @@ class BoxLabelGenerator:
         items = box['items']
         
         for item in items:
-            # 修正メーカー品番: Brand(Dept) - Product - Size - Color
-            # item['maker_code'] is currently Product-Color-Size (from BoxSettingReader)
-            # We need to parse it and reconstruct.
-            # However, if parsing fails, fallback to original logic.
-            
-            maker_code = item['maker_code']
-            try:
-                parts = maker_code.split('-')
-                if len(parts) >= 3:
-                    product = parts[0]
-                    color = parts[1]
-                    size = parts[2]
-                    # Target: Brand-Product-Size-Color
-                    # Brand comes from box['dept']
-                    maker_code = f"{box['dept']}-{product}-{size}-{color}"
-            except Exception:
-                pass # Keep original if parsing fails
-
             table_data.append([
                 "", # 部门列留空
-                maker_code,
+                self._maker_code(item['maker_code'], box['dept']),
                 item['product_name'],
                 str(item['qty'])
             ])
@@ -260,18 +264,18 @@ class BoxLabelGenerator:
             
         # 创建表格
         # 列宽分配: 12mm, 38mm, 35mm, 10mm (Total 95mm < 100mm)
-        col_widths = [12*mm, 38*mm, 35*mm, 10*mm]
-        t = Table(table_data, colWidths=col_widths, rowHeights=4.5*mm)
+        col_widths = TABLE_COL_WIDTHS
+        t = Table(table_data, colWidths=col_widths, rowHeights=TABLE_ROW_HEIGHT)
         
         t.setStyle(TableStyle([
             ('FONTNAME', (0, 0), (-1, -1), self.font_name),
-            ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('FONTSIZE', (0, 0), (-1, -1), TABLE_FONT_SIZE),
             ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
             ('ALIGN', (-1, 0), (-1, -1), 'CENTER'), # 数量居中
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('GRID', (0, 0), (-1, -1), TABLE_GRID_WIDTH, colors.black),
             ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('LEFTPADDING', (0, 0), (-1, -1), 2),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 2),
+            ('LEFTPADDING', (0, 0), (-1, -1), TABLE_CELL_PADDING),
+            ('RIGHTPADDING', (0, 0), (-1, -1), TABLE_CELL_PADDING),
             # 表头背景
             ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
         ]))
@@ -283,7 +287,7 @@ class BoxLabelGenerator:
         if table_bottom_y < 20*mm:
             table_bottom_y = 20*mm # 防止覆盖Footer
             
-        t.drawOn(c, 2.5*mm, table_bottom_y)
+        t.drawOn(c, TABLE_X, table_bottom_y)
         
         # 4. 底部汇总区 (高度 20mm)
         footer_y = 20 * mm
@@ -309,6 +313,175 @@ class BoxLabelGenerator:
         
         c.restoreState()
 
+    @staticmethod
+    def _box_id(box) -> str:
+        """箱ID: ★E-{管理No}-{箱号}（箱号 C-001 之类去掉前缀，数字补足5位）"""
+        ctn_clean = str(box['ctn_no']).replace('C-', '')
+        try:
+            ctn_clean_int = int(ctn_clean)
+            ctn_fmt = f"{ctn_clean_int:05d}"
+        except:
+            ctn_fmt = ctn_clean
+        return f"★E-{box['kanri_no']}-{ctn_fmt}"
+
+    @staticmethod
+    def _maker_code(maker_code: str, dept) -> str:
+        """
+        修正メーカー品番: Brand(Dept) - Product - Size - Color
+        item['maker_code'] 为 Product-Color-Size (from BoxSettingReader)，无法拆分时保持原样
+        """
+        try:
+            parts = maker_code.split('-')
+        except Exception:
+            return maker_code
+        if len(parts) >= 3:
+            product, color, size = parts[0], parts[1], parts[2]
+            return f"{dept}-{product}-{size}-{color}"
+        return maker_code
+
+    @staticmethod
+    def _table_bottom(rows: int) -> float:
+        """明细表格（表头+rows行）的底边y坐标，与 _draw_single_label 中的计算一致"""
+        table_bottom_y = LABEL_HEADER_BOTTOM - (rows + 1) * TABLE_ROW_HEIGHT - TABLE_TOP_GAP
+        return max(table_bottom_y, LABEL_FOOTER_Y)
+
+    def _define_label_form(self, c, rows: int) -> str:
+        """
+        把箱贴中不随箱变化的部分画成表单：边框、分割线、表头（背景+文字）、rows行明细的网格
+
+        表格部分按 Table.drawOn 的方式先平移到表格左下角，再按与 Table 相同的顺序和坐标绘制。
+        Table 先画背景和单元格文字、最后画网格；黑色网格与黑色文字叠放顺序不影响显示，
+        所以网格可以和其他固定部分一起放进表单，先于明细文字绘制。
+        """
+        name = self._forms.get(rows)
+        if name is not None:
+            return name
+        name = f"BoxLabelFrame{rows}"
+        width = BoxLabelConfig.LABEL_WIDTH
+        height = BoxLabelConfig.LABEL_HEIGHT
+        # 边框线宽1，表单范围向外留出线宽，避免裁掉边框外侧
+        c.beginForm(name, lowerx=-1, lowery=-1, upperx=width + 1, uppery=height + 1)
+
+        # 边框 + 头部分割线
+        c.setLineWidth(1)
+        c.setStrokeColor(colors.black)
+        c.rect(0, 0, width, height)
+        c.line(0, LABEL_HEADER_BOTTOM, width, LABEL_HEADER_BOTTOM)
+
+        # 表格（表格内坐标，原点为表格左下角）
+        c.saveState()
+        c.translate(TABLE_X, self._table_bottom(rows))
+        col_xs = TABLE_COL_POSITIONS
+        row_ys = self._table_row_positions(rows)
+        top, bottom, left, right = row_ys[0], row_ys[-1], col_xs[0], col_xs[-1]
+
+        # 表头背景
+        c.setFillColor(colors.lightgrey)
+        c.rect(left, top, right - left, row_ys[1] - top, stroke=0, fill=1)
+
+        # 表头文字
+        c.setFillColor(colors.black)
+        c.setFont(self.font_name, TABLE_FONT_SIZE)
+        text_y = row_ys[1] + TABLE_TEXT_RISE
+        for col, text in enumerate(TABLE_HEADER[:-1]):
+            c.drawString(col_xs[col] + TABLE_CELL_PADDING, text_y, text)
+        c.drawCentredString(TABLE_QTY_X, text_y, TABLE_HEADER[-1])
+
+        # 网格：与 Table 的 GRID 相同（圆头圆角），每条线单独描边（外框在先，内线在后）
+        c.setLineCap(1)
+        c.setLineJoin(1)
+        c.setLineWidth(TABLE_GRID_WIDTH)
+        for row_y in (top, bottom):
+            c.line(left, row_y, right, row_y)
+        for col_x in (left, right):
+            c.line(col_x, bottom, col_x, top)
+        for row_y in row_ys[1:-1]:
+            c.line(left, row_y, right, row_y)
+        for col_x in col_xs[1:-1]:
+            c.line(col_x, bottom, col_x, top)
+        c.restoreState()
+
+        # 底部汇总区分割线
+        c.line(0, LABEL_FOOTER_Y, width, LABEL_FOOTER_Y)
+
+        c.endForm()
+        self._forms[rows] = name
+        return name
+
+    @staticmethod
+    def _table_row_positions(rows: int) -> list:
+        """表格（表头+rows行）各行分界的y坐标（表格内坐标，自上而下，与 Table 的计算方式相同）"""
+        positions = [0]
+        for _ in range(rows + 1):
+            positions.append(positions[-1] + TABLE_ROW_HEIGHT)
+        positions.reverse()
+        return positions
+
+    @staticmethod
+    def _draw_cell(draw, x: float, row_y: float, value):
+        """
+        按 Table 的规则写入一个明细单元格的文字：None为空，含换行时逐行写出、整体垂直居中
+
+        Args:
+            draw: c.drawString / c.drawCentredString
+            x: 文字起点（居中时为中心）的x坐标
+            row_y: 该行底边的y坐标
+        """
+        text = '' if value is None else str(value)
+        if '\n' not in text:
+            draw(x, row_y + TABLE_TEXT_RISE, text)
+            return
+        lines = text.split('\n')
+        text_y = row_y + (3 + TABLE_ROW_HEIGHT - 3 + len(lines) * TABLE_LEADING) / 2 - TABLE_FONT_SIZE
+        for line in lines:
+            draw(x, text_y, line)
+            text_y -= TABLE_LEADING
+
+    def _draw_single_label_fast(self, c, x, y, box, current_no, total):
+        """快速绘制单个箱贴：固定部分引用表单，文字在预先算好的坐标直接写入（版面与 _draw_single_label 相同）"""
+        width = BoxLabelConfig.LABEL_WIDTH
+        height = BoxLabelConfig.LABEL_HEIGHT
+        padding = 5 * mm
+        items = box['items']
+
+        c.saveState()
+        c.translate(x, y)
+        c.doForm(self._define_label_form(c, len(items)))
+
+        # 头部信息区
+        c.setFont(self.font_name, 10)
+        c.drawString(padding, height - 10*mm, f"{box['store_code']}   {box['store_name']}")
+        c.setFont(self.font_name, 8)
+        c.drawRightString(width - padding, height - 15*mm, f"店着日: {box['store_date']}")
+        c.setFont(self.font_name, 9)
+        c.drawString(padding, height - 25*mm, f"箱ID: {self._box_id(box)}")
+
+        # 明细行（表格内坐标，部门列留空）
+        if items:
+            c.saveState()
+            c.translate(TABLE_X, self._table_bottom(len(items)))
+            c.setFont(self.font_name, TABLE_FONT_SIZE)
+            dept = box['dept']
+            code_x = TABLE_COL_POSITIONS[1] + TABLE_CELL_PADDING
+            name_x = TABLE_COL_POSITIONS[2] + TABLE_CELL_PADDING
+            draw_string = c.drawString
+            draw_centred = c.drawCentredString
+            for row_y, item in zip(self._table_row_positions(len(items))[2:], items):
+                self._draw_cell(draw_string, code_x, row_y, self._maker_code(item['maker_code'], dept))
+                self._draw_cell(draw_string, name_x, row_y, item['product_name'])
+                self._draw_cell(draw_centred, TABLE_QTY_X, row_y, str(item['qty']))
+            c.restoreState()
+
+        # 底部汇总区
+        c.setFont(self.font_name, 9)
+        c.drawString(padding, 13*mm, f"C/No. {box['ctn_no']}")
+        c.drawRightString(width - padding, 13*mm, f"入数  {box['total_qty']} PCS")
+        box_idx = box.get('_original_box_index', current_no)
+        total_boxes = box.get('_total_logical_boxes', total)
+        c.drawCentredString(width / 2, 5*mm, f"{box_idx} / {total_boxes}")
+
+        c.restoreState()
+
 if __name__ == "__main__":
     # 测试代码
     pass
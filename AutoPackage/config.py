@@ -103,6 +103,9 @@ class TemplateConfig:
     
     # SKU序列开始列
     PT_SKU_START_COL = 8        # SKU数据从第9列开始（0-indexed为8）
+    
+    # PT页数达到该值时，流式写入改为多进程并行渲染PT页
+    PT_PARALLEL_MIN_SHEETS = 40
 
 
 # 明细表文件结构
@@ -142,6 +145,22 @@ class DeliveryNoteConfig:
     COL_INDEX_COLOR = 6         # G列
     COL_INDEX_QTY = 7           # H列
 
+    # 文本导出（CSV/TSV，直接上传系统用，不经过Excel模板）
+    # 列顺序与模板第7行的上传列一致: (表头, data_rows中的键)
+    TEXT_EXPORT_COLUMNS = [
+        ("受渡伝票NO", "slip_no"),
+        ("ブランド", "brand"),
+        ("店舗コード", "store_code"),
+        ("品番", "product_code"),
+        ("サイズ", "size"),
+        ("カラー", "color"),
+        ("数量", "qty"),
+    ]
+    TEXT_EXPORT_HEADER = True   # 第一行输出表头
+    TEXT_EXPORT_DELIMITERS = {"csv": ",", "tsv": "\t"}
+    # 编码选项 -> Python编码名（Shift-JIS使用Windows扩展的cp932；UTF-8带BOM，Excel打开不乱码）
+    TEXT_EXPORT_ENCODINGS = {"utf-8": "utf-8-sig", "shift_jis": "cp932"}
+
 
 # 配分表文件结构
 class AllocationConfig:
@@ -206,6 +225,12 @@ class BoxLabelConfig:
     FONT_NAME = "NotoSansJP"
     FONT_PATH = "fonts/NotoSansCJKjp-Regular.otf"  # 相对路径
 
+    # 明细表格
+    MAX_ROWS = 14            # 每张箱贴最多明细行数，超出拆成多张
+    # 快速绘制：边框/分割线/表头/网格按明细行数预先画成PDF表单（Form XObject）复用，
+    # 每张箱贴只直接写入文字；False时按原方式用platypus Table逐张排版
+    FAST_RENDER = True
+
 
 # 文件路径配置
 class FileConfig:
@@ -215,6 +240,41 @@ class FileConfig:
     OUTPUT_FILE_SUFFIX = "_振分.xlsx"
 
 
+# 配分表解析缓存配置
+class ParseCacheConfig:
+    """配分表解析缓存配置"""
+    CACHE_DIR_NAME = "parse_cache"        # 缓存目录名（位于storage下）
+    MAX_BYTES = 512 * 1024 * 1024         # 缓存总大小上限（512MB）
+
+
+# 模板缓存配置
+class TemplateCacheConfig:
+    """模板缓存配置"""
+    MAX_ENTRIES = 16                      # 进程内最多缓存的模板数（含用户上传的模板）
+
+
+# PT页解析配置
+class PTSheetConfig:
+    """工厂返回文件（PT页）解析配置"""
+    CACHE_ENTRIES = 8                     # 进程内最多缓存的解析结果数（按文件内容区分）
+    SHEET_NAME_MARK = "PT-"               # PT页名称包含的标记
+    HEADER_LABEL = "No."                  # PT页数据表头（A5）的标签
+
+
+# 打包文件配置
+class PackageConfig:
+    """打包文件（zip）配置"""
+    COMPRESS_LEVEL = 1                    # deflate压缩级别（0=不压缩；xlsx再压缩约可减半，1级与6级体积相差不到5%）
+    CHUNK_SIZE = 256 * 1024               # 写入条目/分块下载时每次读取的字节数
+
+
+# JAN主档配置
+class JanMasterConfig:
+    """JAN主档配置"""
+    DB_NAME = "jan_master.db"             # 主档数据库文件名（位于storage下）
+    INDEX_CACHE_VERSIONS = 2              # 内存中缓存的JAN匹配索引版本数（每个版本载入完整映射）
+
+
 # 日志配置
 class LogConfig:
     """日志配置"""
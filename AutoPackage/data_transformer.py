@@ -5,23 +5,140 @@
 """
 from typing import Dict, List, Tuple
 from collections import defaultdict
+from itertools import islice
 import re
 
+import numpy as np
+
+from sku_catalog import SkuCatalog
+
+
+def clean_product_code(code) -> str:
+    """去除品番中的括号及内容，例如 '14003(2)' -> '14003'"""
+    # 将全角括号转为半角
+    code = str(code).replace('（', '(').replace('）', ')')
+    # 去除 (..) 内容
+    return re.sub(r'\(.*?\)', '', code).strip()
+
+
+def _strip_zeros(value: str) -> str:
+    """去除前导零，全是0时保留'0'（'003' -> '3', '00' -> '0'）"""
+    return value.lstrip('0') or "0"
+
+
+# JAN匹配规则（按优先级）及其日志说明
+JAN_RULE_EXACT = 'exact'
+JAN_RULE_COLOR_ZERO = 'color_zero'
+JAN_RULE_SIZE_ZERO = 'size_zero'
+JAN_RULE_BOTH_ZERO = 'both_zero'
+JAN_RULE_LABELS = {
+    JAN_RULE_COLOR_ZERO: "模糊匹配成功(去零)",
+    JAN_RULE_SIZE_ZERO: "模糊匹配成功(尺码去零)",
+    JAN_RULE_BOTH_ZERO: "模糊匹配成功(双去零)",
+}
+
+
+class JanMatchIndex:
+    """
+    JANCODE 匹配索引
+    
+    按规范键 (清洗后的品番, 颜色去零, 尺码去零) 把明细表条目分桶，
+    每个SKU只需查一次桶，再在桶内按原有规则顺序（精确 → 颜色去零 → 尺码去零 → 双去零）确认，
+    结果与逐条试探完全一致。同一个索引可在批量转换的多个文件之间复用，解析结果按SKU缓存。
+    """
+    
+    def __init__(self, jan_map: Dict[Tuple[str, str, str], str]):
+        """
+        Args:
+            jan_map: JANCODE映射字典 {(品番, 颜色, 尺码): JANCODE}
+        """
+        self.size = len(jan_map)
+        self.sample_keys = list(islice(jan_map, 3))
+        self._buckets = defaultdict(dict)
+        for key, jan in jan_map.items():
+            if not jan:
+                continue
+            p_code, color, size = key
+            canonical = (clean_product_code(p_code), _strip_zeros(color), _strip_zeros(size))
+            self._buckets[canonical][key] = jan
+        self._resolved = {}
+    
+    def __len__(self):
+        return self.size
+    
+    def match(self, p_code: str, color: str, size: str) -> Tuple[str, str, Tuple[str, str, str]]:
+        """
+        查找SKU对应的JANCODE
+        
+        Args:
+            p_code: 已清洗的品番
+            color: 颜色（已去空白）
+            size: 尺码（已去空白）
+        
+        Returns:
+            (JANCODE, 匹配规则, 命中的明细表键)；未匹配时为 ("", None, None)
+        """
+        key = (p_code, color, size)
+        resolved = self._resolved.get(key)
+        if resolved is None:
+            resolved = self._resolve(p_code, color, size)
+            self._resolved[key] = resolved
+        return resolved
+    
+    def _resolve(self, p_code: str, color: str, size: str):
+        bucket = self._buckets.get((p_code, _strip_zeros(color), _strip_zeros(size)))
+        if not bucket:
+            return "", None, None
+        
+        # 1. 精确匹配
+        key = (p_code, color, size)
+        if key in bucket:
+            return bucket[key], JAN_RULE_EXACT, key
+        
+        # 2. 颜色去前导零 (例如 '003' -> '3')，颜色为空时不尝试
+        color_stripped = _strip_zeros(color) if color else color
+        if color != color_stripped:
+            key_retry = (p_code, color_stripped, size)
+            if key_retry in bucket:
+                return bucket[key_retry], JAN_RULE_COLOR_ZERO, key_retry
+        
+        # 3. 尺码去前导零 (例如 '09' -> '9')
+        size_stripped = _strip_zeros(size) if size else size
+        if size != size_stripped:
+            key_retry = (p_code, color, size_stripped)
+            if key_retry in bucket:
+                return bucket[key_retry], JAN_RULE_SIZE_ZERO, key_retry
+        
+        # 4. 颜色尺码都去零
+        key_retry = (p_code, _strip_zeros(color), _strip_zeros(size))
+        if key_retry in bucket:
+            return bucket[key_retry], JAN_RULE_BOTH_ZERO, key_retry
+        
+        return "", None, None
+
 
 class DataTransformer:
     """数据转换器"""
     
-    def __init__(self, allocation_data: Dict, jan_map: Dict[Tuple[str, str, str], str] = None):
+    def __init__(self, allocation_data: Dict, jan_map: Dict[Tuple[str, str, str], str] = None,
+                 jan_index: JanMatchIndex = None):
         """
         初始化转换器
         
         Args:
             allocation_data: 从AllocationTableReader读取的数据
-            jan_map: JANCODE映射字典 {(品番, 颜色, 尺码): JANCODE}
+            jan_map: JANCODE映射字典 {(品番, 颜色, 尺码): JANCODE}，
+                     也可以是 jan_master.JanMasterMap 等只读映射
+            jan_index: 预先构建的JAN匹配索引（批量转换时复用），为None时由jan_map构建
         """
         self.allocation_data = allocation_data
         self.jan_map = jan_map or {}
+        self.jan_index = jan_index
+        self.jan_match_rules = {}  # 各匹配规则命中的SKU数
         self.all_skus = []  # 所有唯一的SKU列表（排序后）
+        self.catalog = SkuCatalog()  # SKU目录，id即all_skus中的下标
+        self.all_stores = []  # 合并后的店铺列表（与数量矩阵的行对应）
+        self.qty_matrix = None  # 店铺×SKU数量矩阵
         self.pt_groups = []  # PT分组结果
         self.ctn_counter = 1  # 箱号计数器
         self.logs = []
@@ -42,30 +159,34 @@ class DataTransformer:
         # 2. 对SKU排序
         self._sort_skus()
         
-        # 3. 注入 JANCODE
+        # 3. 登记SKU目录，分配整数id
+        self._build_catalog()
+        
+        # 4. 注入 JANCODE
         self._inject_jancodes()
         
-        # 4. 计算 SKU 总数
+        # 5. 构建店铺×SKU数量矩阵
+        self._build_quantity_matrix()
+        
+        # 6. 计算 SKU 总数
         self._calculate_sku_totals()
         
-        # 5. 分析店铺配比并分组PT
+        # 7. 分析店铺配比并分组PT
         self._group_by_pattern()
         
-        # 5. 分配箱号
+        # 8. 分配箱号
         self._assign_ctn_numbers()
         
         return {
             'metadata': self.allocation_data['metadata'],
             'skus': self.all_skus,
+            'sku_catalog': self.catalog,
             'pt_groups': self.pt_groups
         }
     
     def _clean_product_code(self, code):
         """去除品番中的括号及内容，例如 '14003(2)' -> '14003'"""
-        # 将全角括号转为半角
-        code = str(code).replace('（', '(').replace('）', ')')
-        # 去除 (..) 内容
-        return re.sub(r'\(.*?\)', '', code).strip()
+        return clean_product_code(code)
 
     def _inject_jancodes(self):
         """注入 JANCODE 到 SKU 信息中"""
@@ -73,105 +194,57 @@ class DataTransformer:
         match_count = 0
         fail_count = 0
         
-        self.logs.append(f"开始匹配 JANCODE (明细表共 {len(self.jan_map)} 条)")
-        if self.jan_map:
-            self.logs.append(f"明细表键样例(前3): {list(self.jan_map.keys())[:3]}")
+        if self.jan_index is None:
+            # JAN主档视图自带按版本缓存的索引
+            build_index = getattr(self.jan_map, 'match_index', None)
+            self.jan_index = build_index() if build_index else JanMatchIndex(self.jan_map)
+        jan_index = self.jan_index
+        
+        self.logs.append(f"开始匹配 JANCODE (明细表共 {len(jan_index)} 条)")
+        if len(jan_index):
+            self.logs.append(f"明细表键样例(前3): {jan_index.sample_keys}")
 
-        for sku in self.all_skus:
-            # 基础清理 & 品番去括号
-            original_p_code = str(sku['product_code']).strip()
-            p_code = self._clean_product_code(original_p_code)
-            
-            # 更新 sku 中的 product_code (写入模板时也生效)
-            if p_code != original_p_code:
-                # self.logs.append(f"品番清洗: {original_p_code} -> {p_code}")
-                sku['product_code'] = p_code
-            
-            color = str(sku['color']).strip()
-            size = str(sku['size']).strip()
-            
-            # 1. 精确匹配
+        rule_counts = defaultdict(int)
+        rule_examples = defaultdict(list)
+        for sku_id in range(len(self.catalog)):
+            # 目录中的品番已去括号
+            p_code, color, size = self.catalog.key(sku_id)
+            color = str(color).strip()
+            size = str(size).strip()
             key = (p_code, color, size)
-            jan = self.jan_map.get(key, "")
             
-            # 2. 模糊匹配：尝试去除颜色前导零 (例如 '003' -> '3')
-            if not jan:
-                color_stripped = color.lstrip('0')
-                # 如果全是0，变成空串了，要恢复成'0'
-                if not color_stripped and '0' in color: color_stripped = "0"
-                
-                if color != color_stripped:
-                    key_retry = (p_code, color_stripped, size)
-                    jan = self.jan_map.get(key_retry, "")
-                    if jan:
-                        self.logs.append(f"模糊匹配成功(去零): {key} -> {key_retry}")
-
-            # 3. 模糊匹配：尝试去除尺码前导零 (例如 '09' -> '9')
-            if not jan:
-                size_stripped = size.lstrip('0')
-                if not size_stripped and '0' in size: size_stripped = "0"
-                
-                if size != size_stripped:
-                    key_retry = (p_code, color, size_stripped)
-                    jan = self.jan_map.get(key_retry, "")
-                    if jan:
-                        self.logs.append(f"模糊匹配成功(尺码去零): {key} -> {key_retry}")
-                        
-            # 4. 组合拳 (颜色尺码都去零)
-            if not jan:
-                color_stripped = color.lstrip('0') or "0"
-                size_stripped = size.lstrip('0') or "0"
-                key_retry = (p_code, color_stripped, size_stripped)
-                jan = self.jan_map.get(key_retry, "")
-                if jan:
-                     self.logs.append(f"模糊匹配成功(双去零): {key} -> {key_retry}")
-
+            jan, rule, matched_key = jan_index.match(p_code, color, size)
             if jan:
-                sku['jan_code'] = jan
+                self.catalog.set_jan(sku_id, jan)
                 match_count += 1
+                rule_counts[rule] += 1
+                if rule in JAN_RULE_LABELS and len(rule_examples[rule]) < 3:
+                    rule_examples[rule].append(f"{key} -> {matched_key}")
             else:
                 fail_count += 1
                 if fail_count <= 5:
                     self.logs.append(f"匹配失败: {key}")
         
+        # 模糊匹配按规则汇总输出
+        for rule, label in JAN_RULE_LABELS.items():
+            if rule_counts[rule]:
+                self.logs.append(f"{label}: {rule_counts[rule]} 个SKU, 例: {'; '.join(rule_examples[rule])}")
+        
         self.logs.append(f"JANCODE 匹配结果: 成功 {match_count}, 失败 {fail_count}")
-        self.jan_map_count = len(self.jan_map)
+        self.jan_map_count = len(jan_index)
         self.jan_match_success = match_count
         self.jan_match_fail = fail_count
+        self.jan_match_rules = dict(rule_counts)
 
     def _calculate_sku_totals(self):
-        """计算每个SKU的全局总数量"""
-        # 初始化计数器
-        sku_totals = defaultdict(int) # key: (product_code, color, size)
-        
-        # 调试日志
-        debug_count = 0
+        """计算每个SKU的全局总数量（数量矩阵按列求和）"""
+        column_totals = self.qty_matrix.sum(axis=0).tolist() if len(self.all_stores) else []
         
-        for product_data in self.allocation_data['products']:
-            # 使用清洗后的品番
-            product_code = self._clean_product_code(product_data['product_code'])
-            
-            for store in product_data['stores']:
-                for sku_key, qty in store['sku_quantities'].items():
-                    # sku_key 是 "Color_Size"
-                    if '_' in sku_key:
-                        parts = sku_key.rsplit('_', 1)
-                        color = parts[0]
-                        size = parts[1]
-                        
-                        key = (product_code, color, size)
-                        sku_totals[key] += qty
-                        
-                        if debug_count < 3:
-                            # print(f"DEBUG: Accumulate {key} += {qty}")
-                            debug_count += 1
-        
-        # 将总数注入到 self.all_skus
+        # 将总数注入到SKU目录
         inject_count = 0
-        for sku in self.all_skus:
-            key = (sku['product_code'], sku['color'], sku['size'])
-            total = sku_totals.get(key, 0)
-            sku['total_qty'] = total
+        for sku_id in range(len(self.catalog)):
+            total = column_totals[sku_id] if column_totals else 0
+            self.catalog.set_total(sku_id, total if total else 0)
             if total > 0:
                 inject_count += 1
                 
@@ -209,15 +282,38 @@ class DataTransformer:
             str(x['size'])
         ))
     
-    def _group_by_pattern(self):
-        """根据配比模式对店铺进行分组"""
+    def _build_catalog(self):
+        """按排序后的顺序登记SKU（品番去括号，写入模板时也使用清洗后的品番）"""
+        for sku in self.all_skus:
+            p_code = self._clean_product_code(str(sku['product_code']).strip())
+            self.catalog.add(p_code, sku['color'], sku['size'])
+        self.all_skus = self.catalog.entries
+    
+    def _product_sku_ids(self, product_data: Dict) -> Tuple[List[int], List[int]]:
+        """
+        品番的SKU列位置 -> 目录id
+        
+        Returns:
+            (列位置列表, id列表)，一一对应；同一カラー/サイズ出现多列时取最后一列，
+            清洗后重复的SKU会对应多个id
+        """
+        product_code = self._clean_product_code(product_data['product_code'])
+        column_of = {}
+        for col_pos, sku_info in enumerate(product_data['sku_columns']):
+            column_of[(sku_info['color'], sku_info['size'])] = col_pos
+        
+        src_idx, dst_ids = [], []
+        for (color, size), col_pos in column_of.items():
+            for sku_id in self.catalog.ids_of(product_code, color, size):
+                src_idx.append(col_pos)
+                dst_ids.append(sku_id)
+        return src_idx, dst_ids
+    
+    def _build_quantity_matrix(self):
+        """合并各品番下的店铺，构建 店铺×SKU 数量矩阵（同一店铺在多个品番下的数量累加）"""
         # 1. 首先聚合同一店铺在所有品番下的数据
         merged_stores_map = {}
-        
         for product_data in self.allocation_data['products']:
-            # 使用清洗后的品番，确保与sku中的key一致
-            product_code = self._clean_product_code(product_data['product_code'])
-            
             for store in product_data['stores']:
                 # 修改聚合逻辑：仅使用 store_code 作为唯一标识，忽略 type
                 # 这样同一店铺即使有不同的 type 也会被合并到一起
@@ -229,131 +325,79 @@ class DataTransformer:
                         'type': store['type'], # 保留第一个遇到的type
                         'store_code': store['store_code'],
                         'store_name': store['store_name'],
-                        'rank': store.get('rank', ''),
-                        'raw_sku_quantities': {}  # 临时存储：{"product_color_size": qty}
+                        'rank': store.get('rank', '')
                     }
-                
-                # 合并该店铺在该品番下的SKU数量
-                for sku_short_key, qty in store['sku_quantities'].items():
-                    # sku_short_key 是 "Color_Size"
-                    # 组合成全局唯一的 "Product_Color_Size"
-                    full_key = f"{product_code}_{sku_short_key}"
-                    
-                    # 累加数量
-                    current_qty = merged_stores_map[store_key]['raw_sku_quantities'].get(full_key, 0)
-                    merged_stores_map[store_key]['raw_sku_quantities'][full_key] = current_qty + qty
-
-        # 2. 为聚合后的店铺构建全局配比向量
-        all_stores = []
+        self.all_stores = list(merged_stores_map.values())
+        store_rows = {store_key: row_idx for row_idx, store_key in enumerate(merged_stores_map)}
         
-        for store_data in merged_stores_map.values():
-            pattern_vector = []
-            full_quantities = {}
-            
-            # 遍历所有已排序的全局SKU列表
-            for sku in self.all_skus:
-                full_key = f"{sku['product_code']}_{sku['color']}_{sku['size']}"
-                
-                # 获取数量，默认为0
-                qty = store_data['raw_sku_quantities'].get(full_key, 0)
-                
-                pattern_vector.append(qty)
-                full_quantities[full_key] = qty
+        # 2. 按SKU id填充矩阵，列号即目录id
+        matrix = np.zeros((len(self.all_stores), len(self.catalog)), dtype=np.float64)
+        for product_data in self.allocation_data['products']:
+            if not product_data['stores']:
+                continue
+            src_idx, dst_ids = self._product_sku_ids(product_data)
+            if not dst_ids:
+                continue
             
-            # 更新店铺数据结构
-            store_data['pattern_vector'] = pattern_vector
-            store_data['sku_quantities'] = full_quantities
-            del store_data['raw_sku_quantities']  # 清理临时数据
+            # 该品番下各店铺的数量块（quantities与sku_columns按位置对齐）
+            block = np.array([store['quantities'] for store in product_data['stores']], dtype=np.float64)
+            rows = np.array([store_rows[store['store_code']] for store in product_data['stores']], dtype=np.intp)
             
-            all_stores.append(store_data)
+            values = block[:, src_idx]
+            if len(np.unique(rows)) == len(rows):
+                matrix[np.ix_(rows, dst_ids)] += values
+            else:
+                # 同一品番下同一店铺出现多次时逐行累加
+                np.add.at(matrix, (rows[:, None], np.array(dst_ids)[None, :]), values)
+        self.qty_matrix = matrix
+    
+    def _group_by_pattern(self):
+        """根据配比模式对店铺进行分组"""
+        all_stores = self.all_stores
+        matrix = self.qty_matrix
+        if not all_stores or not len(self.catalog):
+            return
         
-        # 3. 按配比模式分组
-        pattern_groups = defaultdict(list)
+        # 清洗后重复的SKU只计一次
+        unique_columns = np.array(self.catalog.first_ids(), dtype=np.intp)
         
-        for store in all_stores:
-            # 使用配比向量的tuple作为分组key
-            # 注意：不再包含 type，完全由配比向量决定分组
-            pattern_key = tuple(store['pattern_vector'])
-            pattern_groups[pattern_key].append(store)
+        # 1. 按配比模式分组（完全由配比向量决定，不包含 type）
+        # 以矩阵行的字节串作为分组key，dict保持首次出现顺序，PT编号与原来一致
+        pattern_groups = {}
+        for row_idx in range(len(all_stores)):
+            pattern_groups.setdefault(matrix[row_idx].tobytes(), []).append(row_idx)
         
-        # 4. 转换为PT组列表
+        # 2. 转换为PT组列表
         pt_index = 1
-        for pattern_key, stores in pattern_groups.items():
-            # 计算该PT的总枚数 (应为单个店铺的配货总数)
-            # 因为同组内所有店铺的配货模式都一样，所以取第一个店铺的总数即可
-            # 注意：之前的逻辑是 sum(sum(store...)) 计算了该组所有店铺的总和，这是错误的
+        for member_rows in pattern_groups.values():
+            stores = [all_stores[i] for i in member_rows]
             
-            if not stores:
-                continue
-                
-            # 取第一个店铺计算单店总配货量
-            first_store = stores[0]
-            pt_total_qty = sum(first_store['sku_quantities'].values())
+            # 取第一个店铺计算单店总配货量（同组内所有店铺配货模式相同）
+            first_row = matrix[member_rows[0]]
+            pt_total_qty = first_row[unique_columns].sum()
             
             # 如果总数量为0，跳过（可能是空配比）
             if pt_total_qty == 0:
                 continue
 
+            # 稀疏配比：非零列号（对应self.all_skus的下标，升序）和数量
+            # 组内店铺共用同一份列表，不再为每个店铺保存全量SKU的稠密字典
+            nonzero_cols = np.flatnonzero(first_row)
+            sku_ids = nonzero_cols.tolist()
+            sku_qtys = first_row[nonzero_cols].tolist()
+            for store in stores:
+                store['sku_ids'] = sku_ids
+                store['sku_qtys'] = sku_qtys
+
             self.pt_groups.append({
                 'pt_name': f'PT-{pt_index}',
-                'pattern_vector': list(pattern_key),
+                'sku_ids': sku_ids,
+                'sku_qtys': sku_qtys,
                 'stores': stores,
                 'total_qty': int(pt_total_qty) # 这里存储的是单店配货总数，用于表头显示
             })
             pt_index += 1
     
-    def _build_pattern_vector(self, product_code: str, sku_quantities: Dict) -> List[float]:
-        """
-        构建配比向量（按照排序后的SKU顺序）
-        
-        Args:
-            product_code: 当前店铺数据所属的品番
-            sku_quantities: 店铺的SKU配货数量（key格式: "color_size"）
-            
-        Returns:
-            配比数量列表，顺序与self.all_skus一致
-        """
-        pattern = []
-        
-        for sku in self.all_skus:
-            # 只考虑当前品番的SKU
-            sku_key = f"{sku['color']}_{sku['size']}"
-            
-            # 如果是当前品番且有配货数量，使用该数量；否则为0
-            if sku['product_code'] == product_code and sku_key in sku_quantities:
-                qty = sku_quantities[sku_key]
-            else:
-                qty = 0
-            
-            pattern.append(qty)
-        
-        return pattern
-    
-    def _build_full_sku_quantities(self, product_code: str, sku_quantities: Dict) -> Dict:
-        """
-        构建完整的SKU数量字典（包含所有SKU，按照排序后的顺序）
-        
-        Args:
-            product_code: 当前店铺数据所属的品番
-            sku_quantities: 店铺的SKU配货数量
-            
-        Returns:
-            完整的SKU数量字典，key格式: "product_color_size"
-        """
-        full_quantities = {}
-        
-        for sku in self.all_skus:
-            sku_full_key = f"{sku['product_code']}_{sku['color']}_{sku['size']}"
-            sku_key = f"{sku['color']}_{sku['size']}"
-            
-            # 如果是当前品番且有配货，使用该数量
-            if sku['product_code'] == product_code and sku_key in sku_quantities:
-                full_quantities[sku_full_key] = sku_quantities[sku_key]
-            else:
-                full_quantities[sku_full_key] = 0
-        
-        return full_quantities
-    
     def _assign_ctn_numbers(self):
         """为每个PT组中的店铺分配箱号"""
         global_seq_no = 1 # 全局顺序编号，从0001开始
@@ -371,5 +415,5 @@ class DataTransformer:
                 store['ctn_no'] = self.ctn_counter
                 self.ctn_counter += 1
                 
-                # 计算该箱的合计数量
-                store['total_qty'] = int(sum(store['sku_quantities'].values()))
+                # 该箱的合计数量（同组店铺配比相同，等于单店配货总数）
+                store['total_qty'] = pt_group['total_qty']
@@ -2,33 +2,43 @@
 # -*- coding: utf-8 -*-
 """
 受渡伝票生成模块 - 将填写了箱号的配分表转换为受渡伝票格式
+
+除了写入Excel模板，也可以直接输出上传系统用的CSV/TSV（不经过openpyxl，大量明细时快得多）。
 """
-import openpyxl
-from openpyxl import load_workbook
-import xlrd
-from typing import Dict, List, Optional
+import csv
+from operator import itemgetter
+from typing import Optional
 import os
-from config import TemplateConfig, DeliveryNoteConfig
+from config import DeliveryNoteConfig, PTSheetConfig
+from template_cache import template_cache
+from pt_sheet_parser import PTSheet, PTWorkbook, pt_parse_cache
 
 class DeliveryNoteGenerator:
     """受渡伝票生成器"""
     
-    def __init__(self, input_path: str, template_path: str, output_path: str, start_no: int = None, prefix: str = "81"):
+    def __init__(self, input_path: str, template_path: str, output_path: str, start_no: int = None, prefix: str = "81",
+                 output_format: str = "xlsx", encoding: str = "utf-8", pt_book: Optional[PTWorkbook] = None):
         """
         初始化生成器
         
         Args:
             input_path: 输入文件路径（填写了箱号的配分表）
-            template_path: 模板文件路径（受渡伝票模板）
+            template_path: 模板文件路径（受渡伝票模板，输出CSV/TSV时不使用）
             output_path: 输出文件路径
             start_no: 起始编号 (可选)
             prefix: 受渡伝票NO前缀 (默认 "81")
+            output_format: 输出格式 "xlsx"（写入模板）/ "csv" / "tsv"
+            encoding: CSV/TSV的编码 "utf-8" / "shift_jis"
+            pt_book: 已解析的输入文件（pt_sheet_parser），None时按input_path解析
         """
         self.input_path = input_path
         self.template_path = template_path
         self.output_path = output_path
         self.start_no = start_no
         self.prefix = prefix
+        self.output_format = output_format
+        self.encoding = encoding
+        self.pt_book = pt_book
         self.data_rows = []
 
     def process(self):
@@ -36,231 +46,74 @@ class DeliveryNoteGenerator:
         # 1. 读取输入文件数据
         self._read_input_data()
         
-        # 2. 写入到输出模板
-        self._write_to_template()
+        # 2. 写入到输出模板（或直接输出CSV/TSV）
+        if self.output_format in DeliveryNoteConfig.TEXT_EXPORT_DELIMITERS:
+            self._write_text()
+        elif self.output_format == "xlsx":
+            self._write_to_template()
+        else:
+            raise ValueError(f"Unsupported output format: {self.output_format}")
         
         return self.output_path
 
     def _read_input_data(self):
-        """读取输入文件中的数据"""
+        """读取输入文件中的数据（PT页由共用的解析器解析，同一文件只解析一次）"""
         print(f"Reading input file: {self.input_path}")
+        book = self.pt_book or pt_parse_cache.load(self.input_path)
         
-        # 根据文件扩展名选择读取方式
-        ext = os.path.splitext(self.input_path)[1].lower()
-        
-        if ext in ['.xlsx', '.xlsm']:
-            self._read_xlsx()
-        elif ext == '.xls':
-            self._read_xls()
-        else:
-            raise ValueError(f"Unsupported file format: {ext}")
-            
-    def _read_xlsx(self):
-        """使用openpyxl读取xlsx文件"""
-        wb = load_workbook(self.input_path, data_only=True)
-        
-        # 遍历所有PT sheet
-        for sheet_name in wb.sheetnames:
-            # 假设PT sheet名称包含 "PT-"
-            if "PT-" not in sheet_name:
+        # 遍历所有PT sheet（名称包含 "PT-"）
+        for sheet in book.sheets:
+            if PTSheetConfig.SHEET_NAME_MARK not in sheet.title:
                 continue
-                
-            ws = wb[sheet_name]
-            self._process_sheet_data_openpyxl(ws)
+            self._process_sheet(sheet)
 
-    def _process_sheet_data_openpyxl(self, ws):
-        """处理单个sheet的数据 (openpyxl)"""
-        # 1. 提取元数据 (Kanri No -> Brand)
-        # E1 cell
-        kanri_no = str(ws['E1'].value).strip() if ws['E1'].value else ""
-        brand = kanri_no[:3] if len(kanri_no) >= 3 else kanri_no
-        
-        # 2. 提取SKU信息 (Row 2, 3, 4, Cols from I/8)
-        # Row 2: Product Code (F2 is label, values start from I2)
-        # Row 3: Color (F3 is label, values start from I3)
-        # Row 4: Size (F4 is label, values start from I4)
-        
-        sku_map = {} # col_index -> {product_code, color, size}
-        
-        # Determine how many columns to read
-        # Assuming data starts at col index 8 (Column I)
-        current_col = 8
-        while True:
-            # Check if there is data in header rows
-            prod_code = ws.cell(row=2, column=current_col+1).value
-            if not prod_code:
-                break
-                
-            color = ws.cell(row=3, column=current_col+1).value
-            size = ws.cell(row=4, column=current_col+1).value
-            
-            sku_map[current_col] = {
-                'product_code': str(prod_code),
-                'color': str(color) if color is not None else "",
-                'size': str(size) if size is not None else ""
-            }
-            current_col += 1
-            
-        # 3. 遍历数据行 (从 Row 6 / index 5 开始)
-        # Col D (3): Store Code
-        # Col F (5): CTN_NO
-        # Col I (8) ~: SKU Quantities
-        
-        row_idx = 5
-        # Removed auto-increment current_no
-        # current_no = self.start_no if self.start_no is not None else None
-
-        while row_idx < ws.max_row:
-            row_num = row_idx + 1
-            store_code = ws.cell(row=row_num, column=4).value # Col D
-            ctn_no_raw = ws.cell(row=row_num, column=6).value # Col F
-            
-            # 停止条件：如果store_code为空，假设数据结束
+    def _process_sheet(self, sheet: PTSheet):
+        """处理单个PT页的箱表"""
+        # 1. 元数据：管理No(E1)前3位作为ブランド
+        brand = sheet.kanri_no[:3]
+        skus = sheet.skus
+        
+        # 2. 遍历数据行 (从 Row 6 开始)
+        # Col D: Store Code / Col F: CTN_NO / Col I~: SKU Quantities
+        for i in range(len(sheet)):
+            store_code = sheet.store_codes[i]
+            
+            # 停止条件：store_code为空时，遇到合计行或A列也为空的行即结束
             if not store_code:
-                # 尝试检查下一行，或者直接结束
-                # 这里简单判断：如果是空行则跳过或结束
-                # 但配分表中间通常没有空行，直到合计行
-                # 检查是否是合计行
-                first_col_val = ws.cell(row=row_num, column=1).value
-                if first_col_val and "合计" in str(first_col_val):
-                    break
-                if not first_col_val and not store_code:
+                first_col_val = sheet.first_col[i]
+                if not first_col_val or "合计" in str(first_col_val):
                     break
-                    
-                row_idx += 1
                 continue
 
             # 必须有 CTN_NO 才处理 (作为行有效的标志)
-            if ctn_no_raw:
-                try:
-                    ctn_no_int = int(ctn_no_raw)
-                    
-                    # Logic update: Use start_no as offset if provided
-                    if self.start_no is not None:
-                         # 逻辑：seq = start_no + (ctn_no - 1)
-                         # 假设 ctn_no 从 1 开始
-                         seq_no = self.start_no + (ctn_no_int - 1)
-                         slip_no = f"{self.prefix}{seq_no:04d}"
-                    else:
-                         slip_no = f"{self.prefix}{ctn_no_int:04d}"
-                    
-                    # 遍历SKU列，提取数量 > 0 的记录
-                    for col_idx, sku_info in sku_map.items():
-                        qty = ws.cell(row=row_num, column=col_idx+1).value
-                        if qty and isinstance(qty, (int, float)) and qty > 0:
-                            # 添加一条记录
-                            self.data_rows.append({
-                                'slip_no': slip_no,
-                                'brand': brand,
-                                'store_code': str(store_code),
-                                'product_code': sku_info['product_code'],
-                                'size': sku_info['size'],
-                                'color': sku_info['color'],
-                                'qty': int(qty)
-                            })
-                except ValueError:
-                    print(f"Warning: Invalid CTN_NO '{ctn_no_raw}' at row {row_num}")
-            
-            row_idx += 1
-
-    def _read_xls(self):
-        """使用xlrd读取xls文件"""
-        wb = xlrd.open_workbook(self.input_path)
-        
-        for sheet in wb.sheets():
-            if "PT-" not in sheet.name:
+            ctn_no_raw = sheet.ctn_nos[i]
+            if not ctn_no_raw:
                 continue
-            self._process_sheet_data_xlrd(sheet)
-
-    def _process_sheet_data_xlrd(self, sheet):
-        """处理单个sheet的数据 (xlrd)"""
-        # 1. 提取元数据
-        try:
-            kanri_no = str(sheet.cell_value(0, 4)).strip() # E1 -> (0, 4)
-            brand = kanri_no[:3] if len(kanri_no) >= 3 else kanri_no
-        except:
-            brand = ""
-            
-        # 2. 提取SKU信息
-        sku_map = {}
-        current_col = 8 # Col I
-        
-        while current_col < sheet.ncols:
-            try:
-                prod_code = sheet.cell_value(1, current_col) # Row 2
-                if not prod_code:
-                    break
-                
-                color = sheet.cell_value(2, current_col) # Row 3
-                size = sheet.cell_value(3, current_col) # Row 4
-                
-                # xlrd 读取数字可能是 float
-                if isinstance(color, float): color = str(int(color))
-                if isinstance(size, float): size = str(int(size))
-                if isinstance(prod_code, float): prod_code = str(int(prod_code))
-                
-                sku_map[current_col] = {
-                    'product_code': str(prod_code),
-                    'color': str(color),
-                    'size': str(size)
-                }
-                current_col += 1
-            except IndexError:
-                break
-                
-        # 3. 遍历数据
-        row_idx = 5 # Row 6
-        # Removed auto-increment current_no
-        # current_no = self.start_no if self.start_no is not None else None
-
-        while row_idx < sheet.nrows:
             try:
-                store_code = sheet.cell_value(row_idx, 3) # Col D
-                ctn_no_raw = sheet.cell_value(row_idx, 5) # Col F
-                
-                if not store_code:
-                    # Check for total row or end
-                    first_val = sheet.cell_value(row_idx, 0)
-                    if "合计" in str(first_val):
-                        break
-                    row_idx += 1
-                    continue
-                    
-                if ctn_no_raw:
-                    try:
-                        ctn_no_val = 0
-                        if isinstance(ctn_no_raw, (int, float)):
-                            ctn_no_val = int(ctn_no_raw)
-                        elif isinstance(ctn_no_raw, str) and ctn_no_raw.strip().isdigit():
-                            ctn_no_val = int(ctn_no_raw)
-                            
-                        if ctn_no_val > 0:
-                            if self.start_no is not None:
-                                seq_no = self.start_no + (ctn_no_val - 1)
-                                slip_no = f"{self.prefix}{seq_no:04d}"
-                            else:
-                                slip_no = f"{self.prefix}{ctn_no_val:04d}"
-                            
-                            for col_idx, sku_info in sku_map.items():
-                                qty = sheet.cell_value(row_idx, col_idx)
-                                if qty and isinstance(qty, (int, float)) and qty > 0:
-                                    if isinstance(store_code, float): store_code = str(int(store_code))
-                                    
-                                    self.data_rows.append({
-                                        'slip_no': slip_no,
-                                        'brand': brand,
-                                        'store_code': str(store_code),
-                                        'product_code': sku_info['product_code'],
-                                        'size': sku_info['size'],
-                                        'color': sku_info['color'],
-                                        'qty': int(qty)
-                                    })
-                    except ValueError:
-                        pass
-            except IndexError:
-                break
+                ctn_no_int = int(ctn_no_raw)
+            except (TypeError, ValueError):
+                print(f"Warning: Invalid CTN_NO '{ctn_no_raw}' at row {sheet.row_nums[i]}")
+                continue
             
-            row_idx += 1
+            # 指定start_no时作为偏移：seq = start_no + (ctn_no - 1)，假设 ctn_no 从 1 开始
+            if self.start_no is not None:
+                slip_no = f"{self.prefix}{self.start_no + (ctn_no_int - 1):04d}"
+            else:
+                slip_no = f"{self.prefix}{ctn_no_int:04d}"
+            store_code = str(store_code)
+            
+            # 数量 > 0 的SKU各记一条
+            for sku_idx, qty in sheet.quantities(i):
+                sku_info = skus[sku_idx]
+                self.data_rows.append({
+                    'slip_no': slip_no,
+                    'brand': brand,
+                    'store_code': store_code,
+                    'product_code': sku_info['product_code'],
+                    'size': sku_info['size'],
+                    'color': sku_info['color'],
+                    'qty': qty
+                })
 
     def _write_to_template(self):
         """写入数据到输出模板"""
@@ -290,7 +143,7 @@ class DeliveryNoteGenerator:
                  # 或者我们可以尝试 "升级" 模板
                  raise ValueError("Template must be .xlsx format for writing. Please save the template as .xlsx.")
 
-        wb = load_workbook(self.template_path)
+        wb = template_cache.load(self.template_path)
         ws = wb.active # 假设写入第一个sheet
         
         # 开始写入
@@ -334,4 +187,20 @@ class DeliveryNoteGenerator:
                 pass
 
         print(f"Saving output file: {self.output_path}")
-        wb.save(self.output_path)
\ No newline at end of file
+        wb.save(self.output_path)
+
+    def _write_text(self):
+        """按上传列顺序输出CSV/TSV（不使用模板和openpyxl）"""
+        encoding = DeliveryNoteConfig.TEXT_EXPORT_ENCODINGS.get(self.encoding)
+        if encoding is None:
+            raise ValueError(f"Unsupported encoding: {self.encoding}")
+        delimiter = DeliveryNoteConfig.TEXT_EXPORT_DELIMITERS[self.output_format]
+        headers = [header for header, _ in DeliveryNoteConfig.TEXT_EXPORT_COLUMNS]
+        get_values = itemgetter(*[key for _, key in DeliveryNoteConfig.TEXT_EXPORT_COLUMNS])
+
+        print(f"Saving output file: {self.output_path}")
+        with open(self.output_path, "w", newline="", encoding=encoding) as f:
+            writer = csv.writer(f, delimiter=delimiter)
+            if DeliveryNoteConfig.TEXT_EXPORT_HEADER:
+                writer.writerow(headers)
+            writer.writerows(map(get_values, self.data_rows))
@@ -5,22 +5,37 @@ Excel读取模块 - 读取配分表数据
 """
 import xlrd
 import openpyxl
-from config import AllocationTableConfig, DetailTableConfig, TemplateConfig
-from typing import Dict, List, Tuple
+from config import AllocationTableConfig, DetailTableConfig, PTSheetConfig
+from typing import Dict, Iterator, List, Optional, Tuple
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
 import pandas as pd
-from openpyxl import load_workbook
 import logging
+import time
+import tracemalloc
+from pt_sheet_parser import PTSheet, PTWorkbook, pt_parse_cache
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 配分表读取结果的结构版本（结构变化时递增，使解析缓存失效）
+READER_VERSION = 2
+
 
 class BoxSettingReader:
     """读取工厂返回的箱设定明细表（经过人工分箱处理）"""
     
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, pt_book: Optional[PTWorkbook] = None):
+        """
+        Args:
+            file_path: 箱设定文件路径
+            pt_book: 已解析的文件（pt_sheet_parser），None时按file_path解析
+        """
         self.file_path = file_path
+        self.pt_book = pt_book
         
     def read(self) -> List[Dict]:
         """
@@ -31,28 +46,17 @@ class BoxSettingReader:
         """
         try:
             logger.info(f"Loading box setting file: {self.file_path}")
-            wb = load_workbook(self.file_path, data_only=True)
+            book = self.pt_book or pt_parse_cache.load(self.file_path)
             all_boxes = []
             
-            for sheet_name in wb.sheetnames:
-                # 跳过商品一覧页
-                if sheet_name == TemplateConfig.PRODUCT_LIST_SHEET:
-                    continue
-                
-                sheet = wb[sheet_name]
-                
-                # 验证是否为PT页 (检查表头 A5)
-                # 1-indexed: Row 5, Col 1
-                header_cell = sheet.cell(row=TemplateConfig.PT_DATA_HEADER_ROW + 1, column=TemplateConfig.PT_COL_NO + 1)
-                # 注意：TemplateWriter可能写入的是"No."，也可能只是该行开始数据
-                # Check header value explicitly
-                # Writer: sheet.cell(row=5, column=1).value = "No."
-                if header_cell.value != "No.":
-                    logger.debug(f"Skipping sheet {sheet_name}: Not a PT sheet (A5 != No.)")
+            for sheet in book.sheets:
+                # 验证是否为PT页 (检查表头 A5 == "No.")
+                if sheet.header_label != PTSheetConfig.HEADER_LABEL:
+                    logger.debug(f"Skipping sheet {sheet.title}: Not a PT sheet (A5 != No.)")
                     continue
                     
-                logger.info(f"Processing sheet: {sheet_name}")
-                sheet_boxes = self._process_sheet(sheet, sheet_name)
+                logger.info(f"Processing sheet: {sheet.title}")
+                sheet_boxes = self._process_sheet(sheet)
                 all_boxes.extend(sheet_boxes)
             
             logger.info(f"Total boxes loaded: {len(all_boxes)}")
@@ -62,92 +66,59 @@ class BoxSettingReader:
             logger.error(f"Error reading box setting file: {e}")
             raise
 
-    def _process_sheet(self, sheet, sheet_name) -> List[Dict]:
-        """处理单个PT页"""
-        # 1. 读取SKU列定义
-        skus = []
-        col_idx = 0
-        while True:
-            # 1-indexed column
-            col = TemplateConfig.PT_SKU_START_COL + 1 + col_idx
-            
-            # 检查是否有品番 (Row 2)
-            prod_code = sheet.cell(row=2, column=col).value
-            if not prod_code:
-                break
-                
-            skus.append({
-                'product_code': str(prod_code),
-                'jan_code': str(sheet.cell(row=1, column=col).value or ''),
-                'color': str(sheet.cell(row=3, column=col).value or ''),
-                'size': str(sheet.cell(row=4, column=col).value or '')
-            })
-            col_idx += 1
+    def _process_sheet(self, sheet: PTSheet) -> List[Dict]:
+        """处理单个PT页的箱表"""
+        # 1. SKU列定义：メーカー品番 = 品番-カラー-サイズ
+        maker_codes = [f"{sku['product_code']}-{sku['color']}-{sku['size']}" for sku in sheet.skus]
             
-        # 2. 读取元数据
+        # 2. 元数据
         # E1: 管理No
-        kanri_no = str(sheet.cell(row=1, column=5).value or '')
+        kanri_no = sheet.kanri_no
         # E4: 納期 (这里作为 Store Date / Delivery Date)
-        delivery_date = str(sheet.cell(row=4, column=5).value or '')
+        delivery_date = str(sheet.delivery_date or '')
+        dept = kanri_no[:3]
         
         # 3. 读取数据行
         box_map = {} # Key: ctn_no -> BoxData
+        item_index = {} # Key: ctn_no -> {maker_code: item}（同一箱跨多行时按SKU合并）
         
-        row = TemplateConfig.PT_DATA_START_ROW + 1 # Row 6
         last_ctn_no = None
         last_store_code = None
         last_store_name = None
         last_pattern = None
+        row_count = len(sheet)
         
-        while row <= sheet.max_row:
-            # 检查 CTN_NO 列 (F列, Col 6)
-            ctn_no_val = sheet.cell(row=row, column=TemplateConfig.PT_COL_CTN_NO + 1).value
-            store_code_val = sheet.cell(row=row, column=TemplateConfig.PT_COL_STORE_CODE + 1).value
+        for i in range(row_count):
+            # 检查 CTN_NO 列 (F列) 和 コード列 (D列)
+            ctn_no_val = sheet.ctn_nos[i]
+            store_code_val = sheet.store_codes[i]
             
             # 如果整行关键数据为空，可能是空行，也可能是结束
             if ctn_no_val is None and store_code_val is None:
-                # 检查是否所有SKU数据也为空，如果是，则跳过
-                is_empty = True
-                for i in range(len(skus)):
-                    if sheet.cell(row=row, column=TemplateConfig.PT_SKU_START_COL + 1 + i).value:
-                        is_empty = False
-                        break
-                
-                if is_empty:
-                    # 连续空行超过10行则停止
-                    # 这里简单判断：如果后面还有数据则继续，否则结束？
-                    # 为简单起见，如果 A列 No. 也没了，就结束
-                    if sheet.cell(row=row, column=1).value is None:
-                        # 再次确认下一行，防止中间空行
-                        if sheet.cell(row=row+1, column=1).value is None:
+                if not sheet.sku_filled[i]:
+                    # SKU数据也为空：A列 No. 连续两行为空则结束，否则跳过中间的空行
+                    if sheet.first_col[i] is None:
+                        if i + 1 >= row_count or sheet.first_col[i + 1] is None:
                             break
-                    row += 1
                     continue
                 
                 # 如果有SKU数据但没有CTN/Store，假设是上一行的延续
-                if last_ctn_no is not None:
-                    ctn_no_val = last_ctn_no
-                    store_code_val = last_store_code
-                else:
-                    row += 1
+                if last_ctn_no is None:
                     continue
             else:
                 # 更新上下文
                 last_ctn_no = ctn_no_val
                 last_store_code = store_code_val
-                last_store_name = sheet.cell(row=row, column=TemplateConfig.PT_COL_STORE_NAME + 1).value
-                last_pattern = sheet.cell(row=row, column=TemplateConfig.PT_COL_PATTERN + 1).value
+                last_store_name = sheet.store_names[i]
+                last_pattern = sheet.patterns[i]
             
             # 确保有 ctn_no
             if not last_ctn_no:
-                row += 1
                 continue
                 
             key = str(last_ctn_no)
             
             if key not in box_map:
-                dept = kanri_no[:3] if len(kanri_no) >= 3 else kanri_no
-                
                 box_map[key] = {
                     'ctn_no': last_ctn_no,
                     'store_code': last_store_code,
@@ -160,30 +131,28 @@ class BoxSettingReader:
                     'total_qty': 0,
                     'items': []
                 }
-            
-            # 读取SKU数据
-            for i, sku in enumerate(skus):
-                qty_col = TemplateConfig.PT_SKU_START_COL + 1 + i
-                qty_val = sheet.cell(row=row, column=qty_col).value
+                item_index[key] = {}
+            box = box_map[key]
+            items = item_index[key]
+            
+            # 读取SKU数据（只有数量>0的格子）
+            for sku_idx, qty in sheet.quantities(i):
+                maker_code = maker_codes[sku_idx]
+                # 已存在该SKU时合并数量 (合并多行情况)
+                existing_item = items.get(maker_code)
                 
-                if qty_val and isinstance(qty_val, (int, float)) and qty_val > 0:
-                    qty = int(qty_val)
-                    # 查找是否已存在该SKU (合并多行情况)
-                    existing_item = next((item for item in box_map[key]['items'] 
-                                        if item['maker_code'] == f"{sku['product_code']}-{sku['color']}-{sku['size']}"), None)
-                    
-                    if existing_item:
-                        existing_item['qty'] += qty
-                    else:
-                        box_map[key]['items'].append({
-                            'maker_code': f"{sku['product_code']}-{sku['color']}-{sku['size']}",
-                            'product_name': '',
-                            'qty': qty
-                        })
-                    
-                    box_map[key]['total_qty'] += qty
-            
-            row += 1
+                if existing_item:
+                    existing_item['qty'] += qty
+                else:
+                    item = {
+                        'maker_code': maker_code,
+                        'product_name': '',
+                        'qty': qty
+                    }
+                    items[maker_code] = item
+                    box['items'].append(item)
+                
+                box['total_qty'] += qty
             
         return list(box_map.values())
 
@@ -203,177 +172,323 @@ class DetailTableReader:
             Dict: {(品番, カラー, サイズ): JANCODE}
         """
         try:
-            # 智能判断文件类型读取
-            file_path_lower = file_path.lower()
-            
-            if file_path_lower.endswith('.csv') or file_path_lower.endswith('.txt'):
-                # 尝试不同的分隔符和编码
-                try:
-                    # 优先尝试制表符分隔（常见于系统导出）
-                    df = pd.read_csv(file_path, sep='\t', dtype=str)
-                    # 如果只有一列，可能不是制表符，尝试逗号
-                    if len(df.columns) < 2:
-                        df = pd.read_csv(file_path, sep=',', dtype=str)
-                except:
-                    # 如果UTF-8失败，尝试GBK/Shift-JIS
-                    try:
-                        df = pd.read_csv(file_path, sep='\t', encoding='shift-jis', dtype=str)
-                    except:
-                        df = pd.read_csv(file_path, sep='\t', encoding='gbk', dtype=str)
-            else:
-                # 默认为 Excel
-                df = pd.read_excel(file_path, dtype=str)
-            
-            # 清理列名（去除空白）
-            df.columns = df.columns.str.strip()
-            
-            # 检查必要的列是否存在
-            required_cols = [
-                DetailTableConfig.COL_PRODUCT_CODE,
-                DetailTableConfig.COL_COLOR,
-                DetailTableConfig.COL_SIZE,
-                DetailTableConfig.COL_JAN
-            ]
-            
-            for col in required_cols:
-                if col not in df.columns:
-                    raise ValueError(f"明细表中缺少列: {col}")
-            
-            # 构建映射字典
-            jan_map = {}
-            for _, row in df.iterrows():
-                # 转换为字符串并去除空白
-                product_code = str(row[DetailTableConfig.COL_PRODUCT_CODE]).strip()
-                # 处理颜色：去除小数点（如果是浮点数）
-                color_val = row[DetailTableConfig.COL_COLOR]
-                # 由于读取时指定了 dtype=str，这里通常是字符串，但为了保险起见保留处理逻辑
-                # 如果是字符串形式的浮点数 "403.0"，split处理
-                if isinstance(color_val, str):
-                    if '.' in color_val:
-                        try:
-                            color = str(int(float(color_val)))
-                        except:
-                            color = color_val.strip()
-                    else:
-                        color = color_val.strip()
-                elif isinstance(color_val, float) and color_val.is_integer():
-                    color = str(int(color_val))
-                else:
-                    color = str(color_val).strip()
-                    
-                # 处理尺码
-                size_val = row[DetailTableConfig.COL_SIZE]
-                if isinstance(size_val, str):
-                    if '.' in size_val:
-                         try:
-                            size = str(int(float(size_val)))
-                         except:
-                            size = size_val.strip()
-                    else:
-                        size = size_val.strip()
-                elif isinstance(size_val, float) and size_val.is_integer():
-                    size = str(int(size_val))
-                else:
-                    size = str(size_val).strip()
-                
-                # 处理JAN：去除小数点
-                jan_val = row[DetailTableConfig.COL_JAN]
-                if pd.notna(jan_val):
-                    if isinstance(jan_val, str):
-                        if '.' in jan_val:
-                            try:
-                                jan = str(int(float(jan_val)))
-                            except:
-                                jan = jan_val.strip()
-                        else:
-                            jan = jan_val.strip()
-                    elif isinstance(jan_val, float):
-                        jan = str(int(jan_val))
-                    else:
-                        jan = str(jan_val).strip()
-                else:
-                    jan = ""
-                
-                key = (product_code, color, size)
-                if jan:
-                    jan_map[key] = jan
-            
-            return jan_map
+            df = DetailTableReader._load_frame(file_path)
+            return DetailTableReader.build_jan_map(df)
             
         except Exception as e:
             raise Exception(f"读取明细表失败: {e}")
 
+    @staticmethod
+    def _load_frame(file_path: str) -> pd.DataFrame:
+        """读取明细表为DataFrame（全部按字符串读取），并检查必要的列"""
+        # 智能判断文件类型读取
+        file_path_lower = file_path.lower()
+        
+        if file_path_lower.endswith('.csv') or file_path_lower.endswith('.txt'):
+            # 尝试不同的分隔符和编码
+            try:
+                # 优先尝试制表符分隔（常见于系统导出）
+                df = pd.read_csv(file_path, sep='\t', dtype=str)
+                # 如果只有一列，可能不是制表符，尝试逗号
+                if len(df.columns) < 2:
+                    df = pd.read_csv(file_path, sep=',', dtype=str)
+            except:
+                # 如果UTF-8失败，尝试GBK/Shift-JIS
+                try:
+                    df = pd.read_csv(file_path, sep='\t', encoding='shift-jis', dtype=str)
+                except:
+                    df = pd.read_csv(file_path, sep='\t', encoding='gbk', dtype=str)
+        else:
+            # 默认为 Excel
+            df = pd.read_excel(file_path, dtype=str)
+        
+        # 清理列名（去除空白）
+        df.columns = df.columns.str.strip()
+        
+        # 检查必要的列是否存在
+        required_cols = [
+            DetailTableConfig.COL_PRODUCT_CODE,
+            DetailTableConfig.COL_COLOR,
+            DetailTableConfig.COL_SIZE,
+            DetailTableConfig.COL_JAN
+        ]
+        
+        for col in required_cols:
+            if col not in df.columns:
+                raise ValueError(f"明细表中缺少列: {col}")
+        
+        return df
+
+    @staticmethod
+    def build_jan_map(df: pd.DataFrame) -> Dict[Tuple[str, str, str], str]:
+        """
+        由明细表DataFrame构建 JANCODE 映射字典（按列向量化处理）
+        
+        规范化规则与逐行处理时一致：
+        - 品番: str() 后去除空白（空值为 'nan'）
+        - カラー/サイズ: 含小数点的数字串按 int(float()) 截断（"403.0" -> "403"），其余去除空白
+        - JAN: 同上，空值或空串不记录
+        同一键重复出现时以后出现的为准。
+        """
+        product_codes = df[DetailTableConfig.COL_PRODUCT_CODE].astype(str).str.strip()
+        colors = DetailTableReader._normalize_code_series(df[DetailTableConfig.COL_COLOR])
+        sizes = DetailTableReader._normalize_code_series(df[DetailTableConfig.COL_SIZE])
+        jans = DetailTableReader._normalize_code_series(df[DetailTableConfig.COL_JAN], is_jan=True)
+        
+        # 构建映射字典
+        has_jan = jans != ''
+        keys = zip(product_codes.to_numpy()[has_jan], colors[has_jan], sizes[has_jan])
+        return dict(zip(keys, jans[has_jan]))
+
+    # 形如 "403.0" / "4547810000001.00" 的数字串：直接去掉小数部分
+    # 位数限制在float可精确表示的范围内，超出的交给逐个处理以保持与 int(float()) 相同的结果
+    _INTEGER_FLOAT_PATTERN = r'^[0-9]{1,15}\.0*$'
+
+    @staticmethod
+    def _normalize_code_series(values: pd.Series, is_jan: bool = False) -> np.ndarray:
+        """
+        向量化规范化编码列（カラー/サイズ/JAN）
+        
+        カラー/サイズ的取值种类很少，先按唯一值规范化再映射回各行。
+        
+        Args:
+            values: 原始列（dtype=str读取，元素为字符串或NaN）
+            is_jan: JAN列的规则：空值记为空串，非字符串的float直接截断为整数
+        
+        Returns:
+            与输入等长的规范化结果数组
+        """
+        values = values.astype(object).to_numpy()
+        codes, uniques = pd.factorize(values)
+        normalized = DetailTableReader._normalize_unique_codes(uniques, is_jan)
+        
+        result = np.empty(len(values), dtype=object)
+        valid = codes >= 0
+        result[valid] = normalized[codes[valid]]
+        
+        # 空值：JAN记为空串，其余与 str() 结果一致（'nan'）
+        if is_jan:
+            result[~valid] = ''
+        elif not valid.all():
+            result[~valid] = [str(v).strip() for v in values[~valid]]
+        
+        return result
+
+    @staticmethod
+    def _normalize_unique_codes(uniques: np.ndarray, is_jan: bool) -> np.ndarray:
+        """规范化去重后的编码值（不含空值）"""
+        values = pd.Series(uniques, dtype=object)
+        is_str = np.fromiter((type(v) is str for v in uniques), dtype=bool, count=len(uniques))
+        
+        result = pd.Series(np.full(len(values), '', dtype=object))
+        
+        text = values[is_str]
+        stripped = text.str.strip()
+        result[is_str] = stripped
+        
+        # 含小数点的字符串：先走整数后缀快速路径，其余逐个按 int(float()) 处理
+        has_dot = text.str.contains('.', regex=False)
+        if has_dot.any():
+            dotted = stripped[has_dot]
+            simple = dotted.str.match(DetailTableReader._INTEGER_FLOAT_PATTERN)
+            integer_part = dotted[simple].str.split('.', n=1).str[0].str.lstrip('0')
+            result[integer_part.index] = integer_part.where(integer_part != '', '0')
+            
+            rest = text[has_dot][~simple]
+            if len(rest):
+                result[rest.index] = [DetailTableReader._normalize_code_value(v) for v in rest]
+        
+        # 其他类型（Excel读取时偶尔出现的数值）逐个处理
+        others = ~is_str
+        if others.any():
+            result[others] = [DetailTableReader._normalize_code_value(v, truncate_float=is_jan)
+                              for v in values[others]]
+        
+        return result.to_numpy()
+
+    @staticmethod
+    def _normalize_code_value(val, truncate_float: bool = False) -> str:
+        """单个编码值的规范化（向量化路径无法处理的少数值）"""
+        if isinstance(val, str):
+            if '.' in val:
+                try:
+                    return str(int(float(val)))
+                except:
+                    return val.strip()
+            return val.strip()
+        if isinstance(val, float) and (truncate_float or val.is_integer()):
+            return str(int(val))
+        return str(val).strip()
+
 
 class AllocationTableReader:
     """配分表读取器"""
     
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, profile_memory: bool = False, cache=None):
         """
         初始化读取器
         
         Args:
             file_path: 配分表文件路径
+            profile_memory: 是否统计每个sheet的峰值内存（tracemalloc，会拖慢读取）
+            cache: 解析缓存（parse_cache.ParseCache），为None时不使用缓存
         """
         self.file_path = file_path
+        self.cache = cache
+        self.cache_hit = False
         self.workbook = None
         self.metadata = {}
         self.products_data = []  # 存储所有品番的数据
         self.engine = 'xlrd' # 'xlrd' or 'openpyxl'
+        self.profile_memory = profile_memory
+        self.sheet_stats = []  # 每个sheet的读取耗时/峰值内存
         
-    def read(self) -> Dict:
+    def read(self, parallel: bool = False, max_workers: int = None) -> Dict:
         """
         读取配分表文件
         
+        Args:
+            parallel: 是否把各品番sheet分给多个进程并行解析
+            max_workers: 并行进程数，默认为CPU核数
+            
         Returns:
             包含所有数据的字典
         """
+        tracing = self.profile_memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
         try:
-            if self.file_path.lower().endswith('.xlsx'):
-                return self._read_xlsx()
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.key_for(self.file_path)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"配分表解析缓存命中: {os.path.basename(self.file_path)}")
+                    self.cache_hit = True
+                    self.metadata = cached['metadata']
+                    self.products_data = cached['products']
+                    return cached
+            
+            if parallel:
+                result = self._read_parallel(max_workers)
             else:
-                return self._read_xls()
+                result = self._read_sheets()
+            
+            if cache_key is not None:
+                try:
+                    self.cache.put(cache_key, result)
+                except Exception as e:
+                    logger.warning(f"写入配分表解析缓存失败: {e}")
+            return result
                 
         except Exception as e:
             raise Exception(f"读取配分表文件失败: {e}")
+        finally:
+            if tracing:
+                tracemalloc.stop()
+
+    def _read_sheets(self, sheet_indices: List[int] = None) -> Dict:
+        """按扩展名选择引擎读取（sheet_indices为None时读取全部sheet）"""
+        if self.file_path.lower().endswith('.xlsx'):
+            return self._read_xlsx(sheet_indices)
+        else:
+            return self._read_xls(sheet_indices)
+
+    def _count_sheets(self) -> int:
+        """只读取sheet列表，获取sheet数量"""
+        if self.file_path.lower().endswith('.xlsx'):
+            workbook = openpyxl.load_workbook(self.file_path, read_only=True)
+            try:
+                return len(workbook.sheetnames)
+            finally:
+                workbook.close()
+        else:
+            workbook = xlrd.open_workbook(self.file_path, on_demand=True)
+            try:
+                return workbook.nsheets
+            finally:
+                workbook.release_resources()
+
+    def _read_parallel(self, max_workers: int = None) -> Dict:
+        """
+        多进程并行读取
+        
+        sheet按原顺序切成连续的块，每个进程自己打开文件解析一块，
+        父进程按块顺序合并，保证品番顺序和全局元数据（第一个有元数据的sheet）与串行读取一致。
+        """
+        nsheets = self._count_sheets()
+        workers = min(max_workers or os.cpu_count() or 1, nsheets)
+        if workers <= 1:
+            return self._read_sheets()
+        
+        self.engine = 'openpyxl' if self.file_path.lower().endswith('.xlsx') else 'xlrd'
+        chunk_size = -(-nsheets // workers)
+        chunks = [list(range(i, min(i + chunk_size, nsheets))) for i in range(0, nsheets, chunk_size)]
+        
+        logger.info(f"并行读取配分表: {nsheets} sheets, {len(chunks)} 进程")
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            results = list(executor.map(_read_sheets_worker, [self.file_path] * len(chunks), chunks))
+        
+        for result in results:
+            if not self.metadata and result['metadata']:
+                self.metadata = result['metadata']
+            self.products_data.extend(result['products'])
+            self.sheet_stats.extend(result['sheet_stats'])
+        
+        return {
+            'metadata': self.metadata,
+            'products': self.products_data
+        }
 
-    def _read_xls(self) -> Dict:
+    def _read_xls(self, sheet_indices: List[int] = None) -> Dict:
         """使用xlrd读取.xls文件"""
         self.engine = 'xlrd'
-        self.workbook = xlrd.open_workbook(self.file_path, formatting_info=False)
+        # 只读部分sheet时按需加载，避免每个进程都解析整个文件
+        on_demand = sheet_indices is not None
+        self.workbook = xlrd.open_workbook(self.file_path, formatting_info=False, on_demand=on_demand)
+        if sheet_indices is None:
+            sheet_indices = range(self.workbook.nsheets)
         
         # 读取所有品番sheet（跳过可能的汇总sheet）
-        for sheet_idx in range(self.workbook.nsheets):
+        for sheet_idx in sheet_indices:
             sheet = self.workbook.sheet_by_index(sheet_idx)
             sheet_name = sheet.name
             
             # 跳过空sheet或太小的sheet
-            if sheet.nrows < AllocationTableConfig.DATA_START_ROW:
-                continue
-            
-            # 读取该品番的数据
-            product_data = self._read_product_sheet(sheet, sheet_name)
-            if product_data:
-                self.products_data.append(product_data)
+            if sheet.nrows >= AllocationTableConfig.DATA_START_ROW:
+                # 读取该品番的数据（店铺数据走NumPy批量路径）
+                started = self._begin_sheet_stats()
+                rows = (sheet.row_values(row_idx) for row_idx in range(sheet.nrows))
+                product_data = self._read_product_sheet(rows, sheet_name, xls_sheet=sheet)
+                self._end_sheet_stats(sheet_name, started, product_data)
+                if product_data:
+                    self.products_data.append(product_data)
+            
+            if on_demand:
+                self.workbook.unload_sheet(sheet_idx)
         
         return {
             'metadata': self.metadata,
             'products': self.products_data
         }
 
-    def _read_xlsx(self) -> Dict:
-        """使用openpyxl读取.xlsx文件"""
+    def _read_xlsx(self, sheet_indices: List[int] = None) -> Dict:
+        """使用openpyxl只读模式流式读取.xlsx文件（每个sheet只按行遍历一次）"""
         self.engine = 'openpyxl'
-        self.workbook = openpyxl.load_workbook(self.file_path, data_only=True)
+        self.workbook = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+        sheet_names = self.workbook.sheetnames
+        if sheet_indices is not None:
+            sheet_names = [sheet_names[i] for i in sheet_indices]
         
-        for sheet_name in self.workbook.sheetnames:
+        for sheet_name in sheet_names:
             sheet = self.workbook[sheet_name]
+            # 部分系统导出的文件dimension标记不准确，忽略它，按实际行读取
+            sheet.reset_dimensions()
             
-            # 跳过空sheet或太小的sheet
-            if sheet.max_row < AllocationTableConfig.DATA_START_ROW:
-                continue
-                
-            # 读取该品番的数据
-            product_data = self._read_product_sheet(sheet, sheet_name)
+            # 读取该品番的数据（太小的sheet在_read_product_sheet中跳过）
+            started = self._begin_sheet_stats()
+            product_data = self._read_product_sheet(sheet.iter_rows(values_only=True), sheet_name)
+            self._end_sheet_stats(sheet_name, started, product_data)
             if product_data:
                 self.products_data.append(product_data)
                 
@@ -382,49 +497,67 @@ class AllocationTableReader:
             'products': self.products_data
         }
     
-    def _get_cell_value(self, sheet, row, col):
-        """获取单元格值，屏蔽不同库的差异"""
-        if self.engine == 'xlrd':
-            try:
-                if row >= sheet.nrows or col >= sheet.ncols:
-                    return None
-                return sheet.cell(row, col).value
-            except:
-                return None
-        else: # openpyxl
-            try:
-                # openpyxl is 1-based
-                return sheet.cell(row=row+1, column=col+1).value
-            except:
-                return None
+    def _begin_sheet_stats(self) -> float:
+        """开始统计单个sheet的耗时和峰值内存"""
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        return time.perf_counter()
 
-    def _get_sheet_dims(self, sheet):
-        """获取sheet的维度(rows, cols)"""
-        if self.engine == 'xlrd':
-            return sheet.nrows, sheet.ncols
-        else:
-            return sheet.max_row, sheet.max_column
+    def _end_sheet_stats(self, sheet_name: str, started: float, product_data: Dict):
+        """记录单个sheet的耗时和峰值内存"""
+        stats = {
+            'sheet': sheet_name,
+            'engine': self.engine,
+            'stores': len(product_data['stores']) if product_data else 0,
+            'seconds': round(time.perf_counter() - started, 4),
+            'peak_mb': None
+        }
+        if tracemalloc.is_tracing():
+            stats['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        self.sheet_stats.append(stats)
+        logger.info(
+            f"Sheet {sheet_name}: {stats['stores']} stores, {stats['seconds']}s"
+            + (f", peak {stats['peak_mb']} MB" if stats['peak_mb'] is not None else "")
+        )
 
-    def _read_product_sheet(self, sheet, sheet_name: str) -> Dict:
+    @staticmethod
+    def _row_value(row, col):
+        """获取行元组中的单元格值，越界返回None"""
+        if col < len(row):
+            return row[col]
+        return None
+
+    def _read_product_sheet(self, rows: Iterator, sheet_name: str, xls_sheet=None) -> Dict:
         """
         读取单个品番sheet的数据
         
         Args:
-            sheet: sheet对象
+            rows: 按行产出单元格值的迭代器（从第1行开始）
             sheet_name: sheet名称（品番）
+            xls_sheet: xlrd的sheet对象，传入时店铺数据按整块矩阵读取
             
         Returns:
             该品番的数据字典
         """
+        # 表头区域（元数据 + カラー/サイズ行）先缓存下来，数据行逐行处理
+        header_rows = list(islice(rows, AllocationTableConfig.DATA_START_ROW))
+        
+        # 跳过空sheet或太小的sheet
+        if len(header_rows) < AllocationTableConfig.DATA_START_ROW:
+            return None
+        
         try:
             # 提取元数据
-            metadata = self._extract_metadata(sheet)
+            metadata = self._extract_metadata(header_rows)
             
             # 读取表头（颜色和尺码信息）
-            sku_columns = self._read_sku_columns(sheet)
+            sku_columns = self._read_sku_columns(header_rows)
             
             # 读取店铺数据
-            stores_data = self._read_stores_data(sheet, sku_columns)
+            if xls_sheet is not None:
+                stores_data = self._read_stores_matrix(xls_sheet, sku_columns)
+            else:
+                stores_data = self._read_stores_data(rows, sku_columns)
             
             return {
                 'product_code': sheet_name,  # 品番
@@ -437,56 +570,43 @@ class AllocationTableReader:
             print(f"警告: 读取sheet '{sheet_name}' 失败: {e}")
             return None
     
-    def _extract_metadata(self, sheet) -> Dict:
+    def _extract_metadata(self, header_rows: List) -> Dict:
         """提取元数据（管理No、納期等）"""
         metadata = {}
-        nrows, ncols = self._get_sheet_dims(sheet)
         
         try:
             # 提取カンパニー
-            if nrows > AllocationTableConfig.COMPANY_ROW:
-                val = self._get_cell_value(sheet, 
-                    AllocationTableConfig.COMPANY_ROW,
-                    AllocationTableConfig.COMPANY_COL)
-                if val:
-                    metadata['company'] = val
+            val = self._row_value(header_rows[AllocationTableConfig.COMPANY_ROW],
+                                  AllocationTableConfig.COMPANY_COL)
+            if val:
+                metadata['company'] = val
             
             # 提取納期
-            if nrows > AllocationTableConfig.DELIVERY_DATE_ROW:
-                val = self._get_cell_value(sheet,
-                    AllocationTableConfig.DELIVERY_DATE_ROW,
-                    AllocationTableConfig.DELIVERY_DATE_COL)
-                if val:
-                    metadata['delivery_date'] = val
+            val = self._row_value(header_rows[AllocationTableConfig.DELIVERY_DATE_ROW],
+                                  AllocationTableConfig.DELIVERY_DATE_COL)
+            if val:
+                metadata['delivery_date'] = val
             
             # 提取品番（从元数据区域）
-            if nrows > AllocationTableConfig.PRODUCT_CODE_ROW:
-                val = self._get_cell_value(sheet,
-                    AllocationTableConfig.PRODUCT_CODE_ROW,
-                    AllocationTableConfig.PRODUCT_CODE_COL)
-                if val:
-                    metadata['product_code'] = val
+            val = self._row_value(header_rows[AllocationTableConfig.PRODUCT_CODE_ROW],
+                                  AllocationTableConfig.PRODUCT_CODE_COL)
+            if val:
+                metadata['product_code'] = val
             
             # 提取管理No（直接从已知位置读取）
-            if (nrows > AllocationTableConfig.KANRI_NO_LABEL_ROW and 
-                ncols > AllocationTableConfig.KANRI_NO_VALUE_COL):
-                val = self._get_cell_value(sheet,
-                    AllocationTableConfig.KANRI_NO_LABEL_ROW,
-                    AllocationTableConfig.KANRI_NO_VALUE_COL)
-                if val:
-                    # 转换为字符串，如果是数字则转为整数字符串
-                    if isinstance(val, float):
-                        val = int(val)
-                    metadata['kanri_no'] = str(val)
+            val = self._row_value(header_rows[AllocationTableConfig.KANRI_NO_LABEL_ROW],
+                                  AllocationTableConfig.KANRI_NO_VALUE_COL)
+            if val:
+                # 转换为字符串，如果是数字则转为整数字符串
+                if isinstance(val, float):
+                    val = int(val)
+                metadata['kanri_no'] = str(val)
             
             # 提取店着日（直接从已知位置读取）
-            if (nrows > AllocationTableConfig.STORE_DATE_LABEL_ROW and
-                ncols > AllocationTableConfig.STORE_DATE_VALUE_COL):
-                val = self._get_cell_value(sheet,
-                    AllocationTableConfig.STORE_DATE_LABEL_ROW,
-                    AllocationTableConfig.STORE_DATE_VALUE_COL)
-                if val:
-                    metadata['store_date'] = str(val)
+            val = self._row_value(header_rows[AllocationTableConfig.STORE_DATE_LABEL_ROW],
+                                  AllocationTableConfig.STORE_DATE_VALUE_COL)
+            if val:
+                metadata['store_date'] = str(val)
             
         except Exception as e:
             print(f"警告: 提取元数据失败: {e}")
@@ -497,16 +617,16 @@ class AllocationTableReader:
         
         return metadata
     
-    def _read_sku_columns(self, sheet) -> List[Dict]:
+    def _read_sku_columns(self, header_rows: List) -> List[Dict]:
         """
         读取SKU列信息（カラー和サイズ的组合）
         """
         sku_columns = []
-        nrows, ncols = self._get_sheet_dims(sheet)
         
         # 读取カラー行（COL_FIRST_COLOR之后的列）
-        color_row = AllocationTableConfig.HEADER_ROW
-        size_row = AllocationTableConfig.SIZE_ROW
+        color_row = header_rows[AllocationTableConfig.HEADER_ROW]
+        size_row = header_rows[AllocationTableConfig.SIZE_ROW]
+        ncols = max(len(color_row), len(size_row))
         
         # 从第一个颜色列开始遍历
         col_idx = AllocationTableConfig.COL_FIRST_COLOR
@@ -514,7 +634,7 @@ class AllocationTableReader:
         
         while col_idx < ncols:
             # 读取颜色
-            color_val = self._get_cell_value(sheet, color_row, col_idx)
+            color_val = self._row_value(color_row, col_idx)
             if color_val:
                 # 新的颜色值
                 color_str = str(color_val).strip()
@@ -523,7 +643,7 @@ class AllocationTableReader:
                     current_color = color_str
             
             # 读取尺码
-            size_val = self._get_cell_value(sheet, size_row, col_idx)
+            size_val = self._row_value(size_row, col_idx)
             size_value = str(size_val).strip() if size_val else ""
             
             # 过滤掉无效的尺码值（如"サイズ"、"合計"等）
@@ -542,61 +662,127 @@ class AllocationTableReader:
         
         return sku_columns
     
-    def _read_stores_data(self, sheet, sku_columns: List[Dict]) -> List[Dict]:
+    def _read_stores_data(self, rows: Iterator, sku_columns: List[Dict]) -> List[Dict]:
         """
-        读取店铺数据
+        读取店铺数据（rows为数据开始行之后的行迭代器）
         """
         stores_data = []
-        nrows, ncols = self._get_sheet_dims(sheet)
+        row_value = self._row_value
         
         # 从数据开始行读取
-        for row_idx in range(AllocationTableConfig.DATA_START_ROW, nrows):
+        for row in rows:
             # 读取店铺基本信息
-            no_val = self._get_cell_value(sheet, row_idx, AllocationTableConfig.COL_NO)
-            store_code_val = self._get_cell_value(sheet, row_idx, AllocationTableConfig.COL_STORE_CODE)
-            store_name_val = self._get_cell_value(sheet, row_idx, AllocationTableConfig.COL_STORE_NAME)
-            type_val = self._get_cell_value(sheet, row_idx, AllocationTableConfig.COL_TYPE)
+            no_val = row_value(row, AllocationTableConfig.COL_NO)
+            store_code_val = row_value(row, AllocationTableConfig.COL_STORE_CODE)
+            store_name_val = row_value(row, AllocationTableConfig.COL_STORE_NAME)
+            type_val = row_value(row, AllocationTableConfig.COL_TYPE)
             
             # 如果没有店铺代码或名称，跳过这行（可能是汇总行）
             if not store_code_val or not store_name_val:
                 continue
             
-            # 读取该店铺的SKU配货数量
-            sku_quantities = {}
+            # 读取该店铺的SKU配货数量（与sku_columns按位置对齐）
+            quantities = []
             for sku_info in sku_columns:
-                col_idx = sku_info['column_index']
-                qty_val = self._get_cell_value(sheet, row_idx, col_idx)
+                qty_val = row_value(row, sku_info['column_index'])
                 qty = 0
                 if qty_val:
                     try:
                         qty = float(qty_val)
                     except:
                         qty = 0
-                
-                # 构建SKU key (color_size)
-                sku_key = f"{sku_info['color']}_{sku_info['size']}"
-                sku_quantities[sku_key] = qty
+                quantities.append(qty)
             
             # 只有当至少有一个SKU数量大于0时才记录这个店铺
-            if any(qty > 0 for qty in sku_quantities.values()):
-                store_data = {
-                    'no': no_val if no_val else "",
-                    'type': str(int(type_val)) if isinstance(type_val, (int, float)) and type_val else str(type_val) if type_val else "",
-                    'store_code': str(int(store_code_val)) if isinstance(store_code_val, float) else str(store_code_val),
-                    'store_name': str(store_name_val),
-                    'sku_quantities': sku_quantities
-                }
-                
-                # 读取ランク（如果有）
-                if AllocationTableConfig.COL_RANK < ncols:
-                    rank_val = self._get_cell_value(sheet, row_idx, AllocationTableConfig.COL_RANK)
-                    if rank_val:
-                        store_data['rank'] = str(rank_val)
-                
-                stores_data.append(store_data)
+            if any(qty > 0 for qty in quantities):
+                rank_val = row_value(row, AllocationTableConfig.COL_RANK)
+                stores_data.append(self._build_store_data(
+                    no_val, type_val, store_code_val, store_name_val, rank_val, quantities))
+        
+        return stores_data
+    
+    def _read_stores_matrix(self, sheet, sku_columns: List[Dict]) -> List[Dict]:
+        """
+        读取店铺数据（xlrd批量路径）
+        
+        把数据区整块取成二维数组，数量列一次性转成数值矩阵（无法解析的值记为0），
+        避免逐个单元格调用 sheet.cell() 和 float()。结果与 _read_stores_data 一致。
+        """
+        start = AllocationTableConfig.DATA_START_ROW
+        if sheet.nrows <= start:
+            return []
+        
+        # 数据区整块读取（xlrd默认各行等长，均为ncols列）
+        block = np.empty((sheet.nrows - start, sheet.ncols), dtype=object)
+        for i, row_idx in enumerate(range(start, sheet.nrows)):
+            block[i] = sheet.row_values(row_idx)
+        
+        def column(col_idx):
+            if col_idx < sheet.ncols:
+                return block[:, col_idx]
+            return np.full(len(block), None, dtype=object)
+        
+        no_col = column(AllocationTableConfig.COL_NO)
+        type_col = column(AllocationTableConfig.COL_TYPE)
+        code_col = column(AllocationTableConfig.COL_STORE_CODE)
+        name_col = column(AllocationTableConfig.COL_STORE_NAME)
+        rank_col = column(AllocationTableConfig.COL_RANK)
+        
+        # 数量矩阵：向量化转换为数值，NaN→0
+        raw = block[:, [sku_info['column_index'] for sku_info in sku_columns]]
+        qty_matrix = self._to_qty_matrix(raw)
+        
+        # 只保留有店铺代码和名称、且至少一个SKU数量大于0的行
+        has_store = np.array([bool(c) and bool(n) for c, n in zip(code_col, name_col)], dtype=bool)
+        has_qty = (qty_matrix > 0).any(axis=1) if sku_columns else np.zeros(len(block), dtype=bool)
+        
+        stores_data = []
+        for i in np.flatnonzero(has_store & has_qty):
+            # 数量为0时保持原来的int 0，其他为float
+            quantities = [float(qty) if qty else 0 for qty in qty_matrix[i].tolist()]
+            stores_data.append(self._build_store_data(
+                no_col[i], type_col[i], code_col[i], name_col[i], rank_col[i], quantities))
         
         return stores_data
     
+    @staticmethod
+    def _to_qty_matrix(raw: np.ndarray) -> np.ndarray:
+        """把单元格值矩阵转换为float矩阵，空值和无法解析的值为0"""
+        if raw.size == 0:
+            return np.zeros(raw.shape, dtype=float)
+        
+        flat = raw.ravel()
+        values = pd.to_numeric(flat, errors='coerce').astype(float)
+        
+        # to_numeric不认识的字符串（如全角数字）按float()再试一次，保持与逐格解析一致
+        for idx in np.flatnonzero(np.isnan(values)):
+            val = flat[idx]
+            if isinstance(val, str) and val:
+                try:
+                    values[idx] = float(val)
+                except ValueError:
+                    pass
+        
+        return np.nan_to_num(values, nan=0.0).reshape(raw.shape)
+    
+    @staticmethod
+    def _build_store_data(no_val, type_val, store_code_val, store_name_val, rank_val,
+                          quantities: List[float]) -> Dict:
+        """组装单个店铺的数据"""
+        store_data = {
+            'no': no_val if no_val else "",
+            'type': str(int(type_val)) if isinstance(type_val, (int, float)) and type_val else str(type_val) if type_val else "",
+            'store_code': str(int(store_code_val)) if isinstance(store_code_val, float) else str(store_code_val),
+            'store_name': str(store_name_val),
+            'quantities': quantities  # 与品番的sku_columns按位置对齐
+        }
+        
+        # 读取ランク（如果有）
+        if rank_val:
+            store_data['rank'] = str(rank_val)
+        
+        return store_data
+    
     def close(self):
         """关闭工作簿"""
         if self.workbook:
@@ -605,3 +791,17 @@ class AllocationTableReader:
             elif self.engine == 'openpyxl':
                 self.workbook.close()
             self.workbook = None
+
+
+def _read_sheets_worker(file_path: str, sheet_indices: List[int]) -> Dict:
+    """并行读取的子进程入口：解析指定的sheet，返回品番数据"""
+    reader = AllocationTableReader(file_path)
+    try:
+        reader._read_sheets(sheet_indices)
+    finally:
+        reader.close()
+    return {
+        'metadata': reader.metadata,
+        'products': reader.products_data,
+        'sheet_stats': reader.sheet_stats
+    }
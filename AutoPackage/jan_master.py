@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JAN主档模块 - 持久化保存明细表的 (品番, カラー, サイズ) -> JANCODE 映射
+
+新的明细表到达时增量合并到主档，每次有变化的合并生成一个新版本（快照），
+转换时可以直接查询主档，不必每次都上传并重新解析明细表。
+
+存储使用 SQLite：
+- jan_master: 每条映射记录有效版本区间 [version_from, version_to)，version_to为NULL表示当前有效
+- jan_snapshots: 每个版本的来源和增改数量
+"""
+import logging
+import sqlite3
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from data_transformer import JanMatchIndex
+
+logger = logging.getLogger(__name__)
+
+
+class JanMasterStore:
+    """JAN主档（SQLite），按 (品番, カラー, サイズ) 建索引，支持增量合并和版本快照"""
+
+    def __init__(self, db_path: str, index_cache_versions: int = 2):
+        """
+        初始化主档
+
+        Args:
+            db_path: SQLite数据库文件路径
+            index_cache_versions: 内存中最多缓存几个版本的JAN匹配索引（每个索引含该版本的全部映射）
+        """
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+        self.index_cache_versions = max(1, index_cache_versions)
+        self._index_cache = {}  # 版本号 -> JanMatchIndex，读写都在 self._lock 内
+
+    def _create_tables(self):
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jan_master (
+                    product_code TEXT NOT NULL,
+                    color TEXT NOT NULL,
+                    size TEXT NOT NULL,
+                    jan TEXT NOT NULL,
+                    version_from INTEGER NOT NULL,
+                    version_to INTEGER
+                )
+            """)
+            # 当前有效记录按键唯一，查询走这个索引
+            self._conn.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS ix_jan_master_current
+                ON jan_master (product_code, color, size) WHERE version_to IS NULL
+            """)
+            self._conn.execute("""
+                CREATE INDEX IF NOT EXISTS ix_jan_master_key
+                ON jan_master (product_code, color, size, version_from)
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jan_snapshots (
+                    version INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at TEXT NOT NULL,
+                    source TEXT,
+                    added INTEGER NOT NULL,
+                    updated INTEGER NOT NULL,
+                    total INTEGER NOT NULL
+                )
+            """)
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    def current_version(self) -> int:
+        """当前版本号（没有任何数据时为0）"""
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(version) FROM jan_snapshots").fetchone()
+        return row[0] or 0
+
+    def count(self, version: int = None) -> int:
+        """指定版本（默认当前）的有效映射条数"""
+        sql, params = self._version_filter(version)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM jan_master WHERE {sql}", params).fetchone()[0]
+
+    def merge(self, jan_map: Dict[Tuple[str, str, str], str], source: str = "") -> Dict:
+        """
+        增量合并明细表映射
+
+        新键插入，JAN变化的键把旧记录关闭后插入新记录，相同的不动；主档中已有但本次没有的键保留。
+        有新增或修改时生成新版本。
+
+        Args:
+            jan_map: {(品番, カラー, サイズ): JANCODE}
+            source: 来源说明（如明细表文件名）
+
+        Returns:
+            合并结果 {version, added, updated, unchanged, total}
+        """
+        with self._lock, self._conn:
+            cur = self._conn.cursor()
+            cur.execute("CREATE TEMP TABLE IF NOT EXISTS jan_incoming ("
+                        "product_code TEXT, color TEXT, size TEXT, jan TEXT)")
+            cur.execute("CREATE INDEX IF NOT EXISTS temp.ix_jan_incoming "
+                        "ON jan_incoming (product_code, color, size)")
+            cur.execute("DELETE FROM jan_incoming")
+            cur.executemany(
+                "INSERT INTO jan_incoming VALUES (?, ?, ?, ?)",
+                ((p, c, s, jan) for (p, c, s), jan in jan_map.items())
+            )
+
+            added = cur.execute("""
+                SELECT COUNT(*) FROM jan_incoming i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM jan_master m
+                    WHERE m.product_code = i.product_code AND m.color = i.color
+                      AND m.size = i.size AND m.version_to IS NULL)
+            """).fetchone()[0]
+            updated = cur.execute("""
+                SELECT COUNT(*) FROM jan_incoming i
+                JOIN jan_master m
+                  ON m.product_code = i.product_code AND m.color = i.color
+                 AND m.size = i.size AND m.version_to IS NULL
+                WHERE m.jan <> i.jan
+            """).fetchone()[0]
+
+            if added == 0 and updated == 0:
+                version = cur.execute("SELECT MAX(version) FROM jan_snapshots").fetchone()[0] or 0
+                total = cur.execute("SELECT COUNT(*) FROM jan_master WHERE version_to IS NULL").fetchone()[0]
+                return {'version': version, 'added': 0, 'updated': 0,
+                        'unchanged': len(jan_map), 'total': total}
+
+            cur.execute(
+                "INSERT INTO jan_snapshots (created_at, source, added, updated, total) VALUES (?, ?, ?, ?, 0)",
+                (datetime.now().isoformat(timespec='seconds'), source, added, updated)
+            )
+            version = cur.lastrowid
+
+            # 关闭JAN有变化的旧记录
+            cur.execute("""
+                UPDATE jan_master SET version_to = ?
+                WHERE version_to IS NULL AND EXISTS (
+                    SELECT 1 FROM jan_incoming i
+                    WHERE i.product_code = jan_master.product_code AND i.color = jan_master.color
+                      AND i.size = jan_master.size AND i.jan <> jan_master.jan)
+            """, (version,))
+            # 插入新键和变化后的记录
+            cur.execute("""
+                INSERT INTO jan_master (product_code, color, size, jan, version_from, version_to)
+                SELECT i.product_code, i.color, i.size, i.jan, ?, NULL FROM jan_incoming i
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM jan_master m
+                    WHERE m.product_code = i.product_code AND m.color = i.color
+                      AND m.size = i.size AND m.version_to IS NULL)
+            """, (version,))
+            cur.execute("DELETE FROM jan_incoming")
+
+            total = cur.execute("SELECT COUNT(*) FROM jan_master WHERE version_to IS NULL").fetchone()[0]
+            cur.execute("UPDATE jan_snapshots SET total = ? WHERE version = ?", (total, version))
+
+        logger.info(f"JAN主档合并完成: v{version}, 新增 {added}, 更新 {updated}, 共 {total} 条")
+        return {'version': version, 'added': added, 'updated': updated,
+                'unchanged': len(jan_map) - added - updated, 'total': total}
+
+    @staticmethod
+    def _version_filter(version: Optional[int]):
+        """生成按版本筛选有效记录的SQL条件"""
+        if version is None:
+            return "version_to IS NULL", ()
+        return "version_from <= ? AND (version_to IS NULL OR version_to > ?)", (version, version)
+
+    def lookup(self, product_code: str, color: str, size: str, version: int = None) -> Optional[str]:
+        """查询单个键的JANCODE，没有则返回None"""
+        sql, params = self._version_filter(version)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT jan FROM jan_master WHERE product_code = ? AND color = ? AND size = ? AND {sql}",
+                (product_code, color, size) + params
+            ).fetchone()
+        return row[0] if row else None
+
+    def load_map(self, version: int = None) -> Dict[Tuple[str, str, str], str]:
+        """读取指定版本（默认当前）的完整映射字典"""
+        sql, params = self._version_filter(version)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT product_code, color, size, jan FROM jan_master WHERE {sql}", params
+            ).fetchall()
+        return {(p, c, s): jan for p, c, s, jan in rows}
+
+    def iter_keys(self, version: int = None, batch_size: int = 1000) -> Iterator[Tuple[str, str, str]]:
+        """按插入顺序分批遍历指定版本（默认当前）的键"""
+        sql, params = self._version_filter(version)
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, product_code, color, size FROM jan_master "
+                    f"WHERE rowid > ? AND {sql} ORDER BY rowid LIMIT ?",
+                    (last_rowid,) + params + (batch_size,)
+                ).fetchall()
+            if not rows:
+                return
+            for rowid, p, c, s in rows:
+                yield (p, c, s)
+            last_rowid = rows[-1][0]
+
+    def snapshots(self) -> List[Dict]:
+        """所有版本快照（新的在前）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT version, created_at, source, added, updated, total FROM jan_snapshots ORDER BY version DESC"
+            ).fetchall()
+        return [
+            {'version': v, 'created_at': created_at, 'source': source,
+             'added': added, 'updated': updated, 'total': total}
+            for v, created_at, source, added, updated, total in rows
+        ]
+
+    def match_index(self, version: int = None) -> JanMatchIndex:
+        """
+        指定版本（默认当前）的JAN匹配索引，按版本缓存（版本内容不会再变）
+
+        索引把该版本的全部映射载入内存（另加已匹配SKU的结果缓存），
+        内存约与主档条数成正比；最多缓存 index_cache_versions 个版本，超出时丢弃最旧的版本。
+        """
+        if version is None:
+            version = self.current_version()
+        with self._lock:
+            index = self._index_cache.get(version)
+        if index is not None:
+            return index
+        # load_map 自身要取锁，索引在锁外构建；并发构建同一版本时保留先放入缓存的那个
+        index = JanMatchIndex(self.load_map(version))
+        with self._lock:
+            if version in self._index_cache:
+                return self._index_cache[version]
+            while len(self._index_cache) >= self.index_cache_versions:
+                self._index_cache.pop(min(self._index_cache))
+            self._index_cache[version] = index
+        return index
+
+    def as_mapping(self, version: int = None) -> 'JanMasterMap':
+        """返回可直接传给 DataTransformer 的只读映射视图（版本固定）"""
+        return JanMasterMap(self, version if version is not None else self.current_version())
+
+
+class JanMasterMap(Mapping):
+    """
+    JAN主档某个版本的只读映射视图
+
+    按键取值时直接查询SQLite，不载入整张表；但 DataTransformer 优先使用 match_index()，
+    它会把该版本的完整映射载入内存并在主档中缓存（见 JanMasterStore.match_index）。
+    """
+
+    def __init__(self, store: JanMasterStore, version: int):
+        self.store = store
+        self.version = version
+        self._cache = {}
+        self._len = None
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            self._cache[key] = self.store.lookup(*key, version=self.version)
+        jan = self._cache[key]
+        if jan is None:
+            raise KeyError(key)
+        return jan
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def __len__(self):
+        if self._len is None:
+            self._len = self.store.count(self.version)
+        return self._len
+
+    def __iter__(self):
+        return self.store.iter_keys(self.version)
+
+    def match_index(self) -> JanMatchIndex:
+        """该版本的JAN匹配索引（DataTransformer优先使用）"""
+        return self.store.match_index(self.version)
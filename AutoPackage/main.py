@@ -12,7 +12,7 @@ from datetime import datetime
 import glob
 
 from excel_reader import AllocationTableReader, DetailTableReader
-from data_transformer import DataTransformer
+from data_transformer import DataTransformer, JanMatchIndex
 from template_writer import TemplateWriter
 from config import FileConfig
 
@@ -387,6 +387,8 @@ class AutoPackageApp:
                     self._log(f"  -> 明细表读取失败: {e}", "ERROR")
                     messagebox.showerror("错误", f"明细表读取失败: {e}")
                     return
+            # JAN匹配索引只建一次，批量中的所有文件共用
+            jan_index = JanMatchIndex(jan_map)
 
             total_files = len(files)
             success_count = 0
@@ -423,7 +425,7 @@ class AutoPackageApp:
                             continue
                     
                     # 执行转换
-                    self._perform_single_conversion(file_path, self.template_file_path.get(), output_path, jan_map)
+                    self._perform_single_conversion(file_path, self.template_file_path.get(), output_path, jan_map, jan_index)
                     
                     self._log(f"  -> 成功生成: {output_filename}", "SUCCESS")
                     success_count += 1
@@ -450,7 +452,7 @@ class AutoPackageApp:
         finally:
             self.root.after(0, lambda: self.convert_button.config(state=tk.NORMAL))
 
-    def _perform_single_conversion(self, input_path, template_path, output_path, jan_map=None):
+    def _perform_single_conversion(self, input_path, template_path, output_path, jan_map=None, jan_index=None):
         """执行单个文件转换逻辑 (复用逻辑)"""
         self._log(f"读取配分表: {os.path.basename(input_path)}")
         
@@ -464,7 +466,7 @@ class AutoPackageApp:
         
         # 2. 数据转换
         self._log("  -> 正在进行数据转换和PT分组...")
-        transformer = DataTransformer(allocation_data, jan_map)
+        transformer = DataTransformer(allocation_data, jan_map, jan_index=jan_index)
         transformed_data = transformer.transform()
         
         sku_count = len(transformed_data['skus'])
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配货包生成模块 - ①箱設定 与 ④各店铺明细 在不同进程中同时生成，生成完即写入打包文件
+
+两个文件只读取 DataTransformer 的输出结果，互不依赖：④交给子进程生成，同时父进程生成①
+（①的PT页仍可再分给多个进程并行渲染），总耗时接近两者中较长的一个，而不是两者之和。
+
+工厂返回箱設定文件后的②アソート明細 / ③受渡伝票 / 箱贴PDF 同理：文件只解析一次，
+三份文件在各自的进程中同时生成（ShipmentPackageWriter）。
+
+打包文件由 ZipPackage 逐个条目写出：文件生成完立即按块压缩写入，输出可以是磁盘文件，
+也可以不落盘、直接作为分块下载响应的数据（iter_zip_package）。
+"""
+import os
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, Iterator, Optional, Tuple
+
+from config import PackageConfig
+from streaming_writer import StreamingTemplateWriter, StreamingStoreDetailWriter
+from store_detail_writer import StoreDetailWriter
+from template_cache import OPENPYXL_INTERNALS_SUPPORTED
+from template_writer import TemplateWriter
+from pt_sheet_parser import PTWorkbook, pt_parse_cache
+from assortment_generator import AssortmentGenerator
+from delivery_note_generator import DeliveryNoteGenerator
+from excel_reader import BoxSettingReader
+from box_label_generator import BoxLabelGenerator
+
+
+class _ChunkSink:
+    """zipfile 的输出目标（不支持seek，zipfile改用数据描述符）：写入磁盘文件，或缓存起来分块取出"""
+
+    def __init__(self, file=None):
+        self._file = file
+        self._chunks = []
+
+    def write(self, data) -> int:
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def drain(self) -> bytes:
+        """取出目前为止缓存的数据"""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+class ZipPackage:
+    """
+    逐个写入条目的zip打包文件
+
+    每个文件生成完即可 add_file()，按块读取并压缩，不把整个文件载入内存。
+    指定 path 时写入磁盘文件；不指定时 iter_add_file()/close() 返回写出的zip数据，供分块下载响应使用。
+    """
+
+    def __init__(self, path: Optional[str] = None, compress_level: Optional[int] = None):
+        """
+        Args:
+            path: 打包文件路径，None表示不落盘
+            compress_level: deflate压缩级别（0=不压缩），默认取PackageConfig.COMPRESS_LEVEL
+        """
+        self.path = path
+        level = PackageConfig.COMPRESS_LEVEL if compress_level is None else compress_level
+        self._sink = _ChunkSink(open(path, 'wb') if path else None)
+        if level > 0:
+            self._zip = zipfile.ZipFile(self._sink, 'w', zipfile.ZIP_DEFLATED, compresslevel=level)
+        else:
+            self._zip = zipfile.ZipFile(self._sink, 'w', zipfile.ZIP_STORED)
+
+    def add_file(self, file_path: str, arcname: Optional[str] = None):
+        """把一个文件写入打包文件"""
+        for _ in self.iter_add_file(file_path, arcname):
+            pass
+
+    def iter_add_file(self, file_path: str, arcname: Optional[str] = None) -> Iterator[bytes]:
+        """把一个文件写入打包文件，边写边返回产生的zip数据（写入磁盘时不返回数据）"""
+        arcname = arcname or os.path.basename(file_path)
+        force_zip64 = os.path.getsize(file_path) >= zipfile.ZIP64_LIMIT
+        with open(file_path, 'rb') as src, self._zip.open(arcname, 'w', force_zip64=force_zip64) as dst:
+            for block in iter(lambda: src.read(PackageConfig.CHUNK_SIZE), b''):
+                dst.write(block)
+                data = self._sink.drain()
+                if data:
+                    yield data
+        data = self._sink.drain()
+        if data:
+            yield data
+
+    def close(self) -> bytes:
+        """写出目录并关闭，返回剩余的zip数据（写入磁盘时为空）"""
+        self._zip.close()
+        self._sink.close()
+        return self._sink.drain()
+
+    def abort(self):
+        """放弃打包，删除已写出的文件"""
+        self.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def iter_zip_package(files: Iterable[Tuple[str, str]], compress_level: Optional[int] = None) -> Iterator[bytes]:
+    """
+    把若干文件流式打包，逐块返回zip数据（用于分块下载响应，打包文件不落盘）
+
+    Args:
+        files: (文件路径, 包内文件名) 列表
+        compress_level: deflate压缩级别，默认取PackageConfig.COMPRESS_LEVEL
+    """
+    package = ZipPackage(compress_level=compress_level)
+    for file_path, arcname in files:
+        yield from package.iter_add_file(file_path, arcname)
+    yield package.close()
+
+
+def _write_store_detail(template_path: str, output_path: str, prefix: str, transform_result) -> str:
+    """生成④各店铺明细（在子进程中执行）；openpyxl版本未经验证时不使用流式写出"""
+    writer_class = StreamingStoreDetailWriter if OPENPYXL_INTERNALS_SUPPORTED else StoreDetailWriter
+    writer_class(template_path, output_path, prefix=prefix).write(transform_result)
+    return output_path
+
+
+class AllocationPackageWriter:
+    """生成①箱設定 + ④各店铺明细，并打包成一个zip文件"""
+
+    def __init__(self, template_path: str, output_path: str,
+                 store_detail_template_path: Optional[str] = None,
+                 store_detail_output_path: Optional[str] = None,
+                 prefix: str = ""):
+        """
+        Args:
+            template_path: ①模板路径
+            output_path: ①输出路径
+            store_detail_template_path: ④模板路径，None表示不生成④
+            store_detail_output_path: ④输出路径
+            prefix: ④管理番号前缀
+        """
+        self.template_path = template_path
+        self.output_path = output_path
+        self.store_detail_template_path = store_detail_template_path
+        self.store_detail_output_path = store_detail_output_path
+        self.prefix = prefix
+
+    def write(self, transform_result, package: Optional[ZipPackage] = None, is_hanger: bool = False,
+              pt_parallel: bool = False, concurrent: bool = False) -> dict:
+        """
+        生成各文件
+
+        ①生成失败时直接抛出异常；④生成失败时只返回①，错误记录在结果的 store_detail_error 中，
+        打包文件被放弃（删除）。
+
+        Args:
+            transform_result: DataTransformer 的输出结果
+            package: 写入①和④的打包文件（各自生成完即写入，结束时关闭），None表示不打包
+            is_hanger: ①是否为挂装
+            pt_parallel: ①的PT页是否多进程并行渲染
+            concurrent: 是否在子进程中同时生成④（单核环境下自动改为依次生成）
+
+        Returns:
+            {'allocation': ①路径, 'store_detail': ④路径或None, 'zip': 已完成的打包文件路径或None,
+             'store_detail_error': ④的异常或None}
+        """
+        result = {'allocation': self.output_path, 'store_detail': None, 'zip': None,
+                  'store_detail_error': None}
+        sd_args = None
+        if self.store_detail_template_path:
+            sd_args = (self.store_detail_template_path, self.store_detail_output_path,
+                       self.prefix, transform_result)
+
+        if sd_args is None or not concurrent or (os.cpu_count() or 1) <= 1:
+            return self._write_serial(transform_result, package, is_hanger, pt_parallel, sd_args, result)
+
+        print("并行生成①箱設定 / ④各店铺明细")
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                future = executor.submit(_write_store_detail, *sd_args)
+            except BrokenProcessPool:
+                print("子进程无法启动，改为依次生成")
+                return self._write_serial(transform_result, package, is_hanger, pt_parallel, sd_args, result)
+            try:
+                self._write_allocation(transform_result, is_hanger, pt_parallel)
+                # ④仍在生成时先把①写入打包文件
+                allocation_added = False
+                if package is not None and not (future.done() and future.exception() is not None):
+                    package.add_file(self.output_path)
+                    allocation_added = True
+                try:
+                    try:
+                        result['store_detail'] = future.result()
+                    except BrokenProcessPool:
+                        # 子进程异常退出（不是④本身生成失败），在本进程中重新生成
+                        print("子进程异常退出，改为在本进程中生成④")
+                        result['store_detail'] = _write_store_detail(*sd_args)
+                except Exception as e:
+                    result['store_detail_error'] = e
+                if package is not None and result['store_detail']:
+                    if not allocation_added:
+                        package.add_file(self.output_path)
+                    package.add_file(result['store_detail'])
+                    package.close()
+                    result['zip'] = package.path
+            finally:
+                if package is not None and result['zip'] is None:
+                    package.abort()
+        return result
+
+    def _write_serial(self, transform_result, package: Optional[ZipPackage], is_hanger: bool, pt_parallel: bool,
+                      sd_args: Optional[tuple], result: dict) -> dict:
+        """在本进程中依次生成①和④"""
+        try:
+            self._write_allocation(transform_result, is_hanger, pt_parallel)
+            if sd_args is not None:
+                try:
+                    result['store_detail'] = _write_store_detail(*sd_args)
+                except Exception as e:
+                    result['store_detail_error'] = e
+            if package is not None and result['store_detail']:
+                package.add_file(self.output_path)
+                package.add_file(result['store_detail'])
+                package.close()
+                result['zip'] = package.path
+        finally:
+            if package is not None and result['zip'] is None:
+                package.abort()
+        return result
+
+    def _write_allocation(self, transform_result, is_hanger: bool, pt_parallel: bool):
+        """生成①箱設定；openpyxl版本未经验证时不使用流式写出（也不并行渲染PT页）"""
+        if not OPENPYXL_INTERNALS_SUPPORTED:
+            TemplateWriter(self.template_path, self.output_path).write(transform_result, is_hanger=is_hanger)
+            return
+        writer = StreamingTemplateWriter(self.template_path, self.output_path)
+        writer.write(transform_result, is_hanger=is_hanger, parallel=pt_parallel)
+
+
+def _write_assortment(template_path: str, output_path: str, week_num: Optional[str], prefix: str,
+                      pt_book: PTWorkbook) -> dict:
+    """生成②アソート明細（可在子进程中执行），返回文件路径、耗时和汇总"""
+    started = time.perf_counter()
+    generator = AssortmentGenerator(pt_book.path, template_path, output_path, week_num=week_num, prefix=prefix,
+                                    pt_book=pt_book)
+    generator.process()
+    rows = generator.data_rows
+    arcname = os.path.basename(output_path)
+    kanri_no = getattr(generator, 'kanri_no', "")
+    if kanri_no and generator.week_num:
+        arcname = f"{generator.week_num}-{kanri_no}-アソート明細.xlsx"
+    return {
+        'path': output_path,
+        'arcname': arcname,
+        'seconds': round(time.perf_counter() - started, 3),
+        'stats': {
+            'items_processed': len(rows),
+            'store_count': len({r['delivery_code'] for r in rows}),
+            'box_count': len({r['slip_no'] for r in rows}),
+            'sku_count': len({r['manufacturer_code'] for r in rows}),
+            'total_qty': sum(r['qty'] for r in rows),
+        },
+        'logs': generator.logs,
+    }
+
+
+def _write_delivery_note(template_path: Optional[str], output_path: str, prefix: str, start_no: Optional[int],
+                         output_format: str, encoding: str, pt_book: PTWorkbook) -> dict:
+    """生成③受渡伝票（可在子进程中执行），返回文件路径、耗时和汇总"""
+    started = time.perf_counter()
+    generator = DeliveryNoteGenerator(pt_book.path, template_path, output_path, start_no=start_no, prefix=prefix,
+                                      output_format=output_format, encoding=encoding, pt_book=pt_book)
+    generator.process()
+    rows = generator.data_rows
+    return {
+        'path': output_path,
+        'arcname': os.path.basename(output_path),
+        'seconds': round(time.perf_counter() - started, 3),
+        'stats': {
+            'items_processed': len(rows),
+            'store_count': len({r['store_code'] for r in rows}),
+            'box_count': len({r['slip_no'] for r in rows}),
+            'sku_count': len({(r['product_code'], r['color'], r['size']) for r in rows}),
+            'total_qty': sum(r['qty'] for r in rows),
+        },
+        'logs': [],
+    }
+
+
+def _write_box_labels(output_path: str, pt_book: PTWorkbook) -> dict:
+    """生成箱贴PDF（可在子进程中执行），返回文件路径、耗时和汇总"""
+    started = time.perf_counter()
+    boxes = BoxSettingReader(pt_book.path, pt_book=pt_book).read()
+    if not boxes:
+        raise ValueError("未在文件中找到有效的箱设定数据 (请检查是否包含 PT 页)")
+    _, stats = BoxLabelGenerator(boxes, output_path).generate()
+    return {
+        'path': output_path,
+        'arcname': os.path.basename(output_path),
+        'seconds': round(time.perf_counter() - started, 3),
+        'stats': stats,
+        'logs': [],
+    }
+
+
+class ShipmentPackageWriter:
+    """由工厂返回的箱設定文件生成②アソート明細 + ③受渡伝票 + 箱贴PDF，并打包成一个zip文件"""
+
+    def __init__(self, input_path: str,
+                 assortment_template_path: str, assortment_output_path: str,
+                 delivery_note_template_path: Optional[str], delivery_note_output_path: str,
+                 label_output_path: str,
+                 prefix: str = "81", week_num: Optional[str] = None, start_no: Optional[int] = None,
+                 delivery_note_format: str = "xlsx", delivery_note_encoding: str = "utf-8"):
+        """
+        Args:
+            input_path: 工厂返回的箱設定文件
+            assortment_template_path / assortment_output_path: ②模板路径 / 输出路径
+            delivery_note_template_path / delivery_note_output_path: ③模板路径（CSV/TSV时不使用） / 输出路径
+            label_output_path: 箱贴PDF输出路径
+            prefix: 受渡伝票NO前缀
+            week_num: ②的周数，None时由納期推算
+            start_no: ③的起始编号
+            delivery_note_format: ③输出格式 "xlsx" / "csv" / "tsv"
+            delivery_note_encoding: ③为CSV/TSV时的编码
+        """
+        self.input_path = input_path
+        self.assortment_template_path = assortment_template_path
+        self.assortment_output_path = assortment_output_path
+        self.delivery_note_template_path = delivery_note_template_path
+        self.delivery_note_output_path = delivery_note_output_path
+        self.label_output_path = label_output_path
+        self.prefix = prefix
+        self.week_num = week_num
+        self.start_no = start_no
+        self.delivery_note_format = delivery_note_format
+        self.delivery_note_encoding = delivery_note_encoding
+
+    def write(self, package: Optional[ZipPackage] = None, concurrent: bool = False) -> dict:
+        """
+        解析一次输入文件，生成三份文件
+
+        任一文件生成失败时抛出异常，打包文件被放弃（删除）。
+
+        Args:
+            package: 写入各文件的打包文件（各自生成完即写入，结束时关闭），None表示不打包
+            concurrent: 是否在子进程中同时生成三份文件（单核环境下自动改为依次生成）
+
+        Returns:
+            {'documents': {'assortment'/'delivery_note'/'box_labels': {'path', 'arcname', 'seconds',
+             'stats', 'logs'}}, 'zip': 打包文件路径或None, 'parse_seconds': 解析耗时, 'seconds': 总耗时}
+        """
+        started = time.perf_counter()
+        pt_book = pt_parse_cache.load(self.input_path)
+        parse_seconds = round(time.perf_counter() - started, 3)
+        jobs = {
+            'assortment': (_write_assortment, self.assortment_template_path, self.assortment_output_path,
+                           self.week_num, self.prefix, pt_book),
+            'delivery_note': (_write_delivery_note, self.delivery_note_template_path,
+                              self.delivery_note_output_path, self.prefix, self.start_no,
+                              self.delivery_note_format, self.delivery_note_encoding, pt_book),
+            'box_labels': (_write_box_labels, self.label_output_path, pt_book),
+        }
+        result = {'documents': {}, 'zip': None, 'parse_seconds': parse_seconds, 'seconds': None}
+        workers = min(len(jobs), os.cpu_count() or 1)
+        try:
+            if concurrent and workers > 1:
+                print(f"并行生成②アソート明細 / ③受渡伝票 / 箱贴 ({workers} 进程)")
+                try:
+                    with ProcessPoolExecutor(max_workers=workers) as executor:
+                        futures = {executor.submit(func, *args): name for name, (func, *args) in jobs.items()}
+                        # 先生成完的先写入打包文件
+                        for future in as_completed(futures):
+                            self._finish(result, package, futures[future], future.result())
+                except BrokenProcessPool:
+                    print("子进程异常退出，其余文件改为依次生成")
+            # 依次生成（同时生成时只剩子进程异常退出、未生成完的文件）
+            for name, (func, *args) in jobs.items():
+                if name not in result['documents']:
+                    self._finish(result, package, name, func(*args))
+            if package is not None:
+                package.close()
+                result['zip'] = package.path
+        finally:
+            if package is not None and result['zip'] is None:
+                package.abort()
+        # 按固定顺序返回各文件
+        result['documents'] = {name: result['documents'][name] for name in jobs}
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        return result
+
+    @staticmethod
+    def _finish(result: dict, package: Optional[ZipPackage], name: str, document: dict):
+        """记录一份已生成的文件，并写入打包文件"""
+        result['documents'][name] = document
+        if package is not None:
+            package.add_file(document['path'], document['arcname'])
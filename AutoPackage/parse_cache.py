@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+配分表解析缓存模块 - 按文件内容缓存AllocationTableReader的解析结果
+
+缓存键 = 文件内容SHA-256 + AllocationTableConfig布局 + 读取器版本，
+任何一项变化都会自然失效。结果用pickle序列化后压缩（优先zstandard，没有则用zlib）存盘，
+超过容量上限时按最近使用时间（文件mtime）淘汰。
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import AllocationTableConfig, ParseCacheConfig
+from excel_reader import READER_VERSION
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件头：标明压缩方式，读取时据此解压
+_CODEC_ZSTD = b'Z'
+_CODEC_ZLIB = b'L'
+
+
+def _layout_fingerprint() -> str:
+    """AllocationTableConfig中的布局常量（行列位置）"""
+    items = sorted(
+        (name, value) for name, value in vars(AllocationTableConfig).items()
+        if name.isupper()
+    )
+    return repr(items)
+
+
+class ParseCache:
+    """配分表解析结果的磁盘缓存（LRU，容量有上限）"""
+
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），默认取ParseCacheConfig.MAX_BYTES
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes or ParseCacheConfig.MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def key_for(self, file_path: str) -> str:
+        """计算文件的缓存键"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        digest.update(_layout_fingerprint().encode('utf-8'))
+        digest.update(f"reader-v{READER_VERSION}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.bin"
+
+    def get(self, key: str) -> Optional[Dict]:
+        """读取缓存，未命中返回None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                blob = f.read()
+            data = pickle.loads(self._decompress(blob))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            # 损坏的缓存文件直接丢弃，当作未命中
+            logger.warning(f"解析缓存读取失败，已丢弃: {path.name}: {e}")
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # 更新mtime作为最近使用时间
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: Dict):
+        """写入缓存，并在超出容量时淘汰最久未使用的条目"""
+        blob = self._compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(blob) > self.max_bytes:
+            logger.info(f"解析结果过大（{len(blob)} bytes），不写入缓存")
+            return
+
+        path = self._entry_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        """按mtime从旧到新淘汰，直到总大小不超过上限"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in sorted(entries, key=lambda e: e[2]):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+                    self.evictions += 1
+
+    def _entries(self):
+        """返回 [(路径, 大小, mtime)]"""
+        entries = []
+        for path in self.cache_dir.glob("*.bin"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    @staticmethod
+    def _remove(path: Path) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    @staticmethod
+    def _compress(raw: bytes) -> bytes:
+        if zstandard is not None:
+            return _CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(raw)
+        return _CODEC_ZLIB + zlib.compress(raw, 6)
+
+    @staticmethod
+    def _decompress(blob: bytes) -> bytes:
+        codec, payload = blob[:1], blob[1:]
+        if codec == _CODEC_ZSTD:
+            if zstandard is None:
+                raise ValueError("缓存使用zstandard压缩，但当前环境未安装zstandard")
+            return zstandard.ZstdDecompressor().decompress(payload)
+        if codec == _CODEC_ZLIB:
+            return zlib.decompress(payload)
+        raise ValueError(f"未知的缓存格式: {codec!r}")
+
+    def clear(self) -> int:
+        """清空缓存，返回删除的条目数"""
+        with self._lock:
+            removed = sum(1 for path, _, _ in self._entries() if self._remove(path))
+        return removed
+
+    def stats(self) -> Dict:
+        """缓存统计（命中/未命中/占用字节数等）"""
+        entries = self._entries()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'codec': 'zstd' if zstandard is not None else 'zlib'
+            }
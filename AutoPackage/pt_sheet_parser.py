@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PT页解析模块 - 工厂返回的箱设定文件只解析一次，供箱贴 / ②アソート明細 / ③受渡伝票共用
+
+每个工作簿只按行读取一遍（xlsx用openpyxl只读模式，xls用xlrd），每个PT页存成紧凑的列式箱表：
+数据行的 No./コード/店舗名/CTN_NO/パターン/合計 各占一列，SKU数量只记录大于0的格子
+（按行偏移的稀疏表：SKU序号 + 数量）。各生成器按自己原有的规则从箱表取行，
+不再各自载入整个工作簿、逐格 ws.cell() 读取。
+
+解析结果按文件内容SHA-256缓存在进程内，同一文件生成②③和箱贴只解析一次。
+"""
+import hashlib
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, List, Optional
+
+import openpyxl
+import xlrd
+
+from config import TemplateConfig, PTSheetConfig
+
+# 数据行中读取的各列（0-indexed）
+_COL_NO = TemplateConfig.PT_COL_NO
+_COL_STORE_CODE = TemplateConfig.PT_COL_STORE_CODE
+_COL_STORE_NAME = TemplateConfig.PT_COL_STORE_NAME
+_COL_CTN_NO = TemplateConfig.PT_COL_CTN_NO
+_COL_PATTERN = TemplateConfig.PT_COL_PATTERN
+_COL_TOTAL = TemplateConfig.PT_COL_TOTAL
+_SKU_START = TemplateConfig.PT_SKU_START_COL
+
+
+def _cell(row, col):
+    """行元组中的单元格值，越界返回None"""
+    return row[col] if col < len(row) else None
+
+
+class PTSheet:
+    """一个PT页的列式箱表（只读，各生成器共用，不得修改）"""
+
+    def __init__(self, title: str, header_rows: List[tuple]):
+        """
+        Args:
+            title: sheet名称
+            header_rows: 第1~5行的单元格值（管理No/納期/SKU表头/数据表头）
+        """
+        header_rows = list(header_rows) + [()] * (TemplateConfig.PT_DATA_START_ROW - len(header_rows))
+        self.title = title
+        kanri_no = _cell(header_rows[TemplateConfig.PT_HEADER_ROW_1], 4)  # E1
+        self.kanri_no = str(kanri_no).strip() if kanri_no else ""
+        self.delivery_date = _cell(header_rows[TemplateConfig.PT_HEADER_ROW_4], 4)  # E4（原始值）
+        self.header_label = _cell(header_rows[TemplateConfig.PT_DATA_HEADER_ROW], _COL_NO)  # A5
+
+        # SKU列：从I列开始，遇到品番为空的列结束
+        self.skus = []
+        jans, codes, colors, sizes = header_rows[:4]
+        col = _SKU_START
+        while True:
+            product_code = _cell(codes, col)
+            if not product_code:
+                break
+            jan, color, size = _cell(jans, col), _cell(colors, col), _cell(sizes, col)
+            self.skus.append({
+                'jan': str(jan) if jan else "",
+                'product_code': str(product_code),
+                'color': str(color) if color is not None else "",
+                'size': str(size) if size is not None else "",
+            })
+            col += 1
+
+        # 数据行（第6行起），每列一个列表
+        self.row_nums = []
+        self.first_col = []
+        self.store_codes = []
+        self.store_names = []
+        self.ctn_nos = []
+        self.patterns = []
+        self.totals = []
+        self.sku_filled = []  # SKU区域是否有非空单元格
+        # SKU数量（>0）的稀疏表：第i行为 qty_skus/qty_values[qty_offsets[i]:qty_offsets[i+1]]
+        self.qty_offsets = array('q', [0])
+        self.qty_skus = array('l')
+        self.qty_values = array('q')
+
+    def __len__(self) -> int:
+        return len(self.row_nums)
+
+    def quantities(self, i: int):
+        """第i个数据行中数量>0的 (SKU序号, 数量) 列表"""
+        start, end = self.qty_offsets[i], self.qty_offsets[i + 1]
+        return zip(self.qty_skus[start:end], self.qty_values[start:end])
+
+    def _load_rows(self, rows, start_row: int):
+        """逐行读入数据行，末尾的空行不保留"""
+        sku_end = _SKU_START + len(self.skus)
+        qty_skus, qty_values = self.qty_skus, self.qty_values
+        pending_blank = []
+        for row_num, row in enumerate(rows, start_row):
+            sku_values = row[_SKU_START:sku_end]
+            filled = any(sku_values)
+            key_values = (_cell(row, _COL_NO), _cell(row, _COL_STORE_CODE), _cell(row, _COL_STORE_NAME),
+                          _cell(row, _COL_CTN_NO), _cell(row, _COL_PATTERN), _cell(row, _COL_TOTAL))
+            if not filled and key_values == (None,) * 6:
+                pending_blank.append(row_num)
+                continue
+            # 中间的空行照常保留
+            for blank_num in pending_blank:
+                self._append_row(blank_num, (None,) * 6, False)
+            pending_blank = []
+            if filled:
+                for sku_idx, qty in enumerate(sku_values):
+                    if qty and isinstance(qty, (int, float)) and qty > 0:
+                        qty_skus.append(sku_idx)
+                        qty_values.append(int(qty))
+            self._append_row(row_num, key_values, filled)
+
+    def _append_row(self, row_num: int, key_values: tuple, filled: bool):
+        no, store_code, store_name, ctn_no, pattern, total = key_values
+        self.row_nums.append(row_num)
+        self.first_col.append(no)
+        self.store_codes.append(store_code)
+        self.store_names.append(store_name)
+        self.ctn_nos.append(ctn_no)
+        self.patterns.append(pattern)
+        self.totals.append(total)
+        self.sku_filled.append(filled)
+        self.qty_offsets.append(len(self.qty_skus))
+
+
+class PTWorkbook:
+    """一个工厂返回文件中所有PT页的解析结果"""
+
+    def __init__(self, path: str, sheets: List[PTSheet]):
+        self.path = path
+        self.sheets = sheets
+
+
+def _is_pt_sheet(title: str, header_label) -> bool:
+    """按名称（"PT-"）或数据表头（A5为"No."）判断是否为PT页"""
+    return PTSheetConfig.SHEET_NAME_MARK in title or header_label == PTSheetConfig.HEADER_LABEL
+
+
+def _parse_sheet(title: str, rows) -> Optional[PTSheet]:
+    """从按行产出单元格值的迭代器解析一个sheet，不是PT页时返回None"""
+    if title == TemplateConfig.PRODUCT_LIST_SHEET:
+        return None
+    header_rows = list(islice(rows, TemplateConfig.PT_DATA_START_ROW))
+    sheet = PTSheet(title, header_rows)
+    if not _is_pt_sheet(title, sheet.header_label):
+        return None
+    sheet._load_rows(rows, TemplateConfig.PT_DATA_START_ROW + 1)
+    return sheet
+
+
+def _xls_value(cell, datemode: int):
+    """xlrd单元格值换成与openpyxl一致的形式：空格为None、整数值为int、日期为datetime"""
+    ctype = cell.ctype
+    if ctype == xlrd.XL_CELL_NUMBER:
+        value = cell.value
+        return int(value) if value.is_integer() else value
+    if ctype == xlrd.XL_CELL_TEXT:
+        return cell.value
+    if ctype == xlrd.XL_CELL_DATE:
+        try:
+            return xlrd.xldate_as_datetime(cell.value, datemode)
+        except Exception:
+            return cell.value
+    if ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(cell.value)
+    return None
+
+
+def read_pt_workbook(path: str) -> PTWorkbook:
+    """
+    解析工厂返回文件的所有PT页（每个sheet只按行读取一遍）
+
+    Args:
+        path: 文件路径（.xlsx/.xlsm/.xls）
+    """
+    ext = os.path.splitext(path)[1].lower()
+    sheets = []
+    if ext in ('.xlsx', '.xlsm'):
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for ws in workbook.worksheets:
+                # 部分文件的dimension标记不准确，按实际行读取
+                ws.reset_dimensions()
+                sheet = _parse_sheet(ws.title, ws.iter_rows(values_only=True))
+                if sheet is not None:
+                    sheets.append(sheet)
+        finally:
+            workbook.close()
+    elif ext == '.xls':
+        workbook = xlrd.open_workbook(path, on_demand=True)
+        try:
+            for idx in range(workbook.nsheets):
+                ws = workbook.sheet_by_index(idx)
+                rows = ([_xls_value(cell, workbook.datemode) for cell in ws.row(r)] for r in range(ws.nrows))
+                sheet = _parse_sheet(ws.name, rows)
+                if sheet is not None:
+                    sheets.append(sheet)
+                workbook.unload_sheet(idx)
+        finally:
+            workbook.release_resources()
+    else:
+        raise ValueError(f"Unsupported file format: {ext}")
+    return PTWorkbook(path, sheets)
+
+
+class PTParseCache:
+    """进程内PT页解析结果缓存（按文件内容区分，线程安全，按最近使用淘汰）"""
+
+    def __init__(self, max_entries: int = None):
+        """
+        Args:
+            max_entries: 最多缓存的文件数，默认取PTSheetConfig.CACHE_ENTRIES
+        """
+        self.max_entries = max_entries or PTSheetConfig.CACHE_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, PTWorkbook] = OrderedDict()  # sha256 -> PTWorkbook
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> PTWorkbook:
+        """取得文件的解析结果（内容相同的文件只解析一次）"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        # 扩展名决定读取引擎，一并计入
+        key = f"{digest.hexdigest()}{os.path.splitext(path)[1].lower()}"
+        with self._lock:
+            book = self._entries.get(key)
+            if book is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return book
+        book = read_pt_workbook(path)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = book
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return book
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# 进程内共享的PT页解析缓存
+pt_parse_cache = PTParseCache()
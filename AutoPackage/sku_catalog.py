@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SKU目录模块 - 为转换流程中的SKU统一分配连续整数id
+
+读取器按品番给出SKU列，DataTransformer排序后登记到目录中，
+之后配比矩阵的列号、PT组的 sku_ids、写入器的列位置都直接使用这个id，
+不再反复拼接/拆分 "品番_カラー_サイズ" 字符串（カラー/サイズ中含 "_" 时也不会出错）。
+"""
+from typing import Dict, Iterator, List, Tuple
+
+
+class SkuCatalog:
+    """SKU目录：id -> SKU条目（品番、カラー、サイズ、JANCODE、总数量）"""
+
+    def __init__(self):
+        # 按id顺序排列的SKU条目（即DataTransformer输出的 'skus' 列表）
+        self.entries: List[Dict] = []
+        # (品番, カラー, サイズ) -> id列表（品番清洗后可能出现重复的SKU）
+        self._ids: Dict[Tuple[str, str, str], List[int]] = {}
+
+    def add(self, product_code: str, color: str, size: str) -> int:
+        """登记一个SKU，返回新分配的id"""
+        sku_id = len(self.entries)
+        self.entries.append({'product_code': product_code, 'color': color, 'size': size})
+        self._ids.setdefault((product_code, color, size), []).append(sku_id)
+        return sku_id
+
+    def ids_of(self, product_code: str, color: str, size: str) -> List[int]:
+        """查询SKU对应的id列表，未登记时返回空列表"""
+        return self._ids.get((product_code, color, size), [])
+
+    def key(self, sku_id: int) -> Tuple[str, str, str]:
+        """id对应的 (品番, カラー, サイズ)"""
+        entry = self.entries[sku_id]
+        return entry['product_code'], entry['color'], entry['size']
+
+    def keys(self) -> Iterator[Tuple[str, str, str]]:
+        """去重后的 (品番, カラー, サイズ)，按首次登记顺序"""
+        return iter(self._ids)
+
+    def first_ids(self) -> List[int]:
+        """每个去重后的SKU取第一个id（用于合计时同一SKU只计一次）"""
+        return [ids[0] for ids in self._ids.values()]
+
+    def set_jan(self, sku_id: int, jan_code: str):
+        """设置SKU的JANCODE"""
+        self.entries[sku_id]['jan_code'] = jan_code
+
+    def set_total(self, sku_id: int, total):
+        """设置SKU的全局总数量"""
+        self.entries[sku_id]['total_qty'] = total
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __getitem__(self, sku_id: int) -> Dict:
+        return self.entries[sku_id]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.entries)
@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式写入模块 - 按行输出PT页/店铺页，内存占用不随PT数/店铺数增长
+
+TemplateWriter 把整个输出工作簿保存在内存中，直到最后 save() 才写盘。
+StreamingTemplateWriter 使用 openpyxl 的 write-only 工作簿：每个PT页按行写出，
+已输出的行不再占用内存，每页写完立即压缩写入输出文件（不必等到最后一页）；
+表头/数据的写入逻辑与 TemplateWriter 完全相同，
+模板的样式表整体沿用，合并单元格、列宽、行高和灰色SKU表头保持一致。
+StreamingStoreDetailWriter 用同样的方式逐个输出④各店铺明细的店铺页，
+其他以模板为底的输出（如②アソート明細）通过 StreamingWorkbook 使用同样的机制。
+"""
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from copy import copy
+from typing import List
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from openpyxl import Workbook
+from openpyxl.cell._writer import write_cell
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.comments.comment_sheet import CommentRecord
+from openpyxl.compat import NUMERIC_TYPES, safe_string
+from openpyxl.drawing.spreadsheet_drawing import SpreadsheetDrawing
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_to_tuple
+from openpyxl.utils.indexed_list import IndexedList
+from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet._write_only import WriteOnlyWorksheet
+from openpyxl.worksheet._writer import WorksheetWriter
+from openpyxl.worksheet.worksheet import Worksheet
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.xml.functions import Element
+
+from config import TemplateConfig
+from store_detail_writer import StoreDetailWriter
+from style_registry import StyleRegistry
+from template_cache import template_cache
+from template_writer import TemplateWriter
+
+# 模板工作簿中需要整体沿用到输出工作簿的样式表
+_STYLE_TABLES = (
+    '_fonts', '_fills', '_borders', '_alignments', '_protections',
+    '_number_formats', '_date_formats', '_timedelta_formats',
+    '_cell_styles', '_named_styles', '_table_styles', '_differential_styles', '_colors',
+)
+
+
+def _share_styles(source_wb, target_wb):
+    """
+    让输出工作簿沿用模板的样式表，模板单元格的样式编号可以直接使用
+
+    模板工作簿来自模板缓存，可能被多个请求共用：写入时会追加条目的样式表按原顺序复制一份，
+    其余只读的部分直接共用。
+    """
+    for name in _STYLE_TABLES:
+        table = getattr(source_wb, name)
+        if isinstance(table, IndexedList):
+            table = IndexedList(table)
+        elif isinstance(table, set):
+            table = set(table)
+        setattr(target_wb, name, table)
+    target_wb.loaded_theme = source_wb.loaded_theme
+
+
+def _style_table_sizes(workbook):
+    """会在写入时追加条目的样式表的长度（用于判断渲染过程中是否新增了样式）"""
+    return tuple(len(getattr(workbook, name)) for name in _STYLE_TABLES
+                 if isinstance(getattr(workbook, name), IndexedList))
+
+
+class _BlankCell:
+    """只有样式、没有值的单元格：直接输出 <c r=".." s=".."/>，不创建openpyxl的Cell"""
+    __slots__ = ('coordinate', 'style_id')
+
+    def __init__(self, coordinate: str, style_id: int):
+        self.coordinate = coordinate
+        self.style_id = style_id
+
+
+def _cell_xml(cell):
+    """
+    数值/字符串单元格的XML文本（与 openpyxl 逐元素输出的结果等价）
+
+    日期、公式、富文本、布尔值和带超链接的单元格返回None，交给 openpyxl 输出。
+    """
+    data_type = cell.data_type
+    if cell._hyperlink is not None or data_type not in ('n', 's'):
+        return None
+    value = cell._value
+    style = f' s="{cell.style_id}"' if cell.has_style else ''
+    if data_type == 's':
+        if value is None or value == '':
+            return f'<c r="{cell.coordinate}"{style} t="inlineStr"/>'
+        if not isinstance(value, str):
+            return None
+        space = ' xml:space="preserve"' if value != value.strip() and value.strip() else ''
+        return f'<c r="{cell.coordinate}"{style} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+    if value is None or value == '':
+        return f'<c r="{cell.coordinate}"{style} t="n"/>'
+    if not isinstance(value, NUMERIC_TYPES):
+        return None
+    return f'<c r="{cell.coordinate}"{style} t="n"><v>{safe_string(value)}</v></c>'
+
+
+class _RowWriter(WorksheetWriter):
+    """
+    行输出时识别 _BlankCell，其余单元格按 openpyxl 原逻辑输出
+
+    openpyxl 在未安装lxml时用 et_xmlfile 逐个元素序列化，每个单元格都要构造并遍历Element，
+    是大表输出的主要开销：et_xmlfile 提供底层写入函数时，空单元格和普通数值/字符串单元格直接写XML文本。
+    """
+
+    def write_row(self, xf, row, row_idx):
+        attrs = {'r': f"{row_idx}"}
+        attrs.update(self.ws.row_dimensions.get(row_idx, {}))
+        raw = getattr(xf, '_file', None)
+        if not callable(raw):
+            raw = None
+
+        with xf.element("row", attrs):
+            for cell in row:
+                if type(cell) is _BlankCell:
+                    if raw is not None:
+                        raw(f'<c r="{cell.coordinate}" s="{cell.style_id}"/>')
+                    else:
+                        xf.write(Element("c", {'r': cell.coordinate, 's': f"{cell.style_id}"}))
+                    continue
+                if cell._comment is not None:
+                    self.ws._comments.append(CommentRecord.from_cell(cell))
+                if cell._value is None and not cell.has_style and not cell._comment:
+                    continue
+                if raw is not None:
+                    text = _cell_xml(cell)
+                    if text is not None:
+                        raw(text)
+                        continue
+                write_cell(xf, self.ws, cell, cell.has_style)
+
+
+class _CellRowWorksheet(WriteOnlyWorksheet):
+    """write-only工作表：append() 直接接受已设置好值和样式的Cell列表，不再逐个转换"""
+
+    def _get_writer(self):
+        if self._writer is None:
+            self._writer = _RowWriter(self)
+            self._writer.write_top()
+
+    def _values_to_row(self, values, row_idx):
+        return (cell for cell in values if cell is not None)
+
+
+def _create_sheet(workbook, title: str):
+    """在write-only工作簿中新建 _CellRowWorksheet"""
+    ws = _CellRowWorksheet(parent=workbook, title=title)
+    workbook._add_sheet(ws)
+    return ws
+
+
+class _StreamingExcelWriter(ExcelWriter):
+    """
+    边写边输出的 ExcelWriter：工作表写完后立即压缩进输出文件并删除临时文件
+
+    save() 时只补写工作簿、样式表和清单等其余部分，已输出的工作表不再重复写入。
+    """
+
+    def __init__(self, workbook, filename: str):
+        super().__init__(workbook, ZipFile(filename, 'w', ZIP_DEFLATED, allowZip64=True))
+        self._streamed = {}  # 已输出的工作表编号 -> 关系列表
+
+    def stream_worksheet(self, ws):
+        """关闭工作表并把它写入输出文件（工作表编号与 save() 时的顺序一致）"""
+        if not ws.closed:
+            ws.close()
+        self.add_worksheet_xml(ws, ws._writer.out, ws._writer._rels)
+        ws._writer.cleanup()
+
+    def add_worksheet_xml(self, ws, xml_path: str, rels):
+        """把已渲染好的工作表XML文件作为 ws 的内容写入输出文件（并行渲染时使用）"""
+        ws._id = self.workbook.worksheets.index(ws) + 1
+        self._archive.write(xml_path, ws.path[1:])
+        self._streamed[ws._id] = rels
+
+    def write_worksheet(self, ws):
+        if ws._id not in self._streamed:
+            super().write_worksheet(ws)
+            return
+        ws._drawing = SpreadsheetDrawing()
+        ws._rels = self._streamed[ws._id]
+        self.manifest.append(ws)
+
+    def save(self):
+        self.workbook.properties.modified = datetime.datetime.utcnow()
+        super().save()
+
+    def abort(self):
+        """写入失败时关闭输出文件"""
+        self._archive.close()
+
+
+class StreamingSheet:
+    """
+    按行流式输出的工作表（包装 write-only 工作表）
+
+    提供 TemplateWriter 用到的 cell() / sheet['A1'] / merge_cells / column_dimensions 接口。
+    写入需按行递增：访问更大的行号时，之前的行连同模板中该行的单元格一起输出，之后不能再修改；
+    模板范围内已输出的行仍可读取（复制模板行样式时使用）。
+    模板单元格只在被读写时才复制，未改动的空白模板单元格按样式编号直接输出。
+    """
+
+    def __init__(self, ws, template_ws=None, keep_views: bool = False):
+        """
+        Args:
+            ws: _create_sheet() 创建的 write-only 工作表
+            template_ws: 模板工作表（其单元格、行高列宽和页面设置会被复制），None表示空白页
+            keep_views: 是否同时复制视图/条件格式/数据验证（沿用模板页本身时使用）
+        """
+        self.ws = ws
+        self.parent = ws.parent
+        self.title = ws.title
+        self.column_dimensions = ws.column_dimensions
+        self.row_dimensions = ws.row_dimensions
+        self.merged_cells = ws.merged_cells
+        self._cells = {}            # 尚未输出的单元格 (row, col) -> Cell
+        self._blanks = {}           # 尚未输出的空单元格 行号 -> [(列号列表, 样式数组)]
+        self._next_row = 1          # 下一个要输出的行号
+        self._max_col = 0
+        self._retained = {}         # 模板范围内已输出、被改动过的单元格（只读）
+        self._template_cells = {}   # 模板单元格 (row, col) -> Cell（只读）
+        self._template_rows = {}    # 行号 -> [(列号, 模板单元格, 样式编号)]
+        self._template_max_row = 0
+        if template_ws is not None:
+            self._copy_template(template_ws, keep_views)
+
+    def _copy_template(self, template_ws, keep_views: bool):
+        """复制模板页的单元格索引、行高列宽和页面设置（与 copy_worksheet 相同的范围）"""
+        self._template_cells = template_ws._cells
+        cell_styles = self.parent._cell_styles
+        for (row, col), cell in template_ws._cells.items():
+            style_id = cell_styles.add(cell._style) if cell.has_style else None
+            self._template_rows.setdefault(row, []).append((col, cell, style_id))
+            self._max_col = max(self._max_col, col)
+        self._template_max_row = max(self._template_rows, default=0)
+
+        for attr in ('row_dimensions', 'column_dimensions'):
+            target = getattr(self.ws, attr)
+            for key, dim in getattr(template_ws, attr).items():
+                target[key] = copy(dim)
+                target[key].parent = self.ws
+
+        self.ws.sheet_format = copy(template_ws.sheet_format)
+        self.ws.sheet_properties = copy(template_ws.sheet_properties)
+        self.ws.page_margins = copy(template_ws.page_margins)
+        self.ws.page_setup = copy(template_ws.page_setup)
+        self.ws.print_options = copy(template_ws.print_options)
+        for rng in template_ws.merged_cells.ranges:
+            self.ws.merged_cells.add(CellRange(rng.coord))
+
+        if keep_views:
+            self.ws.views = copy(template_ws.views)
+            self.ws.conditional_formatting = template_ws.conditional_formatting
+            self.ws.data_validations = template_ws.data_validations
+
+    def _template_cell_copy(self, row: int, column: int):
+        """模板单元格的可写副本（模板中没有该单元格时为None）"""
+        template_cell = self._template_cells.get((row, column))
+        if template_cell is None:
+            return None
+        cell = Cell(self.ws, row=row, column=column)
+        cell._value = template_cell._value
+        cell.data_type = template_cell.data_type
+        if template_cell.has_style:
+            cell._style = copy(template_cell._style)
+        return cell
+
+    def _flush_before(self, row: int):
+        """输出 row 之前的所有行"""
+        while self._next_row < row:
+            self._emit_row(self._next_row)
+            self._next_row += 1
+
+    def _emit_row(self, row: int):
+        row_cells = [(col, cell) for (r, col), cell in self._cells.items() if r == row]
+        template_cells = self._template_rows.get(row, ())
+        blanks = self._blanks.pop(row, ())
+        width = max([self._max_col] + [col for col, _ in row_cells]
+                    + [columns[-1] for columns, _ in blanks if columns])
+        values = [None] * width
+        suffix = str(row)
+        for columns, style in blanks:
+            style_id = self.parent._cell_styles.add(style)
+            for col in columns:
+                values[col - 1] = _BlankCell(get_column_letter(col) + suffix, style_id)
+        # 未改动的模板单元格（已改动的在 row_cells 中，随后覆盖）
+        for col, template_cell, style_id in template_cells:
+            if template_cell._value is not None:
+                values[col - 1] = self._template_cell_copy(row, col)
+            elif style_id is not None:
+                values[col - 1] = _BlankCell(get_column_letter(col) + suffix, style_id)
+            else:
+                values[col - 1] = None
+        for col, cell in row_cells:
+            del self._cells[(row, col)]
+            if isinstance(cell, MergedCell):
+                # write-only工作表只接受Cell，合并区域内的单元格按只有样式的空单元格输出
+                merged = cell
+                cell = Cell(self.ws, row=row, column=col)
+                cell._style = copy(merged._style)
+            values[col - 1] = cell
+            if row <= self._template_max_row:
+                self._retained[(row, col)] = cell
+        self.ws.append(values)
+
+    def cell(self, row: int, column: int):
+        """取得单元格；已输出的行只能读取模板范围内保留的单元格"""
+        if row < self._next_row:
+            cell = self._retained.get((row, column))
+            if cell is None:
+                if row > self._template_max_row:
+                    raise ValueError(f"{self.title}: 第{row}行已输出，不能再写入")
+                # 未改动的单元格从模板读取，模板中不存在的按空白单元格读取
+                cell = self._template_cell_copy(row, column)
+                if cell is None:
+                    cell = Cell(self.ws, row=row, column=column)
+            return cell
+        self._flush_before(row)
+        cell = self._cells.get((row, column))
+        if cell is None:
+            cell = self._template_cell_copy(row, column)
+            if cell is None:
+                cell = Cell(self.ws, row=row, column=column)
+            self._cells[(row, column)] = cell
+        return cell
+
+    @property
+    def template_max_row(self) -> int:
+        """模板单元格所在的最大行号（这些行的单元格以模板样式为底）"""
+        return self._template_max_row
+
+    def add_blank_cells(self, row: int, columns, style):
+        """
+        在 row 行的 columns 列（升序）写入只有样式的空单元格，各列共用同一个样式数组
+
+        同一位置已有的单元格优先；只适用于模板范围以外的行。
+        """
+        if row < self._next_row:
+            raise ValueError(f"{self.title}: 第{row}行已输出，不能再写入")
+        self._flush_before(row)
+        self._blanks.setdefault(row, []).append((columns, style))
+
+    def __getitem__(self, coordinate: str):
+        row, column = coordinate_to_tuple(coordinate)
+        return self.cell(row=row, column=column)
+
+    def __setitem__(self, coordinate: str, value):
+        self[coordinate].value = value
+
+    def write_values(self, row: int, columns, values):
+        """在 row 行的 columns 列依次写入 values（模板范围内沿用模板单元格的样式）"""
+        if row < self._next_row:
+            raise ValueError(f"{self.title}: 第{row}行已输出，不能再写入")
+        self._flush_before(row)
+        cells = self._cells
+        for col, value in zip(columns, values):
+            cell = cells.get((row, col))
+            if cell is None:
+                cell = self._template_cell_copy(row, col)
+                if cell is None:
+                    cell = Cell(self.ws, row=row, column=col)
+                cells[(row, col)] = cell
+            cell.value = value
+
+    def merge_cells(self, range_string: str):
+        """合并单元格（范围内的模板单元格先载入，边框处理与普通工作表相同）"""
+        cr = CellRange(range_string)
+        self.cell(row=cr.min_row, column=cr.min_col)
+        # 合并时会读取范围内（右下角等）单元格的边框，先复制范围内的模板单元格
+        for row, col in cr.cells:
+            if (row, col) not in self._cells:
+                cell = self._template_cell_copy(row, col)
+                if cell is not None:
+                    self._cells[(row, col)] = cell
+        Worksheet.merge_cells(self, range_string)
+
+    _clean_merge_range = Worksheet._clean_merge_range
+
+    def close(self):
+        """输出剩余的行（包括模板中尚未覆盖的行）"""
+        last_row = max([self._template_max_row] + [r for r, _ in self._cells] + list(self._blanks))
+        self._flush_before(last_row + 1)
+        self._retained = {}
+
+
+class StreamingWorkbook:
+    """
+    以模板工作簿为底的流式输出工作簿：沿用模板的样式表，各页写完即写入输出文件
+
+    用法：new_sheet() 取得 StreamingSheet 按行写入，finish_sheet() 输出该页，最后 save()。
+    """
+
+    def __init__(self, template_wb, output_path: str):
+        """
+        Args:
+            template_wb: 模板工作簿（可以是模板缓存中的只读工作簿）
+            output_path: 输出文件路径
+        """
+        self.template_wb = template_wb
+        self.workbook = Workbook(write_only=True)
+        _share_styles(template_wb, self.workbook)
+        self._excel_writer = _StreamingExcelWriter(self.workbook, output_path)
+
+    def new_sheet(self, title: str, template_ws=None, keep_views: bool = False) -> StreamingSheet:
+        """新建一页（template_ws 指定时以该模板页为底）"""
+        return StreamingSheet(_create_sheet(self.workbook, title), template_ws, keep_views=keep_views)
+
+    def finish_sheet(self, sheet: StreamingSheet):
+        """输出剩余的行并把该页写入输出文件"""
+        sheet.close()
+        self._excel_writer.stream_worksheet(sheet.ws)
+
+    def copy_sheet(self, template_ws):
+        """原样输出模板中的一页"""
+        self.finish_sheet(self.new_sheet(template_ws.title, template_ws, keep_views=True))
+
+    def save(self):
+        self._excel_writer.save()
+
+    def abort(self):
+        """写入失败时关闭输出文件"""
+        self._excel_writer.abort()
+
+
+class StreamingTemplateWriter(TemplateWriter):
+    """流式写入的TemplateWriter：输出内容与 TemplateWriter 相同，PT页逐行写出、逐页写入输出文件"""
+
+    def __init__(self, template_path: str, output_path: str):
+        super().__init__(template_path, output_path)
+        self._excel_writer = None
+
+    def write(self, transformed_data, is_hanger: bool = False,
+              parallel: bool = False, max_workers: int = None) -> str:
+        """
+        写入数据到输出文件
+
+        Args:
+            transformed_data: 转换后的数据
+            is_hanger: 是否为挂装商品（影响CTN_NO写入逻辑）
+            parallel: 是否把各PT页分给多个进程并行渲染
+            max_workers: 并行进程数，默认为CPU核数
+
+        Returns:
+            输出文件路径
+        """
+        try:
+            # 取得缓存的模板（只读取结构和样式，输出写入新的write-only工作簿）
+            print(f"加载模板: {self.template_path}")
+            template_wb = template_cache.skeleton(self.template_path).workbook
+            self.workbook = Workbook(write_only=True)
+            _share_styles(template_wb, self.workbook)
+            self.styles = StyleRegistry(self.workbook)
+            self._register_styles()
+
+            template_sheet_name = TemplateConfig.PT_TEMPLATE_SHEET
+            template_pt_sheet = None
+            if template_sheet_name in template_wb.sheetnames:
+                template_pt_sheet = template_wb[template_sheet_name]
+
+            print(f"写入输出文件: {self.output_path}")
+            self._excel_writer = _StreamingExcelWriter(self.workbook, self.output_path)
+
+            # 模板中的其他页原样输出，商品一覧页同时写入SKU列表
+            product_list_found = False
+            for template_ws in template_wb.worksheets:
+                if template_ws is template_pt_sheet:
+                    continue
+                sheet = StreamingSheet(_create_sheet(self.workbook, template_ws.title), template_ws, keep_views=True)
+                if template_ws.title == TemplateConfig.PRODUCT_LIST_SHEET:
+                    product_list_found = True
+                    self._update_product_list(transformed_data, sheet)
+                self._finish_pt_sheet(sheet)
+            if not product_list_found:
+                print("警告: 更新商品一覧页失败: 找不到商品一覧sheet")
+
+            # 创建所有PT页（每页写完即写入输出文件）
+            if parallel:
+                self._create_pt_sheets_parallel(transformed_data, template_pt_sheet, is_hanger, max_workers)
+            else:
+                self._create_pt_sheets(transformed_data, template_pt_sheet, is_hanger)
+
+            # 补写工作簿结构和样式表
+            print(f"保存输出文件: {self.output_path}")
+            self._excel_writer.save()
+
+            return self.output_path
+
+        except Exception as e:
+            if self._excel_writer is not None:
+                self._excel_writer.abort()
+            raise Exception(f"写入文件失败: {e}")
+        finally:
+            self._excel_writer = None
+
+    def _new_pt_sheet(self, pt_name: str, template_sheet):
+        """新建流式PT页（以模板PT-1页为底）"""
+        return StreamingSheet(_create_sheet(self.workbook, pt_name), template_sheet)
+
+    def _register_styles(self):
+        """登记固定样式；空数量单元格共用的样式数组也预先加入样式表，并行渲染时各进程的编号一致"""
+        super()._register_styles()
+        self.workbook._cell_styles.add(self.styles.style_array('data_sku'))
+
+    def _write_blank_cells(self, sheet, row: int, columns, style_name: str):
+        """模板范围以外的行：空单元格只记录列号和共用的样式，输出时不创建Cell"""
+        if row <= sheet.template_max_row:
+            super()._write_blank_cells(sheet, row, columns, style_name)
+            return
+        sheet.add_blank_cells(row, columns, self.styles.style_array(style_name))
+
+    def _finish_pt_sheet(self, sheet):
+        """输出剩余的行，并把该页写入输出文件"""
+        sheet.close()
+        self._excel_writer.stream_worksheet(sheet.ws)
+
+    def _create_pt_sheets_parallel(self, data, template_sheet, is_hanger: bool, max_workers: int = None):
+        """
+        多进程并行渲染PT页
+
+        各PT页在子进程中渲染成工作表XML临时文件，父进程按PT顺序把它们写入输出文件，
+        工作簿结构、样式表和商品一覧页仍由父进程输出。
+        单元格XML中的样式编号指向工作簿的样式表，所以先在父进程中渲染一个只含一家店铺的样例PT页，
+        把PT页用到的样式组合全部登记好，子进程从这份样式表出发，输出的编号与父进程一致。
+        """
+        pt_groups = data['pt_groups']
+        workers = min(max_workers or os.cpu_count() or 1, len(pt_groups))
+        if workers <= 1:
+            self._create_pt_sheets(data, template_sheet, is_hanger)
+            return
+
+        metadata = data.get('metadata', {})
+        skus = data['skus']
+        style_tables = {name: getattr(self.workbook, name) for name in _STYLE_TABLES}
+        renderer = _PtSheetRenderer(template_sheet, style_tables, metadata, skus, is_hanger)
+        sample = dict(pt_groups[0], stores=pt_groups[0]['stores'][:1])
+        os.remove(renderer.render(sample)[0])
+        style_blob = pickle.dumps(style_tables, protocol=pickle.HIGHEST_PROTOCOL)
+
+        print(f"并行渲染PT页: {len(pt_groups)} 页, {workers} 进程")
+        # 子进程的XML临时文件都放在单独的目录中，子进程异常退出时留下的文件随目录一并删除
+        work_dir = tempfile.mkdtemp(prefix='autopackage_pt_')
+        written = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_pt_worker,
+                                     initargs=(self.template_path, style_blob, metadata, skus, is_hanger,
+                                               work_dir)) as executor:
+                try:
+                    futures = [executor.submit(_render_pt_worker, pt_group) for pt_group in pt_groups]
+                    for pt_group, future in zip(pt_groups, futures):
+                        xml_path, rels, consistent = future.result()
+                        if not consistent:
+                            # 该页用到了样例页之外的样式，子进程中的样式编号无效，改在父进程中渲染
+                            os.remove(xml_path)
+                            xml_path, rels, _ = renderer.render(pt_group)
+                        self._add_pt_sheet_xml(pt_group['pt_name'], xml_path, rels)
+                        written += 1
+                except BrokenProcessPool:
+                    # 子进程异常退出或无法启动，其余PT页在本进程中渲染
+                    print("子进程异常退出，其余PT页改为在本进程中渲染")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        for pt_group in pt_groups[written:]:
+            xml_path, rels, _ = renderer.render(pt_group)
+            self._add_pt_sheet_xml(pt_group['pt_name'], xml_path, rels)
+
+    def _add_pt_sheet_xml(self, pt_name: str, xml_path: str, rels):
+        """把渲染好的PT页XML临时文件写入输出文件，并删除临时文件"""
+        ws = _create_sheet(self.workbook, pt_name)
+        self._excel_writer.add_worksheet_xml(ws, xml_path, rels)
+        os.remove(xml_path)
+
+
+class _PtSheetRenderer(StreamingTemplateWriter):
+    """把单个PT页渲染成独立的工作表XML临时文件（并行写入时使用，不输出工作簿）"""
+
+    def __init__(self, template_sheet, style_tables, metadata, skus, is_hanger: bool):
+        """
+        Args:
+            template_sheet: 模板PT-1页（None表示空白页）
+            style_tables: 样式表（属性名 -> 表），渲染时新增的样式登记到这些表中
+            metadata/skus/is_hanger: 同 TemplateWriter._create_single_pt_sheet
+        """
+        super().__init__(None, None)
+        self.template_sheet = template_sheet
+        self.metadata = metadata
+        self.skus = skus
+        self.is_hanger = is_hanger
+        self.workbook = Workbook(write_only=True)
+        for name, table in style_tables.items():
+            setattr(self.workbook, name, table)
+        self.styles = StyleRegistry(self.workbook)
+        self._register_styles()
+        # 与父进程一致的样式表长度；此后新增的样式只存在于本渲染器中
+        self._base_sizes = _style_table_sizes(self.workbook)
+        self._sheet = None
+
+    def render(self, pt_group):
+        """
+        渲染一个PT页，返回 (XML临时文件路径, 关系列表, 样式表是否仍与初始时一致)
+
+        样式表一旦新增过条目，之后渲染的页都可能引用这些只在本渲染器中的编号，一律视为不一致。
+        """
+        self._create_single_pt_sheet(pt_group, self.metadata, self.skus, self.template_sheet, self.is_hanger)
+        ws = self._sheet.ws
+        if not ws.closed:
+            ws.close()
+        self.workbook._sheets.remove(ws)
+        return ws._writer.out, ws._writer._rels, _style_table_sizes(self.workbook) == self._base_sizes
+
+    def _new_pt_sheet(self, pt_name: str, template_sheet):
+        self._sheet = super()._new_pt_sheet(pt_name, template_sheet)
+        return self._sheet
+
+    def _finish_pt_sheet(self, sheet):
+        sheet.close()
+
+
+
+class StreamingStoreDetailWriter(StoreDetailWriter):
+    """
+    流式写入的各店铺明细（④）：输出内容与 StoreDetailWriter 相同
+
+    模板页从模板缓存取得，只解析一次；每个店铺页以模板页为底逐行写出，写完即写入输出文件，
+    内存占用不随店铺数增长。店铺较多时可按店铺代码顺序拆分成多个文件。
+    """
+
+    def write(self, data):
+        """
+        写入数据
+        :param data: DataTransformer 的输出结果
+        """
+        return self.write_parts(data, 1)[0]
+
+    def write_parts(self, data, parts: int = 1) -> List[str]:
+        """
+        写入数据，按店铺代码顺序均分为 parts 个文件
+
+        Args:
+            data: DataTransformer 的输出结果
+            parts: 拆分的文件数；大于1时文件名加 _1, _2 ... 后缀
+
+        Returns:
+            输出文件路径列表
+        """
+        stores = self._sorted_stores(data)
+        parts = max(1, min(parts, len(stores)))
+        if parts == 1:
+            chunks = [(self.output_path, stores)]
+        else:
+            stem, ext = os.path.splitext(self.output_path)
+            size = -(-len(stores) // parts)
+            chunks = [(f"{stem}_{idx + 1}{ext}", stores[start:start + size])
+                      for idx, start in enumerate(range(0, len(stores), size))]
+
+        template_wb = template_cache.skeleton(self.template_path).workbook
+        for output_path, chunk in chunks:
+            self._write_file(output_path, template_wb, chunk, data)
+        return [output_path for output_path, _ in chunks]
+
+    def _write_file(self, output_path: str, template_wb, stores, data):
+        """把一组店铺写入一个输出文件"""
+        print(f"Writing Store Detail to: {output_path}")
+        workbook = StreamingWorkbook(template_wb, output_path)
+        try:
+            template_sheet = template_wb.active
+            # 模板中的其他页原样保留，模板页本身只在没有店铺页时输出
+            for template_ws in template_wb.worksheets:
+                if template_ws is not template_sheet:
+                    workbook.copy_sheet(template_ws)
+            if not stores:
+                workbook.copy_sheet(template_sheet)
+
+            for store_code, store_data in stores:
+                sheet = workbook.new_sheet(self._sheet_title(store_code, store_data), template_sheet)
+                self._fill_store_sheet(sheet, store_code, store_data, data)
+                workbook.finish_sheet(sheet)
+
+            print(f"Saving Store Detail file: {output_path}")
+            workbook.save()
+        except Exception as e:
+            workbook.abort()
+            print(f"Error writing store detail: {e}")
+            raise e
+
+# 子进程中的PT页渲染器（由 _init_pt_worker 创建）
+_pt_renderer = None
+
+
+def _init_pt_worker(template_path: str, style_blob: bytes, metadata, skus, is_hanger: bool, work_dir: str):
+    """子进程初始化：从模板缓存取得PT-1页，按父进程的样式表建立渲染器，XML临时文件写到 work_dir"""
+    global _pt_renderer
+    tempfile.tempdir = work_dir
+    template_wb = template_cache.skeleton(template_path).workbook
+    template_sheet = None
+    if TemplateConfig.PT_TEMPLATE_SHEET in template_wb.sheetnames:
+        template_sheet = template_wb[TemplateConfig.PT_TEMPLATE_SHEET]
+    _pt_renderer = _PtSheetRenderer(template_sheet, pickle.loads(style_blob), metadata, skus, is_hanger)
+
+
+def _render_pt_worker(pt_group):
+    """在子进程中渲染一个PT页"""
+    return _pt_renderer.render(pt_group)
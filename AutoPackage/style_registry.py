@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+样式注册表模块 - 工作簿内共享的单元格样式
+
+openpyxl 每次给单元格赋 Font/Border/PatternFill/Alignment 时，都要对样式对象求哈希
+并在工作簿的样式表中查重。大表逐格赋新对象（或 copy() 模板单元格样式）时这部分开销很大。
+注册表在工作簿内把每种样式只登记一次，记下各部分在样式表中的编号，
+之后直接把编号写入单元格的样式数组，输出的样式与逐格赋值完全相同。
+"""
+from copy import copy
+from typing import Dict, Tuple
+
+from openpyxl.styles.cell_style import StyleArray
+
+# 单元格样式数组中可由注册表设置的部分：(属性名, 工作簿样式表)
+_STYLE_PARTS = (
+    ('font', 'fontId', '_fonts'),
+    ('fill', 'fillId', '_fills'),
+    ('border', 'borderId', '_borders'),
+    ('alignment', 'alignmentId', '_alignments'),
+)
+
+
+class StyleRegistry:
+    """单个工作簿的样式注册表，按名称登记样式后按引用赋给单元格"""
+
+    def __init__(self, workbook):
+        """
+        初始化注册表
+
+        Args:
+            workbook: openpyxl Workbook，样式登记到它的样式表中
+        """
+        self.workbook = workbook
+        self._styles: Dict[str, Tuple[Tuple[str, int], ...]] = {}
+        self._clones: Dict[Tuple, Tuple[Tuple[str, int], ...]] = {}
+        self._arrays: Dict[str, StyleArray] = {}
+
+    def register(self, name: str, font=None, fill=None, border=None, alignment=None):
+        """
+        登记命名样式；未指定的部分在赋值时保持单元格原样
+
+        Args:
+            name: 样式名称
+            font/fill/border/alignment: openpyxl样式对象
+        """
+        values = {'font': font, 'fill': fill, 'border': border, 'alignment': alignment}
+        ids = []
+        for part, key, collection in _STYLE_PARTS:
+            if values[part] is not None:
+                ids.append((key, getattr(self.workbook, collection).add(values[part])))
+        self._styles[name] = tuple(ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._styles
+
+    def apply(self, cell, name: str):
+        """把命名样式赋给单元格（与逐个设置 cell.font/fill/border/alignment 结果相同）"""
+        self._set_ids(cell, self._styles[name])
+
+    def style_array(self, name: str) -> StyleArray:
+        """命名样式赋给无样式单元格后的样式数组（同名共用一个，调用方不得修改）"""
+        style = self._arrays.get(name)
+        if style is None:
+            style = self._arrays[name] = StyleArray()
+            for key, idx in self._styles[name]:
+                setattr(style, key, idx)
+        return style
+
+    def copy_from(self, template_cell, target_cell, font_name: str = None, font_size=None):
+        """
+        把模板单元格的字体/边框/填充/对齐复制到目标单元格，可覆盖字体名和字号
+
+        相同的模板样式和覆盖组合只登记一次。
+        """
+        src = template_cell._style if template_cell._style is not None else StyleArray()
+        cache_key = (src.fontId, src.fillId, src.borderId, src.alignmentId, font_name, font_size)
+        ids = self._clones.get(cache_key)
+        if ids is None:
+            font_id = src.fontId
+            if font_name or font_size:
+                font = copy(self.workbook._fonts[src.fontId])
+                if font_name:
+                    font.name = font_name
+                if font_size:
+                    font.size = font_size
+                font_id = self.workbook._fonts.add(font)
+            ids = (('fontId', font_id), ('fillId', src.fillId),
+                   ('borderId', src.borderId), ('alignmentId', src.alignmentId))
+            self._clones[cache_key] = ids
+        self._set_ids(target_cell, ids)
+
+    @staticmethod
+    def _set_ids(cell, ids):
+        style = cell._style
+        if style is None:
+            style = cell._style = StyleArray()
+        for key, idx in ids:
+            setattr(style, key, idx)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+模板缓存模块 - 每个模板文件只解析一次，之后按请求发放独立的工作簿副本
+
+load_workbook 每次都要解压并解析XML、重建样式表；②模板预置了9000行带边框的空单元格，
+解析一次要近1秒。缓存把模板编译成骨架：工作簿结构（样式表、合并单元格、行高列宽、页面设置等）
+去掉单元格后pickle保存，单元格另存为 (行, 列, 值, 类型, 样式) 元组。
+发放副本时反序列化结构，再直接按元组重建单元格，不再经过XML解析。
+
+模板文件的mtime/大小变化时重新计算内容SHA-256，内容确实变化才重新解析。
+
+骨架的编译和复制（以及 streaming_writer 的流式写出）直接使用 openpyxl 的内部结构
+（ws._cells、cell._style、WorksheetWriter、ExcelWriter 等），只在 openpyxl 3.1.x 上验证过。
+其他版本上 OPENPYXL_INTERNALS_SUPPORTED 为 False：缓存直接返回 load_workbook 的结果，
+各输出改用非流式的 TemplateWriter / StoreDetailWriter。
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from copy import copy
+from typing import Optional
+
+import openpyxl
+from openpyxl import load_workbook
+from openpyxl.cell.cell import Cell, MergedCell
+from openpyxl.styles.cell_style import StyleArray
+
+from config import TemplateCacheConfig
+
+logger = logging.getLogger(__name__)
+
+# 验证过内部结构的 openpyxl 版本系列（主版本, 次版本）
+OPENPYXL_TESTED_SERIES = ('3', '1')
+OPENPYXL_INTERNALS_SUPPORTED = tuple(openpyxl.__version__.split('.')[:2]) == OPENPYXL_TESTED_SERIES
+if not OPENPYXL_INTERNALS_SUPPORTED:
+    logger.warning(f"openpyxl {openpyxl.__version__} 未经验证（已验证 {'.'.join(OPENPYXL_TESTED_SERIES)}.x），"
+                   f"停用模板缓存和流式写出")
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class TemplateSkeleton:
+    """编译后的模板：只读的原工作簿 + 用于快速复制的结构和单元格数据"""
+
+    def __init__(self, path: str):
+        """
+        解析模板并编译骨架
+
+        Args:
+            path: 模板文件路径（.xlsx）
+        """
+        self.path = path
+        self.workbook = load_workbook(path)  # 只读引用，调用方不得修改
+        self._cells = []
+        self._structure = self._compile()
+
+    def _compile(self) -> bytes:
+        """拆出各工作表的单元格，把剩余的工作簿结构序列化"""
+        detached = []
+        for ws in self.workbook.worksheets:
+            rows = []
+            for (row, col), cell in ws._cells.items():
+                merged = isinstance(cell, MergedCell)
+                style = StyleArray(cell._style) if cell.has_style else None
+                if merged:
+                    rows.append((row, col, None, None, style, True, None, None))
+                else:
+                    rows.append((row, col, cell._value, cell.data_type, style, False,
+                                 cell._hyperlink, cell._comment))
+            self._cells.append(rows)
+            detached.append(ws._cells)
+            ws._cells = {}
+        try:
+            return pickle.dumps(self.workbook, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            for ws, cells in zip(self.workbook.worksheets, detached):
+                ws._cells = cells
+
+    def clone(self):
+        """生成一个可自由修改的工作簿副本（与 load_workbook 的结果等价）"""
+        workbook = pickle.loads(self._structure)
+        new_cell = Cell.__new__
+        for ws, rows in zip(workbook.worksheets, self._cells):
+            cells = {}
+            for row, col, value, data_type, style, merged, hyperlink, comment in rows:
+                if merged:
+                    cell = MergedCell(ws, row=row, column=col)
+                else:
+                    cell = new_cell(Cell)
+                    cell.parent = ws
+                    cell.row = row
+                    cell.column = col
+                    cell._value = value
+                    cell.data_type = data_type
+                    cell._hyperlink = None
+                    cell._comment = None
+                    if hyperlink is not None:
+                        cell.hyperlink = copy(hyperlink)
+                    if comment is not None:
+                        cell.comment = copy(comment)
+                cell._style = StyleArray(style) if style is not None else StyleArray()
+                cells[(row, col)] = cell
+            ws._cells = cells
+        return workbook
+
+
+class TemplateCache:
+    """进程内模板缓存（线程安全，按最近使用淘汰）"""
+
+    def __init__(self, max_entries: int = None):
+        """
+        初始化缓存
+
+        Args:
+            max_entries: 最多缓存的模板数，默认取TemplateCacheConfig.MAX_ENTRIES
+        """
+        self.max_entries = max_entries or TemplateCacheConfig.MAX_ENTRIES
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # 绝对路径 -> [(mtime_ns, size), sha256, TemplateSkeleton]
+        self._lock = threading.Lock()
+        self._path_locks = {}
+
+    def skeleton(self, template_path: str) -> TemplateSkeleton:
+        """取得模板骨架（文件变化时重新编译）"""
+        path = os.path.abspath(template_path)
+        with self._lock:
+            path_lock = self._path_locks.setdefault(path, threading.Lock())
+        # 同一模板只由一个线程解析，其他线程等待结果
+        with path_lock:
+            stat = os.stat(path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            with self._lock:
+                entry = self._entries.get(path)
+            if entry is not None:
+                if entry[0] != signature:
+                    # mtime变化但内容相同（如重新复制同一文件）时继续使用
+                    if _file_digest(path) == entry[1]:
+                        entry[0] = signature
+                    else:
+                        logger.info(f"模板已更新，重新解析: {path}")
+                        entry = None
+            if entry is None:
+                digest = _file_digest(path)
+                entry = [signature, digest, TemplateSkeleton(path)]
+                with self._lock:
+                    self.misses += 1
+                    self._entries[path] = entry
+                    self._entries.move_to_end(path)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            else:
+                with self._lock:
+                    self.hits += 1
+                    if path in self._entries:
+                        self._entries.move_to_end(path)
+            return entry[2]
+
+    def load(self, template_path: str):
+        """取得模板工作簿的独立副本，用法同 load_workbook(template_path)"""
+        if not OPENPYXL_INTERNALS_SUPPORTED:
+            return load_workbook(template_path)
+        return self.skeleton(template_path).clone()
+
+    def preload(self, template_dir: str) -> int:
+        """预先编译目录下所有.xlsx模板，返回成功数量"""
+        if not OPENPYXL_INTERNALS_SUPPORTED:
+            return 0
+        count = 0
+        for name in sorted(os.listdir(template_dir)):
+            if not name.lower().endswith('.xlsx') or name.startswith('~$'):
+                continue
+            try:
+                self.skeleton(os.path.join(template_dir, name))
+                count += 1
+            except Exception as e:
+                logger.warning(f"模板预加载失败: {name}: {e}")
+        return count
+
+    def invalidate(self, template_path: Optional[str] = None):
+        """清除指定模板（None表示全部）的缓存"""
+        with self._lock:
+            if template_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(template_path), None)
+
+
+# 进程内共享的模板缓存
+template_cache = TemplateCache()
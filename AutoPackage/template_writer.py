@@ -3,11 +3,11 @@
 """
 模板写入模块 - 基于openpyxl实现，支持合并单元格
 """
-from openpyxl import load_workbook
 from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
 from openpyxl.utils import get_column_letter
-from copy import copy
 from config import TemplateConfig
+from style_registry import StyleRegistry
+from template_cache import template_cache
 from typing import Dict, List
 
 
@@ -25,6 +25,7 @@ class TemplateWriter:
         self.template_path = template_path
         self.output_path = output_path
         self.workbook = None
+        self.styles = None  # 样式注册表（每个工作簿一个）
         
     def write(self, transformed_data: Dict, is_hanger: bool = False) -> str:
         """
@@ -38,9 +39,11 @@ class TemplateWriter:
             输出文件路径
         """
         try:
-            # 加载模板
+            # 加载模板（从模板缓存取得副本）
             print(f"加载模板: {self.template_path}")
-            self.workbook = load_workbook(self.template_path)
+            self.workbook = template_cache.load(self.template_path)
+            self.styles = StyleRegistry(self.workbook)
+            self._register_styles()
             
             # 重命名模板PT-1页以避免名称冲突
             template_sheet_name = TemplateConfig.PT_TEMPLATE_SHEET
@@ -70,13 +73,42 @@ class TemplateWriter:
         except Exception as e:
             raise Exception(f"写入文件失败: {e}")
     
-    def _update_product_list(self, data: Dict):
-        """更新商品一覧页"""
+    def _register_styles(self):
+        """登记写入时用到的固定样式（每个工作簿只登记一次，之后按引用赋值）"""
+        thin_border = Border(
+            left=Side(style='thin'),
+            right=Side(style='thin'),
+            top=Side(style='thin'),
+            bottom=Side(style='thin')
+        )
+        center = Alignment(horizontal='center', vertical='center')
+        grey_fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
+        common_font = Font(name='ＭＳ Ｐゴシック', size=9)
+        
+        # 统一字体 / 居中
+        self.styles.register('common', font=common_font)
+        self.styles.register('common_center', font=common_font, alignment=center)
+        self.styles.register('center', alignment=center)
+        # 表头SKU列样式（灰色背景），JANCODE行需要换行
+        self.styles.register('header_sku', font=common_font, alignment=center, fill=grey_fill, border=thin_border)
+        self.styles.register('header_jan', font=common_font, fill=grey_fill, border=thin_border,
+                             alignment=Alignment(horizontal='center', vertical='center', wrap_text=True))
+        # SKU数据列样式（白色背景，只有边框）
+        self.styles.register('data_sku', font=common_font, alignment=center,
+                             fill=PatternFill(fill_type=None), border=thin_border)
+        # 合计行样式（灰色背景，加粗，边框）；商品一覧的字号稍微大一点
+        self.styles.register('pt_total', font=Font(name='ＭＳ Ｐゴシック', size=9, bold=True),
+                             alignment=center, fill=grey_fill, border=thin_border)
+        self.styles.register('list_total', font=Font(name='ＭＳ Ｐゴシック', size=10, bold=True),
+                             alignment=center, fill=grey_fill, border=thin_border)
+    
+    def _update_product_list(self, data: Dict, sheet=None):
+        """更新商品一覧页（sheet为None时从工作簿中查找）"""
         try:
-            if TemplateConfig.PRODUCT_LIST_SHEET not in self.workbook.sheetnames:
-                raise Exception("找不到商品一覧sheet")
-            
-            sheet = self.workbook[TemplateConfig.PRODUCT_LIST_SHEET]
+            if sheet is None:
+                if TemplateConfig.PRODUCT_LIST_SHEET not in self.workbook.sheetnames:
+                    raise Exception("找不到商品一覧sheet")
+                sheet = self.workbook[TemplateConfig.PRODUCT_LIST_SHEET]
             
             # 更新管理No
             kanri_no = data.get('metadata', {}).get('kanri_no', '')
@@ -137,19 +169,6 @@ class TemplateWriter:
             # 写入合计行
             total_row_num = last_row_num + 1
             
-            # 定义合计行样式（灰色背景，加粗，边框）
-            total_style = {
-                'font': Font(name='ＭＳ Ｐゴシック', size=10, bold=True), # 稍微大一点
-                'alignment': Alignment(horizontal='center', vertical='center'),
-                'fill': PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid'),
-                'border': Border(
-                    left=Side(style='thin'),
-                    right=Side(style='thin'),
-                    top=Side(style='thin'),
-                    bottom=Side(style='thin')
-                )
-            }
-            
             # 合计行从No列到增产数列
             for col_idx in range(start_col, end_col + 1):
                 cell = sheet.cell(row=total_row_num, column=col_idx + 1)
@@ -163,32 +182,17 @@ class TemplateWriter:
                 else:
                     cell.value = "" # 其他列留空，但应用样式
                 
-                # 应用样式
-                cell.font = total_style['font']
-                cell.alignment = total_style['alignment']
-                cell.fill = total_style['fill']
-                cell.border = total_style['border']
+                # 应用样式（灰色背景，加粗，边框）
+                self.styles.apply(cell, 'list_total')
                 
         except Exception as e:
             print(f"警告: 更新商品一覧页失败: {e}")
     
     def _copy_cell_style(self, sheet, template_row, template_col, target_cell, override_font_name=None, override_font_size=None):
-        """从模板单元格复制样式到目标单元格"""
+        """从模板单元格复制样式到目标单元格（经样式注册表，相同的样式只登记一次）"""
         try:
             template_cell = sheet.cell(row=template_row, column=template_col)
-            if template_cell.font:
-                new_font = copy(template_cell.font)
-                if override_font_name:
-                    new_font.name = override_font_name
-                if override_font_size:
-                    new_font.size = override_font_size
-                target_cell.font = new_font
-            if template_cell.border:
-                target_cell.border = copy(template_cell.border)
-            if template_cell.fill:
-                target_cell.fill = copy(template_cell.fill)
-            if template_cell.alignment:
-                target_cell.alignment = copy(template_cell.alignment)
+            self.styles.copy_from(template_cell, target_cell, override_font_name, override_font_size)
         except:
             pass
     
@@ -208,11 +212,7 @@ class TemplateWriter:
             print(f"创建 {pt_name}...")
             
             # 复制模板sheet
-            if template_sheet:
-                new_sheet = self.workbook.copy_worksheet(template_sheet)
-                new_sheet.title = pt_name
-            else:
-                new_sheet = self.workbook.create_sheet(pt_name)
+            new_sheet = self._new_pt_sheet(pt_name, template_sheet)
             
             # 设置列宽
             # A, B, C, D (1-4) 列宽为 5
@@ -229,11 +229,32 @@ class TemplateWriter:
             # 写入数据
             self._write_pt_data(new_sheet, pt_group, skus, is_hanger)
             
+            self._finish_pt_sheet(new_sheet)
+            
         except Exception as e:
             print(f"警告: 创建PT页 {pt_group.get('pt_name', '?')} 失败: {e}")
             import traceback
             traceback.print_exc()
     
+    def _new_pt_sheet(self, pt_name: str, template_sheet):
+        """新建PT页（复制模板PT-1页）"""
+        if template_sheet:
+            new_sheet = self.workbook.copy_worksheet(template_sheet)
+            new_sheet.title = pt_name
+        else:
+            new_sheet = self.workbook.create_sheet(pt_name)
+        return new_sheet
+    
+    def _finish_pt_sheet(self, sheet):
+        """PT页写入完成（内存工作簿无需处理，流式写入时输出剩余行）"""
+        pass
+    
+    def _write_blank_cells(self, sheet, row: int, columns: List[int], style_name: str):
+        """在 row 行的 columns 列写入只有样式、没有值的单元格"""
+        styles = self.styles
+        for col_num in columns:
+            styles.apply(sheet.cell(row=row, column=col_num), style_name)
+    
     def _write_pt_header(self, sheet, pt_group: Dict, metadata: Dict, skus: List[Dict]):
         """写入PT页表头并实现合并单元格"""
         pt_name = pt_group['pt_name']
@@ -241,58 +262,38 @@ class TemplateWriter:
         kanri_no = metadata.get('kanri_no', '')
         store_date = metadata.get('store_date', metadata.get('delivery_date', ''))
         
-        # 定义样式（用于超出模板列的情况）
-        # 表头SKU列样式（灰色背景）
-        header_sku_style = {
-            'font': Font(name='ＭＳ Ｐゴシック', size=9),
-            'alignment': Alignment(horizontal='center', vertical='center'),
-            'fill': PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid'),
-            'border': Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-        }
-        
-        # 统一字体
-        common_font = Font(name='ＭＳ Ｐゴシック', size=9)
+        # 样式（表头SKU列灰色背景、统一字体）见 _register_styles
+        styles = self.styles
         
         # 行1 (索引0): 管理No区域 - 合并A1:D1
         sheet.merge_cells('A1:D1')
         sheet['A1'].value = "管理No"
-        sheet['A1'].font = common_font
+        styles.apply(sheet['A1'], 'common')
         sheet['E1'].value = kanri_no
-        sheet['E1'].font = common_font
-        sheet['E1'].alignment = Alignment(horizontal='center', vertical='center')
+        styles.apply(sheet['E1'], 'common_center')
         
         # 行1: No.标签 (F1)
         sheet['F1'].value = "Jan"
-        sheet['F1'].font = common_font
+        styles.apply(sheet['F1'], 'common')
         
         # 行1: SKU序号 (从I列开始)
         for idx, sku in enumerate(skus):
             col_letter = get_column_letter(TemplateConfig.PT_SKU_START_COL + 1 + idx)
             cell = sheet[f'{col_letter}1']
             cell.value = str(sku.get('jan_code', ''))
-            # 应用样式
-            cell.font = header_sku_style['font']
-            # JANCODE 需要换行
-            cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            cell.fill = header_sku_style['fill']
-            cell.border = header_sku_style['border']
+            # 应用样式（JANCODE 需要换行）
+            styles.apply(cell, 'header_jan')
         
         # 行2: パターン区域 - 合并A2:D2
         sheet.merge_cells('A2:D2')
         sheet['A2'].value = "パターン"
-        sheet['A2'].font = common_font
+        styles.apply(sheet['A2'], 'common')
         sheet['E2'].value = pt_name
-        sheet['E2'].font = common_font
-        sheet['E2'].alignment = Alignment(horizontal='center', vertical='center')
+        styles.apply(sheet['E2'], 'common_center')
         
         # 行2: 品番标签
         sheet['F2'].value = "品番"
-        sheet['F2'].font = common_font
+        styles.apply(sheet['F2'], 'common')
         
         # 行2: 品番序列
         for idx, sku in enumerate(skus):
@@ -300,22 +301,18 @@ class TemplateWriter:
             cell = sheet[f'{col_letter}2']
             cell.value = str(sku['product_code'])
             # 应用样式
-            cell.font = header_sku_style['font']
-            cell.alignment = header_sku_style['alignment']
-            cell.fill = header_sku_style['fill']
-            cell.border = header_sku_style['border']
+            styles.apply(cell, 'header_sku')
         
         # 行3: 枚数区域 - 合并A3:D3
         sheet.merge_cells('A3:D3')
         sheet['A3'].value = "枚数"
-        sheet['A3'].font = common_font
+        styles.apply(sheet['A3'], 'common')
         sheet['E3'].value = total_qty
-        sheet['E3'].font = common_font
-        sheet['E3'].alignment = Alignment(horizontal='center', vertical='center')
+        styles.apply(sheet['E3'], 'common_center')
         
         # 行3: カラー标签
         sheet['F3'].value = "カラー"
-        sheet['F3'].font = common_font
+        styles.apply(sheet['F3'], 'common')
         
         # 行3: カラー序列
         for idx, sku in enumerate(skus):
@@ -323,22 +320,18 @@ class TemplateWriter:
             cell = sheet[f'{col_letter}3']
             cell.value = str(sku['color'])
             # 应用样式
-            cell.font = header_sku_style['font']
-            cell.alignment = header_sku_style['alignment']
-            cell.fill = header_sku_style['fill']
-            cell.border = header_sku_style['border']
+            styles.apply(cell, 'header_sku')
         
         # 行4: 納期区域 - 合并A4:D4
         sheet.merge_cells('A4:D4')
         sheet['A4'].value = "納期"
-        sheet['A4'].font = common_font
+        styles.apply(sheet['A4'], 'common')
         sheet['E4'].value = store_date
-        sheet['E4'].font = common_font
-        sheet['E4'].alignment = Alignment(horizontal='center', vertical='center')
+        styles.apply(sheet['E4'], 'common_center')
         
         # 行4: サイズ标签
         sheet['F4'].value = "サイズ"
-        sheet['F4'].font = common_font
+        styles.apply(sheet['F4'], 'common')
         
         # 行4: サイズ序列
         for idx, sku in enumerate(skus):
@@ -346,10 +339,7 @@ class TemplateWriter:
             cell = sheet[f'{col_letter}4']
             cell.value = str(sku['size'])
             # 应用样式
-            cell.font = header_sku_style['font']
-            cell.alignment = header_sku_style['alignment']
-            cell.fill = header_sku_style['fill']
-            cell.border = header_sku_style['border']
+            styles.apply(cell, 'header_sku')
         
         # 行5: 数据列表头
         headers = ["No.", "タイプ", "ランク", "コード", "店舗名", "CTN_NO", "パターン", "合計"]
@@ -360,7 +350,7 @@ class TemplateWriter:
             # 假设表头样式由模板决定，这里只写入值。
             # 但用户要求"写入的内容的字体统一"，所以最好也设置一下，或者依赖模板但修改字体名
             # 由于没有_copy_cell_style，这里直接设置
-            cell.font = Font(name='ＭＳ Ｐゴシック', size=9) # 假设表头稍微小一点或者和正文一样
+            styles.apply(cell, 'common') # 假设表头稍微小一点或者和正文一样
         
         # 行5: SKU列的列标题（也需要灰色背景）
         for idx in range(len(skus)):
@@ -370,10 +360,7 @@ class TemplateWriter:
             # 可以留空或写编号
             cell.value = ""
             # 应用灰色背景样式
-            cell.font = header_sku_style['font']
-            cell.alignment = header_sku_style['alignment']
-            cell.fill = header_sku_style['fill']
-            cell.border = header_sku_style['border']
+            styles.apply(cell, 'header_sku')
 
     
     def _write_pt_data(self, sheet, pt_group: Dict, skus: List[Dict], is_hanger: bool):
@@ -382,22 +369,26 @@ class TemplateWriter:
         template_row = 6  # 使用第6行作为样式模板
         pt_name = pt_group['pt_name']
         
-        # 定义SKU数据列样式（白色背景，只有边框）
-        data_sku_style = {
-            'font': Font(name='ＭＳ Ｐゴシック', size=9),
-            'alignment': Alignment(horizontal='center', vertical='center'),
-            'fill': PatternFill(fill_type=None),  # 无背景色（白色）
-            'border': Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-        }
+        # SKU数据列样式（白色背景，只有边框）见 _register_styles
+        styles = self.styles
         
         # 统计总数
         grand_total_qty = 0
         sku_totals = {idx: 0 for idx in range(len(skus))}
+        
+        # 由稀疏配比（列号, 数量）展开该PT的SKU单元格值，组内店铺配比相同，只需计算一次
+        sku_cell_values = [""] * len(skus)
+        sku_ids = pt_group.get('sku_ids', [])
+        sku_qtys = pt_group.get('sku_qtys', [])
+        for sku_idx, qty in zip(sku_ids, sku_qtys):
+            if qty > 0:
+                sku_cell_values[sku_idx] = int(qty)
+        # 有数量的列逐格写入；空数量的列（稀疏配比下占大多数）不写值，只共用边框样式
+        first_sku_col = TemplateConfig.PT_COL_FIRST_SKU + 1
+        filled_sku_cells = [(first_sku_col + sku_idx, value)
+                            for sku_idx, value in enumerate(sku_cell_values) if value != ""]
+        empty_sku_cols = [first_sku_col + sku_idx
+                          for sku_idx, value in enumerate(sku_cell_values) if value == ""]
         last_row_num = TemplateConfig.PT_DATA_START_ROW
         
         for idx, store in enumerate(stores):
@@ -444,7 +435,7 @@ class TemplateWriter:
             cell_g.value = f"{global_seq:04d}" if global_seq else ""
             self._copy_cell_style(sheet, template_row, 7, cell_g, override_font_name='ＭＳ Ｐゴシック', override_font_size=9)
             # 确保G列也是居中对齐
-            cell_g.alignment = Alignment(horizontal='center', vertical='center')
+            styles.apply(cell_g, 'center')
 
             # CTN_NO（黄色背景）
             # 用户要求：当用户勾选【是否为HANGER】时，G列填入箱号的同时，在F列可以直接写入相同的箱号
@@ -465,44 +456,22 @@ class TemplateWriter:
             self._copy_cell_style(sheet, template_row, 8, cell, override_font_name='ＭＳ Ｐゴシック', override_font_size=9)
             
             # SKU数量 - 白色背景，仅边框
-            for sku_idx, sku in enumerate(skus):
-                col_num = TemplateConfig.PT_COL_FIRST_SKU + 1 + sku_idx
-                sku_key = f"{sku['product_code']}_{sku['color']}_{sku['size']}"
-                qty = store['sku_quantities'].get(sku_key, 0)
+            for sku_idx, qty in zip(sku_ids, sku_qtys):
                 sku_totals[sku_idx] += qty
-                
+            
+            for col_num, value in filled_sku_cells:
                 cell = sheet.cell(row=row_num, column=col_num)
-                if qty > 0:
-                    cell.value = int(qty)
-                else:
-                    cell.value = ""
+                cell.value = value
                 
                 # 应用样式：白色背景+ 边框
-                cell.font = data_sku_style['font']
-                cell.alignment = data_sku_style['alignment']
-                cell.fill = data_sku_style['fill']
-                cell.border = data_sku_style['border']
+                styles.apply(cell, 'data_sku')
+            self._write_blank_cells(sheet, row_num, empty_sku_cols, 'data_sku')
         
         # 写入最后一行合计
         total_row_num = last_row_num + 1
         
-        # 定义合计行样式（灰色背景，居中，边框）
-        total_style = {
-            'font': Font(name='ＭＳ Ｐゴシック', size=9, bold=True),
-            'alignment': Alignment(horizontal='center', vertical='center'),
-            'fill': PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid'),
-            'border': Border(
-                left=Side(style='thin'),
-                right=Side(style='thin'),
-                top=Side(style='thin'),
-                bottom=Side(style='thin')
-            )
-        }
-        
         # 写入总合计
         cell = sheet.cell(row=total_row_num, column=TemplateConfig.PT_COL_TOTAL + 1)
         cell.value = grand_total_qty
-        cell.font = total_style['font']
-        cell.alignment = total_style['alignment']
-        cell.fill = total_style['fill']
-        cell.border = total_style['border']
+        # 合计行样式（灰色背景，居中，边框）
+        styles.apply(cell, 'pt_total')
@@ -64,6 +64,14 @@ def build():
         "assortment_generator",
         "store_detail_writer",
         "box_label_generator",
+        "parse_cache",
+        "jan_master",
+        "sku_catalog",
+        "style_registry",
+        "streaming_writer",
+        "template_cache",
+        "package_pipeline",
+        "pt_sheet_parser",
         "config"
     ]
 
@@ -1,3 +1,4 @@
+import multiprocessing
 import os
 import sys
 import webbrowser
@@ -60,4 +61,6 @@ def main():
     uvicorn.run(app, host=host, port=port, log_level="info")
 
 if __name__ == "__main__":
+    # 打包成exe后，子进程（①④/②③箱贴同时生成）启动时在这里直接进入子进程的任务，不再执行main()
+    multiprocessing.freeze_support()
     main()
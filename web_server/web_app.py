@@ -2,6 +2,7 @@ import sys
 import os
 import shutil
 import logging
+import json
 from pathlib import Path
 from datetime import datetime
 from typing import List
@@ -27,7 +28,7 @@ if str(parent_dir) not in sys.path:
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 
@@ -35,12 +36,14 @@ from pydantic import BaseModel
 try:
     from excel_reader import AllocationTableReader, DetailTableReader, BoxSettingReader
     from data_transformer import DataTransformer
-    from template_writer import TemplateWriter
+    from package_pipeline import AllocationPackageWriter, ShipmentPackageWriter, ZipPackage, iter_zip_package
     from delivery_note_generator import DeliveryNoteGenerator
     from assortment_generator import AssortmentGenerator
-    from store_detail_writer import StoreDetailWriter
     from box_label_generator import BoxLabelGenerator
-    from config import FileConfig, DeliveryNoteConfig, AssortmentConfig, StoreDetailConfig, AllocationConfig, BoxLabelConfig
+    from parse_cache import ParseCache
+    from template_cache import template_cache
+    from jan_master import JanMasterStore
+    from config import TemplateConfig, FileConfig, DeliveryNoteConfig, AssortmentConfig, StoreDetailConfig, AllocationConfig, BoxLabelConfig, ParseCacheConfig, JanMasterConfig, PackageConfig
 except ImportError as e:
     print(f"Error importing core modules: {e}")
     print(f"Current sys.path: {sys.path}")
@@ -74,11 +77,25 @@ UPLOAD_DIR = parent_dir / "temp_uploads"
 OUTPUT_DIR = parent_dir / "temp_outputs"
 TEMPLATES_DIR = parent_dir / "templates"
 STORAGE_DIR = parent_dir / "storage" / "uploads"
+PARSE_CACHE_DIR = parent_dir / "storage" / ParseCacheConfig.CACHE_DIR_NAME
 UPLOAD_DIR.mkdir(exist_ok=True)
 OUTPUT_DIR.mkdir(exist_ok=True)
 TEMPLATES_DIR.mkdir(exist_ok=True)
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
 
+# 配分表解析缓存（同一文件重复转换/生成箱贴时跳过解析）
+parse_cache = ParseCache(str(PARSE_CACHE_DIR), max_bytes=ParseCacheConfig.MAX_BYTES)
+
+# JAN主档（上传过的明细表增量合并于此，转换时可不再上传明细表）
+jan_master = JanMasterStore(str(parent_dir / "storage" / JanMasterConfig.DB_NAME),
+                            index_cache_versions=JanMasterConfig.INDEX_CACHE_VERSIONS)
+
+# 启动时预先编译模板库，转换请求不再包含模板解析时间
+@app.on_event("startup")
+def preload_templates():
+    count = template_cache.preload(str(TEMPLATES_DIR))
+    logger.info(f"Preloaded {count} templates from {TEMPLATES_DIR}")
+
 # 挂载静态文件 (前端)
 app.mount("/static", StaticFiles(directory=str(current_dir / "static")), name="static")
 
@@ -91,6 +108,34 @@ def cleanup_file(path: Path):
     except Exception as e:
         logger.error(f"Error cleaning up {path}: {e}")
 
+def write_package_manifest(zip_filename: str, entries) -> Path:
+    """不保留打包文件时记录包含的 [文件名, 包内文件名]，下载时再流式打包；返回清单路径"""
+    manifest_path = OUTPUT_DIR / f"{zip_filename}.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump([list(entry) for entry in entries], f, ensure_ascii=False)
+    return manifest_path
+
+def read_package_manifest(manifest_path: Path):
+    """读取打包清单，返回 [(文件路径, 包内文件名)]（旧清单的条目只有文件名）"""
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        entries = [(name, name) if isinstance(name, str) else tuple(name) for name in json.load(f)]
+    return [(OUTPUT_DIR / name, arcname) for name, arcname in entries]
+
+def remove_package_manifest(record):
+    """删除历史记录的打包清单及清单中的文件（只有不保留打包文件的记录才有清单）"""
+    manifest = (record.stats or {}).get("package_manifest")
+    if not manifest and not record.file_path and record.output_filename:
+        manifest = OUTPUT_DIR / f"{record.output_filename}.json"
+    if not manifest or not os.path.exists(manifest):
+        return
+    try:
+        for path, _ in read_package_manifest(Path(manifest)):
+            if path.exists():
+                os.remove(path)
+        os.remove(manifest)
+    except Exception as e:
+        logger.warning(f"Failed to delete package manifest {manifest}: {e}")
+
 @app.get("/")
 async def read_root():
     return FileResponse(str(current_dir / "static" / "index.html"))
@@ -106,7 +151,8 @@ async def get_settings(db: Session = Depends(get_db)):
     settings = db.query(models.SystemSetting).all()
     # Ensure default settings exist
     defaults = {
-        "delivery_note_prefix": {"value": "42", "description": "受渡伝票NO前缀 (默认42)"}
+        "delivery_note_prefix": {"value": "42", "description": "受渡伝票NO前缀 (默认42)"},
+        "keep_package_history": {"value": "true", "description": "保留打包文件 (false时不保存zip，下载时流式打包)"}
     }
     
     result = {}
@@ -249,6 +295,7 @@ async def delete_history_batch(request: DeleteBatchRequest, db: Session = Depend
             except Exception as e:
                 logger.warning(f"Failed to delete source file {record.source_file_path}: {e}")
 
+        remove_package_manifest(record)
         db.delete(record)
         count += 1
     
@@ -280,7 +327,15 @@ async def preview_history_file(history_id: int, db: Session = Depends(get_db)):
         # if the file has complex headers.
         # But if the file HAS headers, they will be row 0.
         # Let's read with header=None first, then try to detect if row 0 looks like a header.
-        df = pd.read_excel(record.file_path, nrows=20, header=None)
+        if record.file_path.lower().endswith(('.csv', '.tsv')):
+            # 受渡伝票的上传用文本（UTF-8或Shift-JIS）
+            sep = '\t' if record.file_path.lower().endswith('.tsv') else ','
+            try:
+                df = pd.read_csv(record.file_path, sep=sep, nrows=20, header=None, dtype=str, encoding='utf-8-sig')
+            except UnicodeDecodeError:
+                df = pd.read_csv(record.file_path, sep=sep, nrows=20, header=None, dtype=str, encoding='cp932')
+        else:
+            df = pd.read_excel(record.file_path, nrows=20, header=None)
         
         # Replace NaN, inf, -inf with None for valid JSON
         df = df.replace([np.inf, -np.inf], np.nan)
@@ -330,6 +385,7 @@ async def delete_history(history_id: int, db: Session = Depends(get_db)):
             os.remove(record.file_path)
         except Exception as e:
             logger.warning(f"Failed to delete file {record.file_path}: {e}")
+    remove_package_manifest(record)
             
     db.delete(record)
     db.commit()
@@ -438,11 +494,9 @@ async def _run_conversion(
         if not template_path.exists():
              # Fallback to default search if not found? No, explicit request.
              raise HTTPException(status_code=404, detail=f"Template {template_name} not found")
-        # Copy to temp
-        temp_copy = UPLOAD_DIR / f"temp_lib_tpl_{int(datetime.now().timestamp())}_{template_name}"
-        shutil.copy2(template_path, temp_copy)
-        real_template_path = temp_copy
-        template_path = temp_copy
+        # 库模板直接使用（写入器从模板缓存取副本，不会修改模板文件）
+        real_template_path = template_path
+        template_path = None
     else:
         # Search default
         if mode == "delivery_note":
@@ -478,12 +532,6 @@ async def _run_conversion(
     if not real_template_path or not real_template_path.exists():
          raise HTTPException(status_code=400, detail=f"Default template for {mode} not found.")
 
-    # Detail file setup
-    jan_map = {}
-    # If we had a stored detail file, we would use it here.
-    # For now, if mode is allocation and we don't have detail file, we might fail or produce partial results.
-    # Let's assume for now we only support modes that don't strictly require new detail file OR we rely on what's available.
-    
     # Output setup
     prefix = "DeliveryNote_" if mode == "delivery_note" else "Converted_"
     output_filename = f"{prefix}{input_filename}"
@@ -585,15 +633,30 @@ async def _run_conversion(
             except: pass
 
         else:
-            # Allocation
-            if not detail_file_path:
-                 # If we don't have detail file, we can't fully run allocation mode as designed.
-                 # But maybe the user just wants to try? 
-                 # Or maybe we stored detail file?
-                 # For now, let's error if allocation mode is requested in rerun without detail file support.
-                 raise Exception("Rerun for Allocation mode not fully supported yet (requires detail file persistence).")
-            
-            # ... Allocation logic ...
+            # Allocation: 没有保存的明细表时使用JAN主档
+            if detail_file_path:
+                jan_map = DetailTableReader.read_jan_map(str(detail_file_path))
+            elif jan_master.count() > 0:
+                jan_map = jan_master.as_mapping()
+                response_stats["jan_master_version"] = jan_map.version
+            else:
+                raise Exception("Rerun for Allocation mode requires a detail file or a non-empty JAN master.")
+
+            # 重新转换同一源文件：解析结果直接从解析缓存取
+            reader = AllocationTableReader(str(temp_input_path), cache=parse_cache)
+            allocation_data = reader.read()
+            reader.close()
+            response_stats["items_processed"] = len(allocation_data.get('products', []))
+            response_stats["parse_cache_hit"] = reader.cache_hit
+
+            transformer = DataTransformer(allocation_data, jan_map)
+            transform_result = transformer.transform()
+            transformer_logs = getattr(transformer, 'logs', [])
+
+            AllocationPackageWriter(str(real_template_path), str(output_path), prefix=prefix).write(
+                transform_result,
+                pt_parallel=len(transform_result['pt_groups']) >= TemplateConfig.PT_PARALLEL_MIN_SHEETS
+            )
 
         # Success
         response_stats["generated_file"] = output_filename
@@ -623,6 +686,7 @@ async def _run_conversion(
             except: pass
         # Cleanup temp template
         if template_path and template_path.exists() and UPLOAD_DIR in template_path.parents:
+             template_cache.invalidate(str(template_path))
              try: os.remove(template_path)
              except: pass
 
@@ -649,10 +713,10 @@ async def generate_box_labels(
     try:
         # 3. 重新读取和转换数据
         # 假设源文件是配分表格式
-        reader = AllocationTableReader(record.source_file_path)
+        reader = AllocationTableReader(record.source_file_path, cache=parse_cache)
         allocation_data = reader.read()
         
-        transformer = DataTransformer(allocation_data)
+        transformer = DataTransformer(allocation_data, jan_master.as_mapping())
         transform_result = transformer.transform()
         
         # 4. 生成PDF
@@ -751,8 +815,190 @@ async def generate_labels_from_file(
     finally:
         pass
 
+@app.post("/api/full-package")
+async def generate_full_package(
+    file: UploadFile = File(...),
+    week_num: str = Form(None),
+    start_no: str = Form(None),
+    export_format: str = Form(None), # Optional: "csv"/"tsv" for ③受渡伝票 upload text
+    export_encoding: str = Form(None), # Optional: "utf-8" (default) / "shift_jis"
+    db: Session = Depends(get_db)
+):
+    """
+    上传一次工厂返回的箱设定文件，同时生成 ②アソート明細 + ③受渡伝票 + 箱贴PDF 并打包
+    文件只解析一次，三份文件在各自的进程中同时生成，响应中包含各文件的耗时
+    """
+    timestamp = int(datetime.now().timestamp())
+    input_path = UPLOAD_DIR / f"input_{timestamp}_{file.filename}"
+    text_export = export_format in DeliveryNoteConfig.TEXT_EXPORT_DELIMITERS
+    if export_format and not text_export and export_format != "xlsx":
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {export_format}")
+    if text_export and (export_encoding or "utf-8") not in DeliveryNoteConfig.TEXT_EXPORT_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export encoding: {export_encoding}")
+
+    # 默认模板（③输出CSV/TSV时不需要模板）
+    def find_template(name):
+        for base in [source_dir, parent_dir, TEMPLATES_DIR]:
+            if (base / name).exists():
+                return base / name
+        return None
+
+    as_template_path = find_template(AssortmentConfig.TEMPLATE_NAME)
+    dn_template_path = None if text_export else find_template(DeliveryNoteConfig.TEMPLATE_NAME)
+    if not as_template_path:
+        raise HTTPException(status_code=400, detail=f"Default template not found. Expected: {AssortmentConfig.TEMPLATE_NAME}")
+    if not text_export and not dn_template_path:
+        raise HTTPException(status_code=400, detail=f"Default template not found. Expected: {DeliveryNoteConfig.TEMPLATE_NAME}")
+
+    stem = os.path.splitext(file.filename)[0]
+    as_output_path = OUTPUT_DIR / f"Assortment_{timestamp}_{stem}.xlsx"
+    dn_output_path = OUTPUT_DIR / f"DeliveryNote_{timestamp}_{stem}.{export_format if text_export else 'xlsx'}"
+    label_output_path = OUTPUT_DIR / f"BoxLabels_{timestamp}_{stem}.pdf"
+    zip_filename = f"FullPackage_{timestamp}.zip"
+
+    # Save source file to storage
+    source_storage_path = STORAGE_DIR / f"{timestamp}_{file.filename}"
+    with open(source_storage_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    shutil.copyfile(source_storage_path, input_path)
+
+    db_record = models.ConversionHistory(
+        original_filename=file.filename,
+        mode="full_package",
+        status="processing",
+        source_file_path=str(source_storage_path)
+    )
+    db.add(db_record)
+    db.commit()
+    db.refresh(db_record)
+
+    try:
+        logger.info(f"Receiving file: {file.filename}, Mode: full_package")
+        prefix_setting = db.query(models.SystemSetting).filter(models.SystemSetting.key == "delivery_note_prefix").first()
+        prefix = prefix_setting.value if prefix_setting else "42"
+        keep_setting = db.query(models.SystemSetting).filter(models.SystemSetting.key == "keep_package_history").first()
+        keep_package = (keep_setting.value if keep_setting else "true").lower() != "false"
+
+        writer = ShipmentPackageWriter(
+            str(input_path),
+            str(as_template_path), str(as_output_path),
+            str(dn_template_path) if dn_template_path else None, str(dn_output_path),
+            str(label_output_path),
+            prefix=prefix, week_num=week_num or None, start_no=int(start_no) if start_no else None,
+            delivery_note_format=export_format if text_export else "xlsx",
+            delivery_note_encoding=export_encoding or "utf-8"
+        )
+        package = writer.write(
+            package=ZipPackage(str(OUTPUT_DIR / zip_filename)) if keep_package else None,
+            concurrent=True
+        )
+
+        documents = package['documents']
+        logs = list(documents['assortment']['logs'])
+        response_stats = {
+            "generated_file": zip_filename,
+            "parse_seconds": package['parse_seconds'],
+            "total_seconds": package['seconds'],
+            "documents": {
+                name: {"file": doc['arcname'], "seconds": doc['seconds'], **doc['stats']}
+                for name, doc in documents.items()
+            }
+        }
+        for name, doc in documents.items():
+            logs.append(f"{doc['arcname']}: {doc['seconds']}s")
+        logs.append(f"解析 {package['parse_seconds']}s, 合计 {package['seconds']}s")
+
+        output_path = OUTPUT_DIR / zip_filename
+        if not keep_package:
+            # 不保留打包文件：只记录包含的文件，下载时再流式打包
+            manifest_path = write_package_manifest(
+                zip_filename, [(Path(doc['path']).name, doc['arcname']) for doc in documents.values()])
+            response_stats["package_manifest"] = str(manifest_path)
+            output_path = None
+
+        logger.info("Process completed successfully.")
+        db_record.status = "success"
+        db_record.output_filename = zip_filename
+        db_record.file_path = str(output_path) if output_path else None
+        db_record.stats = response_stats
+        db.commit()
+
+        return {
+            "status": "success",
+            "message": "Full package generated",
+            "download_url": f"/api/download/{zip_filename}",
+            "stats": response_stats,
+            "logs": logs
+        }
+
+    except Exception as e:
+        logger.error(f"Full package failed: {str(e)}", exc_info=True)
+        try:
+            db_record.status = "failed"
+            db_record.error_message = str(e)
+            db.commit()
+        except:
+            pass
+        return JSONResponse(
+            status_code=500,
+            content={"status": "error", "message": str(e)}
+        )
+    finally:
+        if input_path.exists():
+            try:
+                os.remove(input_path)
+            except: pass
+
 # --- End History Management APIs ---
 
+# --- JAN Master APIs ---
+@app.get("/api/jan-master")
+async def get_jan_master():
+    """JAN主档概况：当前版本、条数和历史快照"""
+    return {
+        "version": jan_master.current_version(),
+        "total": jan_master.count(),
+        "snapshots": jan_master.snapshots()
+    }
+
+@app.post("/api/jan-master")
+async def merge_jan_master(detail_file: UploadFile = File(...)):
+    """上传明细表，增量合并到JAN主档"""
+    detail_path = UPLOAD_DIR / f"jan_master_{int(datetime.now().timestamp())}_{detail_file.filename}"
+    try:
+        with open(detail_path, "wb") as buffer:
+            shutil.copyfileobj(detail_file.file, buffer)
+        jan_map = DetailTableReader.read_jan_map(str(detail_path))
+        result = jan_master.merge(jan_map, source=detail_file.filename)
+        return {"status": "success", **result}
+    except Exception as e:
+        logger.error(f"Failed to merge JAN master: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        if detail_path.exists():
+            try: os.remove(detail_path)
+            except: pass
+
+@app.get("/api/jan-master/lookup")
+async def lookup_jan_master(product_code: str, color: str, size: str, version: int = None):
+    """按 (品番, カラー, サイズ) 查询JANCODE（可指定版本）"""
+    jan = jan_master.lookup(product_code, color, size, version=version)
+    if jan is None:
+        raise HTTPException(status_code=404, detail="JAN not found")
+    return {"product_code": product_code, "color": color, "size": size, "jan": jan}
+
+# --- Parse Cache APIs ---
+@app.get("/api/cache/stats")
+async def get_parse_cache_stats():
+    """配分表解析缓存统计（命中/未命中/占用字节数）"""
+    return parse_cache.stats()
+
+@app.delete("/api/cache")
+async def clear_parse_cache():
+    """清空配分表解析缓存"""
+    removed = parse_cache.clear()
+    return {"status": "success", "removed": removed}
+
 @app.post("/api/convert")
 async def convert_file(
     file: UploadFile = File(...),
@@ -763,18 +1009,25 @@ async def convert_file(
     week_num: str = Form(None), # Optional: week number for assortment
     start_no: str = Form(None), # Optional: start number for delivery note
     is_hanger: str = Form(None), # Optional: "true" for hanger allocation
+    export_format: str = Form(None), # Optional: "csv"/"tsv" for 受渡伝票 upload text (no Excel template)
+    export_encoding: str = Form(None), # Optional: "utf-8" (default) / "shift_jis" for csv/tsv
     db: Session = Depends(get_db)
 ):
     """
     核心转换接口
     mode: 'allocation' (default) for 配分表转换
-          'delivery_note' for 受渡伝票生成
+          'delivery_note' for 受渡伝票生成（export_format=csv/tsv 时直接输出上传用文本）
     """
     input_path = UPLOAD_DIR / f"input_{int(datetime.now().timestamp())}_{file.filename}"
+    text_export = mode == "delivery_note" and export_format in DeliveryNoteConfig.TEXT_EXPORT_DELIMITERS
+    if export_format and export_format != "xlsx" and export_format not in DeliveryNoteConfig.TEXT_EXPORT_DELIMITERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {export_format}")
+    if text_export and (export_encoding or "utf-8") not in DeliveryNoteConfig.TEXT_EXPORT_ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export encoding: {export_encoding}")
     
-    # Validation for allocation mode
-    if mode == "allocation" and not detail_file:
-         raise HTTPException(status_code=400, detail="请上传明细表 (Detail File is required for allocation mode)")
+    # Validation for allocation mode (JAN主档有数据时可以不上传明细表)
+    if mode == "allocation" and not detail_file and jan_master.count() == 0:
+         raise HTTPException(status_code=400, detail="请上传明细表 (Detail File is required for allocation mode until the JAN master has data)")
 
     # Determine template filename and path
     template_filename = f"template_{int(datetime.now().timestamp())}"
@@ -802,7 +1055,9 @@ async def convert_file(
     # Output filename
     prefix = "DeliveryNote_" if mode == "delivery_note" else "Converted_"
     output_filename = f"{prefix}{file.filename}"
-    if not output_filename.endswith('.xlsx'):
+    if text_export:
+         output_filename = os.path.splitext(output_filename)[0] + f'.{export_format}'
+    elif not output_filename.endswith('.xlsx'):
          output_filename = os.path.splitext(output_filename)[0] + '.xlsx'
          
     output_path = OUTPUT_DIR / output_filename
@@ -861,18 +1116,10 @@ async def convert_file(
         elif template_name:
              # Use library template
              logger.info(f"Using library template: {template_name}")
-             # We should probably copy it to temp to avoid modification if code modifies it
-             # But current code might modify real_template_path variable, not file content in place (except conversion)
-             # Wait, conversion modifies real_template_path if it converts .xls to .xlsx
-             # So we MUST copy it to temp
-             temp_copy = UPLOAD_DIR / f"temp_lib_tpl_{int(datetime.now().timestamp())}_{template_name}"
-             shutil.copy2(template_path, temp_copy)
-             real_template_path = temp_copy
-             # Mark as temporary so we clean it up? 
-             # The finally block cleans 'template_path'. 
-             # Here 'template_path' was set to library path. We shouldn't delete library path.
-             # So we set template_path to temp_copy for cleanup purposes.
-             template_path = temp_copy
+             # 库模板直接使用：写入器从模板缓存取副本，不会修改模板文件；
+             # .xls转换只会改变 real_template_path 指向新的临时文件。
+             # finally 中只清理 UPLOAD_DIR 下的 template_path，库模板不受影响。
+             real_template_path = template_path
         else:
             # Search for default template
             if mode == "delivery_note":
@@ -909,7 +1156,8 @@ async def convert_file(
                     real_template_path = path
                     break
         
-        if not real_template_path or not real_template_path.exists():
+        # CSV/TSV输出不使用模板
+        if not text_export and (not real_template_path or not real_template_path.exists()):
              msg = f"Default template for {mode} not found."
              if mode == "delivery_note":
                  msg += f" Expected: {DeliveryNoteConfig.TEMPLATE_NAME}"
@@ -925,9 +1173,16 @@ async def convert_file(
             try:
                 jan_map = DetailTableReader.read_jan_map(str(detail_path))
                 logger.info(f"Loaded {len(jan_map)} JAN entries from detail file")
+                # 合并到JAN主档，之后的转换可以直接使用
+                merge_result = jan_master.merge(jan_map, source=detail_file.filename)
+                response_stats["jan_master_version"] = merge_result["version"]
             except Exception as e:
                 logger.error(f"Failed to read detail file: {e}")
                 pass
+        elif mode == "allocation":
+            jan_map = jan_master.as_mapping()
+            response_stats["jan_master_version"] = jan_map.version
+            logger.info(f"Using JAN master v{jan_map.version} ({len(jan_map)} entries)")
 
         # 3. 执行核心逻辑
         logger.info("Starting process...")
@@ -983,8 +1238,8 @@ async def convert_file(
 
         elif mode == "delivery_note":
             # Delivery Note Generation
-            # Check template format for writing (must be xlsx)
-            if str(real_template_path).lower().endswith('.xls'):
+            # Check template format for writing (must be xlsx; CSV/TSV output needs no template)
+            if not text_export and str(real_template_path).lower().endswith('.xls'):
                 # Try to convert on the fly or fail
                 # Ideally, we should have a pre-converted .xlsx template
                 # For this task, let's assume we can use a converter or just rename if it's actually valid
@@ -1040,7 +1295,11 @@ async def convert_file(
                             pass
             
             # Prefix already fetched above
-            generator = DeliveryNoteGenerator(str(input_path), str(real_template_path), str(output_path), start_no=int(start_no) if start_no else None, prefix=prefix)
+            generator = DeliveryNoteGenerator(
+                str(input_path), str(real_template_path) if real_template_path else None, str(output_path),
+                start_no=int(start_no) if start_no else None, prefix=prefix,
+                output_format=export_format if text_export else "xlsx", encoding=export_encoding or "utf-8"
+            )
             generator.process()
             # items_processed is hard to get without return, but let's assume success
             items_processed = len(generator.data_rows)
@@ -1072,11 +1331,13 @@ async def convert_file(
         else:
             # Standard Allocation Table Conversion
             # Step A: Read
-            reader = AllocationTableReader(str(input_path))
+            reader = AllocationTableReader(str(input_path), cache=parse_cache)
             allocation_data = reader.read()
+            reader.close()
             items_processed = len(allocation_data.get('products', []))
-            logger.info(f"Read {items_processed} products from allocation table.")
+            logger.info(f"Read {items_processed} products from allocation table (cache hit: {reader.cache_hit}).")
             response_stats["items_processed"] = items_processed
+            response_stats["parse_cache_hit"] = reader.cache_hit
     
             # Step B: Transform
             transformer = DataTransformer(allocation_data, jan_map)
@@ -1093,10 +1354,10 @@ async def convert_file(
                 pt_count = len(pt_groups)
                 store_count = sum(len(g.get("stores", []) or []) for g in pt_groups)
                 box_count = store_count
+                # 同组店铺配比相同，总枚数 = 单店配货数 × 店铺数
                 total_qty = 0
                 for g in pt_groups:
-                    for s in g.get("stores", []) or []:
-                        total_qty += int(s.get("total_qty") or 0)
+                    total_qty += int(g.get("total_qty") or 0) * len(g.get("stores", []) or [])
 
                 response_stats.update(
                     {
@@ -1107,7 +1368,8 @@ async def convert_file(
                         "total_qty": total_qty,
                         "jan_map_count": int(getattr(transformer, "jan_map_count", 0) or 0),
                         "jan_match_success": int(getattr(transformer, "jan_match_success", 0) or 0),
-                        "jan_match_fail": int(getattr(transformer, "jan_match_fail", 0) or 0)
+                        "jan_match_fail": int(getattr(transformer, "jan_match_fail", 0) or 0),
+                        "jan_match_rules": dict(getattr(transformer, "jan_match_rules", {}) or {})
                     }
                 )
 
@@ -1117,61 +1379,76 @@ async def convert_file(
             except Exception as e:
                 logger.warning(f"Failed to compute summary stats: {e}")
             
-            # Step C: Write
-            writer = TemplateWriter(str(real_template_path), str(output_path))
-            writer.write(transform_result, is_hanger=(is_hanger == 'true'))
-            
-            # --- NEW: Step D: Write ④ Store Detail ---
-            try:
-                # Find template for ④
-                sd_template_name = StoreDetailConfig.TEMPLATE_NAME
-                sd_template_path = None
-                for base in [source_dir, parent_dir, TEMPLATES_DIR]:
-                    if (base / sd_template_name).exists():
-                        sd_template_path = base / sd_template_name
-                        break
-                
-                sd_output_path = None
-                if sd_template_path:
-                    sd_filename = f"StoreDetail_{file.filename}"
-                    if not sd_filename.endswith('.xlsx'):
-                        sd_filename = os.path.splitext(sd_filename)[0] + '.xlsx'
-                    sd_output_path = OUTPUT_DIR / sd_filename
-                    
-                    sd_writer = StoreDetailWriter(str(sd_template_path), str(sd_output_path), prefix=prefix)
-                    sd_writer.write(transform_result)
-                    logger.info(f"Generated Store Detail: {sd_output_path}")
-                else:
-                    logger.warning(f"Store Detail template not found: {sd_template_name}")
-                    transformer_logs.append(f"Warning: Store Detail template not found: {sd_template_name}")
-
-                # --- Zip if multiple files ---
-                if sd_output_path and sd_output_path.exists():
-                    # Create zip
-                    zip_filename = f"Package_{int(datetime.now().timestamp())}.zip"
-                    zip_path = OUTPUT_DIR / zip_filename
-                    
-                    import zipfile
-                    with zipfile.ZipFile(zip_path, 'w') as zf:
-                        # Add ① (using simple name)
-                        zf.write(output_path, arcname=output_path.name)
-                        # Add ④
-                        zf.write(sd_output_path, arcname=sd_output_path.name)
-                    
-                    # Update response to point to zip
-                    output_path = zip_path # For download
-                    output_filename = zip_filename
-            except Exception as e:
-                logger.error(f"Error generating Store Detail or Zip: {e}", exc_info=True)
+            # Step C/D: Write ①箱設定 + ④各店铺明细
+            # PT页/店铺页逐行流式写出，内存不随PT数/店铺数增长；PT页较多时各PT页分给多个进程并行渲染
+            # ④在子进程中与①同时生成，两个文件生成完即写入打包文件
+            sd_template_name = StoreDetailConfig.TEMPLATE_NAME
+            sd_template_path = None
+            for base in [source_dir, parent_dir, TEMPLATES_DIR]:
+                if (base / sd_template_name).exists():
+                    sd_template_path = base / sd_template_name
+                    break
+
+            sd_output_path = None
+            if sd_template_path:
+                sd_filename = f"StoreDetail_{file.filename}"
+                if not sd_filename.endswith('.xlsx'):
+                    sd_filename = os.path.splitext(sd_filename)[0] + '.xlsx'
+                sd_output_path = OUTPUT_DIR / sd_filename
+            else:
+                logger.warning(f"Store Detail template not found: {sd_template_name}")
+                transformer_logs.append(f"Warning: Store Detail template not found: {sd_template_name}")
+
+            # 不保留打包文件时不生成zip，只记录包含的文件，下载时再流式打包
+            keep_setting = db.query(models.SystemSetting).filter(models.SystemSetting.key == "keep_package_history").first()
+            keep_package = (keep_setting.value if keep_setting else "true").lower() != "false"
+
+            timestamp = int(datetime.now().timestamp())
+            zip_filename = f"Package_{timestamp}.zip"
+            arcnames = [output_path.name, sd_output_path.name if sd_output_path else None]
+            if not keep_package and sd_output_path:
+                # 不落盘打包时①④只能通过清单下载，文件名加上时间戳，之后同名文件的转换不会覆盖它们
+                output_path = OUTPUT_DIR / f"{timestamp}_{output_path.name}"
+                sd_output_path = OUTPUT_DIR / f"{timestamp}_{sd_output_path.name}"
+                output_filename = output_path.name
+            package_writer = AllocationPackageWriter(
+                str(real_template_path), str(output_path),
+                store_detail_template_path=str(sd_template_path) if sd_template_path else None,
+                store_detail_output_path=str(sd_output_path) if sd_output_path else None,
+                prefix=prefix
+            )
+            package = package_writer.write(
+                transform_result,
+                package=ZipPackage(str(OUTPUT_DIR / zip_filename)) if keep_package and sd_template_path else None,
+                is_hanger=(is_hanger == 'true'),
+                pt_parallel=len(transform_result['pt_groups']) >= TemplateConfig.PT_PARALLEL_MIN_SHEETS,
+                concurrent=True
+            )
+
+            if package['store_detail_error'] is not None:
+                e = package['store_detail_error']
+                logger.error(f"Error generating Store Detail or Zip: {e}", exc_info=e)
                 transformer_logs.append(f"Error generating Store Detail: {e}")
-            
+            elif package['store_detail']:
+                logger.info(f"Generated Store Detail: {sd_output_path}")
+
+            if package['zip']:
+                # Update response to point to zip
+                output_path = OUTPUT_DIR / zip_filename # For download
+                output_filename = zip_filename
+            elif package['store_detail'] and not keep_package:
+                manifest_path = write_package_manifest(
+                    zip_filename, zip([output_path.name, sd_output_path.name], arcnames))
+                response_stats["package_manifest"] = str(manifest_path)
+                output_path = None # 打包文件不落盘，历史记录中没有可预览的文件
+                output_filename = zip_filename
         logger.info("Process completed successfully.")
         response_stats["generated_file"] = output_filename
 
         # Update DB record success
         db_record.status = "success"
         db_record.output_filename = output_filename
-        db_record.file_path = str(output_path)
+        db_record.file_path = str(output_path) if output_path else None
         db_record.stats = response_stats
         db.commit()
 
@@ -1207,10 +1484,11 @@ async def convert_file(
             except: pass
         
         # Only clean up template if it is in UPLOAD_DIR (temp)
-        # We modified logic so that template_path is always a temp copy if we are using it
         if template_path and template_path.exists():
             # Check if it is inside UPLOAD_DIR to be safe
             if UPLOAD_DIR in template_path.parents:
+                 # 上传的模板只用一次，同时移出模板缓存
+                 template_cache.invalidate(str(template_path))
                  try:
                     os.remove(template_path)
                  except: pass
@@ -1224,12 +1502,27 @@ async def convert_file(
 @app.get("/api/download/{filename}")
 async def download_file(filename: str, background_tasks: BackgroundTasks):
     file_path = OUTPUT_DIR / filename
+    manifest_path = OUTPUT_DIR / f"{filename}.json"
+    if not file_path.exists() and file_path.suffix.lower() == ".zip" and manifest_path.exists():
+        # 未保存的打包文件：按清单中的文件边打包边分块输出
+        members = read_package_manifest(manifest_path)
+        if not all(p.exists() for p, _ in members):
+            raise HTTPException(status_code=404, detail="File not found")
+        return StreamingResponse(
+            iter_zip_package([(str(p), arcname) for p, arcname in members], PackageConfig.COMPRESS_LEVEL),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="File not found")
     
     suffix = file_path.suffix.lower()
     if suffix == ".zip":
         media_type = "application/zip"
+    elif suffix == ".csv":
+        media_type = "text/csv"
+    elif suffix == ".tsv":
+        media_type = "text/tab-separated-values"
     else:
         media_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 